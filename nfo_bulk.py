@@ -0,0 +1,10 @@
+# command-line entry point: apply a nfo sync script to a whole tree of NFO files, without Kodi
+# usage: python nfo_bulk.py --help
+import sys
+from resources.lib import headless
+headless.install()
+
+from resources.lib.bulk import main
+
+if __name__ == '__main__':
+    sys.exit(main())
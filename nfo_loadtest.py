@@ -0,0 +1,13 @@
+# command-line entry point: measure the latency of the service under a synthetic stream of notifications, without Kodi
+# usage: python nfo_loadtest.py --help
+import os
+import sys
+import tempfile
+from resources.lib import headless
+work_dir = tempfile.mkdtemp(prefix = 'nfo_loadtest_')
+headless.install(profile = os.path.join(work_dir, 'profile'))
+
+from resources.lib.loadtest import main
+
+if __name__ == '__main__':
+    sys.exit(main(work_dir))
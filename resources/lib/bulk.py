@@ -0,0 +1,151 @@
+from __future__ import unicode_literals
+import argparse
+import codecs
+import difflib
+import multiprocessing
+import os
+import sys
+import time
+
+from resources.lib.helpers import load_nfo, save_file, render_nfo, FileError
+from resources.lib.script import FileScriptHandler, ScriptError
+from resources.lib.rules import load_rules, RulesError
+from resources.lib.nfo.diff import freeze, diff
+
+# bulk processing of a directory tree of NFO files, outside of Kodi
+# the user script is applied to every NFO, using a pool of processes; NFOs are only saved when semantically modified,
+# so that the Kodi service can then pick up the changes incrementally (ImportAllTask only considers modified files)
+
+VIDEO_EXTENSIONS = [ '.mkv', '.mp4', '.avi', '.m4v', '.mov', '.wmv', '.ts', '.m2ts', '.mpg', '.mpeg', '.iso', '.divx', '.ogm', '.webm' ]
+
+# list all NFO files under the given roots
+def find_nfo_files(roots):
+    for root_dir in roots:
+        for dirpath, dirnames, filenames in os.walk(root_dir):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if (filename.lower().endswith('.nfo')):
+                    yield os.path.join(dirpath, filename)
+
+# guess the video file corresponding to a NFO: a file with the same base name and a video extension
+def guess_video_path(nfo_path):
+    base = os.path.splitext(nfo_path)[0]
+    for ext in VIDEO_EXTENSIONS:
+        for candidate in [ base + ext, base + ext.upper() ]:
+            if (os.path.exists(candidate)):
+                return candidate
+    return base
+
+######################
+### worker process ###
+######################
+_worker = {}
+
+def _init_worker(script_path, rules_path, video_type, task_family, dry_run):
+    _worker['script'] = FileScriptHandler(script_path, log_prefix = 'bulk') if (script_path) else None
+    _worker['rules'] = load_rules(rules_path) if (rules_path) else None
+    _worker['video_type'] = video_type
+    _worker['task_family'] = task_family
+    _worker['dry_run'] = dry_run
+
+# process a single NFO file
+# returns a tuple (status, nfo_path, details), status being one of 'modified', 'unchanged', 'skipped', 'error'
+def _process_file(nfo_path):
+    try:
+        (soup, root, raw) = load_nfo(nfo_path, _worker['video_type'])
+    except FileError as e:
+        # typically another kind of NFO (tvshow, episode...)
+        return ('skipped', nfo_path, str(e))
+    try:
+        loaded_state = freeze(root)
+        video_path = guess_video_path(nfo_path)
+        if (_worker['rules']):
+            _worker['rules'].apply(soup, root, video_path)
+        if (_worker['script']):
+            try:
+                _worker['script'].execute(locals_dict = {
+                    'soup': soup,
+                    'root': root,
+                    'video_type': _worker['video_type'],
+                    'video_path': video_path,
+                    'nfo_path': nfo_path,
+                    'video_title': root.title.string if (root.title and root.title.string) else os.path.basename(nfo_path),
+                    'task_family': _worker['task_family'],
+                })
+            except ScriptError as e:
+                return ('error', nfo_path, 'script error: %s: %s' % (e.ex.__class__.__name__, str(e.ex)) if (e.ex) else str(e))
+        stats = diff(loaded_state, freeze(root))
+        if (not stats):
+            return ('unchanged', nfo_path, None)
+        content = render_nfo(root)
+        if (_worker['dry_run']):
+            return ('modified', nfo_path, ''.join(difflib.unified_diff(raw.splitlines(True), content.splitlines(True), nfo_path, nfo_path + ' (new)')))
+        save_file(nfo_path, content)
+        return ('modified', nfo_path, str(stats))
+    except FileError as e:
+        return ('error', nfo_path, str(e))
+    except Exception as e:
+        return ('error', nfo_path, '%s: %s' % (e.__class__.__name__, str(e)))
+    finally:
+        soup.decompose()
+
+############
+### main ###
+############
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description = 'Apply a nfo sync script to a whole tree of NFO files, without Kodi.')
+    parser.add_argument('roots', nargs = '+', metavar = 'DIR', help = 'directories to scan recursively for .nfo files')
+    parser.add_argument('-s', '--script', help = 'user script to apply (same format as the addon setting)')
+    parser.add_argument('-r', '--rules', help = 'tag rules file to apply, before the script if any (same format as the addon setting)')
+    parser.add_argument('-n', '--dry-run', action = 'store_true', help = 'do not save anything, print the diff of modified NFOs instead')
+    parser.add_argument('-j', '--jobs', type = int, default = multiprocessing.cpu_count(), help = 'nb of worker processes (default: nb of CPUs)')
+    parser.add_argument('-t', '--video-type', default = 'movie', help = 'root tag of the NFOs to process (default: movie)')
+    parser.add_argument('--task-family', default = 'import', help = 'value of task_family given to the script (default: import)')
+    parser.add_argument('-q', '--quiet', action = 'store_true', help = 'only print the final report')
+    return parser.parse_args(argv)
+
+def main(argv = None):
+    args = parse_args(argv if (argv is not None) else sys.argv[1:])
+    args.roots = [ root_dir.decode(sys.getfilesystemencoding()) if (isinstance(root_dir, bytes)) else root_dir for root_dir in args.roots ]
+    out = codecs.getwriter('utf-8')(sys.stdout)
+
+    # check the script and rules once, before starting workers
+    if (args.script):
+        try:
+            FileScriptHandler(args.script)
+        except ScriptError as e:
+            out.write('cannot load script \'%s\': %s\n' % (args.script, str(e)))
+            return 2
+    if (args.rules):
+        try:
+            load_rules(args.rules)
+        except RulesError as e:
+            out.write('cannot load rules \'%s\': %s\n' % (args.rules, str(e)))
+            return 2
+
+    counts = { 'modified': 0, 'unchanged': 0, 'skipped': 0, 'error': 0 }
+    start = time.time()
+    pool = multiprocessing.Pool(max(args.jobs, 1), _init_worker, (args.script, args.rules, args.video_type, args.task_family, args.dry_run))
+    try:
+        for status, nfo_path, details in pool.imap_unordered(_process_file, find_nfo_files(args.roots), chunksize = 8):
+            counts[status] += 1
+            if (args.quiet):
+                continue
+            if (status == 'modified'):
+                out.write(details if (args.dry_run) else 'modified: %s (%s)\n' % (nfo_path, details))
+            elif (status == 'error'):
+                out.write('error: %s: %s\n' % (nfo_path, details))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    elapsed = time.time() - start
+    total = sum(counts.values())
+    out.write('%d files in %.1fs (%.1f files/s): %d %s, %d unchanged, %d skipped, %d errors\n' % (
+        total, elapsed, total / elapsed if (elapsed > 0) else 0,
+        counts['modified'], 'to be modified' if (args.dry_run) else 'modified',
+        counts['unchanged'], counts['skipped'], counts['error']))
+    return 1 if (counts['error']) else 0
@@ -0,0 +1,266 @@
+from __future__ import unicode_literals
+import errno
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+# multi-room coordination between several Kodi instances sharing the same NFO files (and library)
+# everything happens in a shared directory, reachable by all instances through the local filesystem (mounted share):
+#   <shared_dir>/instances/<instance_id>.lease: heartbeat of each running instance
+#   <shared_dir>/locks/<md5(nfo_path)>.lock: exclusive lock on a given NFO, held while it is processed
+# each lock file holds a token of its own: the threads of an instance share the instance ID, so a lock file bearing our ID
+# is only ours if we know its token (otherwise, it was left over by a previous run)
+# work is partitioned across live instances by rendezvous hashing of the NFO path, so that every NFO has exactly one owner,
+# and only a few NFOs move from one instance to another when an instance joins or leaves
+# this module intentionally relies on os only (no xbmc), so that it can be exercised by plain processes
+
+class Coordinator(object):
+    LEASE_TTL = 120 # seconds without heartbeat before an instance is considered dead
+    HEARTBEAT_INTERVAL = 30 # seconds between two heartbeats
+    LOCK_TTL = 600 # seconds after which a lock is considered stale (owner crashed while processing)
+    PEERS_CACHE_TTL = 5 # seconds during which the list of live instances is not read again
+
+    def __init__(self, shared_dir, instance_id = None, log = None, lease_ttl = None, lock_ttl = None):
+        self.shared_dir = shared_dir
+        self.instance_id = instance_id or self.new_instance_id()
+        self.log = log
+        self.lease_ttl = lease_ttl or self.LEASE_TTL
+        self.lock_ttl = lock_ttl or self.LOCK_TTL
+        self.instances_dir = os.path.join(shared_dir, 'instances')
+        self.locks_dir = os.path.join(shared_dir, 'locks')
+        for path in [ self.instances_dir, self.locks_dir ]:
+            try:
+                os.makedirs(path)
+            except OSError as e:
+                if (e.errno != errno.EEXIST):
+                    raise
+        self._peers = []
+        self._peers_time = 0
+        self._held = {} # lock file => token, for the locks currently held by this instance
+        self._tokens = set() # tokens of the locks held, or being created, by this instance
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def new_instance_id():
+        return '%s-%s' % (socket.gethostname(), uuid.uuid4().hex[:8])
+
+    @property
+    def lease_path(self):
+        return os.path.join(self.instances_dir, '%s.lease' % self.instance_id)
+
+    def _log(self, msg):
+        if (self.log):
+            self.log.debug(msg)
+
+    ### lifecycle ###
+    # register this instance, and keep its lease alive from a background thread
+    def start(self):
+        self.heartbeat()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target = self._heartbeat_loop, name = 'nfo-sync-heartbeat')
+        self._thread.daemon = True
+        self._thread.start()
+
+    # unregister this instance: release locks and remove the lease, so that peers take over immediately
+    def stop(self):
+        self._stop_event.set()
+        if (self._thread):
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            held = list(self._held)
+            self._held.clear()
+            self._tokens.clear()
+        for lock_path in held:
+            self._remove(lock_path)
+        self._remove(self.lease_path)
+
+    def _heartbeat_loop(self):
+        while (not self._stop_event.wait(self.HEARTBEAT_INTERVAL)):
+            try:
+                self.heartbeat()
+            except (IOError, OSError) as e:
+                self._log('cannot renew lease: %s' % str(e))
+
+    # write (or renew) the lease file of this instance
+    def heartbeat(self):
+        self._write_atomic(self.lease_path, {
+            'id': self.instance_id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'time': time.time(),
+        })
+        self._peers_time = 0 # force reload of peers
+
+    ### partitioning ###
+    # list of live instance IDs (sorted), always including this one
+    def live_instances(self):
+        now = time.time()
+        if (now - self._peers_time < self.PEERS_CACHE_TTL):
+            return self._peers
+        peers = set([ self.instance_id ])
+        for filename in self._listdir(self.instances_dir):
+            if (not filename.endswith('.lease')):
+                continue
+            lease_path = os.path.join(self.instances_dir, filename)
+            lease = self._read(lease_path)
+            if (lease is None):
+                continue
+            age = now - lease.get('time', 0)
+            if (age <= self.lease_ttl):
+                peers.add(lease['id'])
+            elif (age > 2 * self.lease_ttl):
+                # dead for a long time => garbage collect its lease
+                self._log('removing stale lease of instance %s' % lease.get('id'))
+                self._remove(lease_path)
+        self._peers = sorted(peers)
+        self._peers_time = now
+        return self._peers
+
+    # instance in charge of the given path (rendezvous hashing: highest weight wins)
+    def owner(self, path):
+        key = self._encode(path)
+        return max(self.live_instances(), key = lambda instance_id: hashlib.md5(self._encode(instance_id) + b'\0' + key).hexdigest())
+
+    # True if this instance is in charge of the given path
+    def owns(self, path):
+        return (self.owner(path) == self.instance_id)
+
+    ### locking ###
+    def _lock_path(self, path):
+        return os.path.join(self.locks_dir, '%s.lock' % hashlib.md5(self._encode(path)).hexdigest())
+
+    # try to get the exclusive lock on path, waiting up to timeout seconds if it is held by another instance
+    # stale locks (too old, or held by a dead instance) are taken over
+    # returns True if the lock was acquired
+    def acquire(self, path, timeout = 0):
+        lock_path = self._lock_path(path)
+        deadline = time.time() + timeout
+        while (True):
+            # the token is known before the file exists: other threads never take our lock for a leftover
+            token = uuid.uuid4().hex
+            with self._lock:
+                self._tokens.add(token)
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                try:
+                    os.write(fd, json.dumps({ 'id': self.instance_id, 'token': token, 'path': path, 'time': time.time() }).encode('utf-8'))
+                finally:
+                    os.close(fd)
+                with self._lock:
+                    self._held[lock_path] = token
+                return True
+            except OSError as e:
+                with self._lock:
+                    self._tokens.discard(token)
+                if (e.errno != errno.EEXIST):
+                    raise
+            # lock already exists: check if we can take it over
+            if (self._is_stale(lock_path)):
+                self._takeover(lock_path)
+                continue
+            if (time.time() >= deadline):
+                return False
+            time.sleep(0.2)
+
+    def release(self, path):
+        lock_path = self._lock_path(path)
+        with self._lock:
+            if (lock_path not in self._held):
+                return
+            self._tokens.discard(self._held.pop(lock_path))
+        self._remove(lock_path)
+
+    def _is_stale(self, lock_path):
+        lock = self._read(lock_path)
+        if (lock is None):
+            # either just released (retry), or being written right now: only stale if old enough
+            try:
+                return (time.time() - os.stat(lock_path).st_mtime > self.lock_ttl)
+            except OSError:
+                return True
+        if (lock.get('id') == self.instance_id):
+            # held by another thread of this instance, or left over by a previous run of it
+            with self._lock:
+                return (lock.get('token') not in self._tokens)
+        if (time.time() - lock.get('time', 0) > self.lock_ttl):
+            return True
+        self._peers_time = 0 # owner may have died since last check
+        return (lock.get('id') not in self.live_instances())
+
+    # atomically move the stale lock aside: only one instance can succeed in renaming it
+    def _takeover(self, lock_path):
+        aside_path = '%s.%s.stale' % (lock_path, self.instance_id)
+        try:
+            os.rename(lock_path, aside_path)
+        except OSError:
+            return # someone else was quicker, or lock was released in the meantime
+        self._log('took over stale lock: %s' % lock_path)
+        self._remove(aside_path)
+
+    ### file helpers ###
+    @staticmethod
+    def _encode(value):
+        return value.encode('utf-8') if (isinstance(value, type(u''))) else value
+
+    @staticmethod
+    def _listdir(path):
+        try:
+            return os.listdir(path)
+        except OSError:
+            return []
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as fp:
+                return json.loads(fp.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _write_atomic(self, path, data):
+        tmp_path = '%s.%s.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as fp:
+            fp.write(json.dumps(data).encode('utf-8'))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Windows does not allow renaming over an existing file
+            self._remove(path)
+            os.rename(tmp_path, path)
+
+###################################################
+### process-wide coordinator, set by the service ###
+###################################################
+_coordinator = None
+
+# return the running coordinator, or None if multi-room coordination is disabled
+def get_coordinator():
+    return _coordinator
+
+def start_coordinator(shared_dir, instance_id = None, log = None):
+    global _coordinator
+    stop_coordinator()
+    coordinator = Coordinator(shared_dir, instance_id, log = log)
+    coordinator.start()
+    _coordinator = coordinator
+    return coordinator
+
+def stop_coordinator():
+    global _coordinator
+    if (_coordinator):
+        _coordinator.stop()
+        _coordinator = None
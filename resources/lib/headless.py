@@ -0,0 +1,138 @@
+from __future__ import unicode_literals
+import os
+import sys
+import time
+import types
+import xml.etree.ElementTree as ET
+
+# minimal stand-ins for the Kodi modules (xbmc, xbmcaddon, xbmcvfs), backed by the local filesystem
+# they only cover what this addon uses, so that its NFO logic can run outside of Kodi (command-line tools)
+# install() must be called before importing anything from resources.lib; it is a no-op within Kodi
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# log levels, same values as in Kodi 18
+LOGDEBUG, LOGINFO, LOGNOTICE, LOGWARNING, LOGERROR, LOGSEVERE, LOGFATAL, LOGNONE = range(8)
+
+class HeadlessAddon(object):
+    def __init__(self, profile = None, settings = None):
+        manifest = ET.parse(os.path.join(ADDON_DIR, 'addon.xml')).getroot()
+        self.info = {
+            'id': manifest.get('id'),
+            'name': manifest.get('name'),
+            'version': manifest.get('version'),
+            'path': ADDON_DIR,
+            'icon': os.path.join(ADDON_DIR, 'icon.png'),
+            'profile': profile or os.path.join(os.path.expanduser('~'), '.%s' % manifest.get('id')),
+        }
+        # default values from settings.xml, optionally overridden
+        self.settings = {}
+        for elt in ET.parse(os.path.join(ADDON_DIR, 'resources', 'settings.xml')).getroot().iter('setting'):
+            if (elt.get('id')):
+                self.settings[elt.get('id')] = elt.get('default', '')
+        self.settings.update(settings or {})
+        if (not os.path.isdir(self.info['profile'])):
+            os.makedirs(self.info['profile'])
+
+    def getAddonInfo(self, key):
+        return self.info.get(key, '')
+    def getSetting(self, key):
+        return self.settings.get(key, '')
+    def getSettingBool(self, key):
+        return (self.getSetting(key) == 'true')
+    def getSettingInt(self, key):
+        try:
+            return int(self.getSetting(key))
+        except ValueError:
+            return 0
+    def setSetting(self, key, value):
+        self.settings[key] = value
+
+class HeadlessFile(object):
+    def __init__(self, path, mode = 'r'):
+        self.fp = open(path, 'wb' if (mode == 'w') else 'rb')
+    def read(self):
+        return self.fp.read()
+    def write(self, data):
+        self.fp.write(data)
+        return True
+    def close(self):
+        self.fp.close()
+
+class HeadlessStat(object):
+    def __init__(self, path):
+        self.stat = os.stat(path)
+    def st_mtime(self):
+        return int(self.stat.st_mtime)
+    def st_size(self):
+        return self.stat.st_size
+
+def _delete(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+def _listdir(path):
+    dirs, files = [], []
+    for name in os.listdir(path):
+        (dirs if (os.path.isdir(os.path.join(path, name))) else files).append(name)
+    return (dirs, files)
+
+def _translate_path(path):
+    # Kodi returns encoded strings
+    path = os.path.expanduser(path)
+    return path.encode('utf-8') if (isinstance(path, type(''))) else path
+
+log_level = LOGWARNING # messages below this level are discarded
+def _log(msg, level = LOGDEBUG):
+    if (level >= log_level):
+        msg = msg.decode('utf-8') if (isinstance(msg, bytes)) else msg
+        sys.stderr.write(('%s %s\n' % (time.strftime('%H:%M:%S'), msg)).encode('utf-8'))
+
+class _Monitor(object):
+    def abortRequested(self):
+        return False
+    def waitForAbort(self, timeout = None):
+        if (timeout):
+            time.sleep(timeout)
+        return False
+
+class _Player(object):
+    def isPlaying(self):
+        return False
+    def isPlayingVideo(self):
+        return False
+
+def _module(name, **members):
+    module = types.ModuleType(str(name))
+    for k, v in members.items():
+        setattr(module, str(k), v)
+    return module
+
+# register the stand-in modules, unless the real ones are available
+# returns True if the stand-ins were installed
+def install(profile = None, settings = None, level = None):
+    global log_level
+    try:
+        import xbmc
+        return False # running within Kodi
+    except ImportError:
+        pass
+    if (level is not None):
+        log_level = level
+    addon = HeadlessAddon(profile, settings)
+    sys.modules[str('xbmc')] = _module('xbmc',
+        LOGDEBUG = LOGDEBUG, LOGINFO = LOGINFO, LOGNOTICE = LOGNOTICE, LOGWARNING = LOGWARNING, LOGERROR = LOGERROR,
+        LOGSEVERE = LOGSEVERE, LOGFATAL = LOGFATAL, LOGNONE = LOGNONE,
+        log = _log, translatePath = _translate_path, sleep = lambda ms: time.sleep(ms / 1000.0),
+        Monitor = _Monitor, Player = _Player,
+    )
+    sys.modules[str('xbmcaddon')] = _module('xbmcaddon', Addon = lambda id = None: addon)
+    sys.modules[str('xbmcvfs')] = _module('xbmcvfs',
+        exists = os.path.exists, File = HeadlessFile, Stat = HeadlessStat, delete = _delete, listdir = _listdir,
+        mkdirs = lambda path: os.makedirs(path) or True,
+    )
+    sys.modules[str('xbmcgui')] = _module('xbmcgui')
+    return True
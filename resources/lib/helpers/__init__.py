@@ -1,11 +1,14 @@
 from __future__ import unicode_literals
 from datetime import datetime
+import os
 import os.path
 import re
 from bs4 import BeautifulSoup, Tag
 import xbmc
 import xbmcaddon
 import xbmcvfs
+from resources.lib.helpers.io_executor import get_io_executor
+from resources.lib.helpers.resolver import get_nfo_resolver
 
 ### addon shortcuts
 addon = xbmcaddon.Addon()
@@ -50,6 +53,15 @@ def str_to_timestamp(date_string):
 def plural(word, value):
     return '%d %s%s' % (value, word, 's' if (value > 1) else '')
 
+# current resident memory of the process, in bytes
+# returns None if it cannot be determined on this platform (only Linux / Android for the moment)
+def get_memory_usage():
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf(str('SC_PAGE_SIZE'))
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return None
+
 ##########################################################
 ### helper methods: load / save to addon data location ###
 ##########################################################
@@ -65,13 +77,19 @@ class FileError(Error):
         else:
             return '%s' % self.err_msg
 
-# get the nfo file path, given the video one
+# get the nfo file path, given the video one (see resolver.py)
 def get_nfo_path(video_path):
-    return os.path.splitext(video_path)[0] + '.nfo'
+    return get_nfo_resolver().resolve(video_path)
 
 # load data from file
 def load_file(path, dir = ''):
     full_path = os.path.join(dir, path) if dir else path
+    # on network shares, reads are queued per host, so that they can overlap with the ones of other threads
+    executor = get_io_executor()
+    if (executor):
+        return executor.run(full_path, _load_file, path, full_path)
+    return _load_file(path, full_path)
+def _load_file(path, full_path):
     # check if the file already exists
     if (not xbmcvfs.exists(full_path)):
         raise FileError(full_path, 'file does not exist')
@@ -105,9 +123,11 @@ def load_data(path):
 def save_data(path, data):
     save_file(path, data, dir = addon_profile)
 # load soup from nfo file (XML)
-def load_nfo(nfo_path, root_tag):
+# raw content may be given if already loaded
+def load_nfo(nfo_path, root_tag, raw = None):
     # load raw data from file (may throw exceptions)
-    raw = load_file(nfo_path) # already contains the full path
+    if (raw is None):
+        raw = load_file(nfo_path) # already contains the full path
     # load XML tree from file content
     try:
         soup = BeautifulSoup(raw, 'html.parser')
@@ -121,13 +141,18 @@ def load_nfo(nfo_path, root_tag):
     # everything is OK, return
     return (soup, root, raw)
 
+NFO_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# generate the nfo file content from the root tag
+def render_nfo(root):
+    return NFO_HEADER + root.prettify_with_indent()
+
 # save soup tag to nfo file (XML)
 # if old_raw is set, perform a check, and do not save if identical
 # True if content was actually saved, False if save was skipped
 def save_nfo(nfo_path, root, old_raw = None):
     # generate content
-    content = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
-    content = content + root.prettify_with_indent()
+    content = render_nfo(root)
 
     # only save if content has been updated
     # to perform that, we just compare string outputs. Dirty but acceptable, because strictly speaking XML is order-sensitive...
@@ -157,7 +182,10 @@ def prettify_with_indent(self, indent_width = 4, single_lines = True, encoding=N
     #             tag.attrs[attr] = " ".join(
     #                 tag.attrs[attr].replace("\n", " ").split())
     # get prettify() before applying modifications
-    output = self.prettify(encoding, formatter)
+    return reindent(self.prettify(encoding, formatter), indent_width, single_lines)
+
+# post-process the output of prettify(): one-line leaf nodes, and wider indentation
+def reindent(output, indent_width = 4, single_lines = True):
     # compact nodes
     if single_lines:
         r = re.compile('>\n\s+([^<>\s].*?)\n\s+</', re.DOTALL)
@@ -0,0 +1,192 @@
+from __future__ import unicode_literals
+import re
+import threading
+import time
+from collections import deque
+from Queue import Queue
+
+# concurrent file I/O, throttled per host
+# on network shares, each xbmcvfs call (exists, Stat, File read) costs at least a full round-trip: issuing several of them
+# at once hides most of the latency; operations are queued per host (smb://host, nfs://host, ... or 'local'), each host
+# being served by its own small pool of threads, so that a slow NAS neither gets flooded nor delays the other ones
+
+_STOP = object() # stop marker, see _HostLane.stop()
+
+HOST_REGEX = re.compile(r'^([a-z0-9]+)://(?:[^@/]*@)?([^/:]*)', re.IGNORECASE)
+
+# key of the host serving the given path: e.g. 'smb://nas' for 'smb://user@nas/movies/a.nfo', or 'local'
+def host_of(path):
+    match = HOST_REGEX.match(path)
+    if (not match or match.group(1).lower() == 'special'):
+        return 'local'
+    return '%s://%s' % (match.group(1).lower(), match.group(2).lower())
+
+# result of an asynchronous operation
+class Future(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.exception = None
+
+    def set_result(self, value):
+        self.value = value
+        self.event.set()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    # wait for the operation to finish; re-raises its exception, if any
+    def result(self, timeout = None):
+        if (not self.event.wait(timeout)):
+            raise RuntimeError('operation timed out')
+        if (self.exception is not None):
+            raise self.exception
+        return self.value
+
+class HostStats(object):
+    def __init__(self):
+        self.nb_ops = 0
+        self.nb_errors = 0
+        self.total_latency = 0.0 # time spent running operations, in seconds
+        self.max_latency = 0.0
+        self.total_wait = 0.0 # time spent queued, in seconds
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def __str__(self):
+        return '%d ops (%d errors), latency avg %dms / max %dms, queue wait avg %dms, max queue depth %d' % (
+            self.nb_ops, self.nb_errors, 1000 * self.total_latency / self.nb_ops if (self.nb_ops) else 0, 1000 * self.max_latency,
+            1000 * self.total_wait / self.nb_ops if (self.nb_ops) else 0, self.max_queue_depth)
+
+class _HostLane(object):
+    def __init__(self, executor, host, nb_threads):
+        self.executor = executor
+        self.host = host
+        self.queue = Queue()
+        self.stats = HostStats()
+        self.threads = []
+        for n in range(nb_threads):
+            t = threading.Thread(target = self._work, name = 'io-%s-%d' % (host, n))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, func, args):
+        future = Future()
+        with self.executor.lock:
+            self.stats.queue_depth += 1
+            self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queue_depth)
+        self.queue.put((future, func, args, time.time()))
+        return future
+
+    # make the threads exit, once the operations already queued are done
+    def stop(self):
+        for t in self.threads:
+            self.queue.put(_STOP)
+
+    def join(self, timeout = None):
+        for t in self.threads:
+            t.join(timeout)
+
+    def _work(self):
+        _local.in_executor = True
+        while (True):
+            operation = self.queue.get()
+            if (operation is _STOP):
+                return
+            (future, func, args, queued_at) = operation
+            start = time.time()
+            try:
+                future.set_result(func(*args))
+                error = False
+            except Exception as e:
+                future.set_exception(e)
+                error = True
+            latency = time.time() - start
+            with self.executor.lock:
+                stats = self.stats
+                stats.queue_depth -= 1
+                stats.nb_ops += 1
+                stats.nb_errors += int(error)
+                stats.total_latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+                stats.total_wait += start - queued_at
+
+_local = threading.local()
+
+class IOExecutor(object):
+    def __init__(self, threads_per_host = 4):
+        self.threads_per_host = threads_per_host
+        self.lanes = {}
+        self.lock = threading.Lock()
+
+    def _lane(self, host):
+        with self.lock:
+            lane = self.lanes.get(host)
+            if (lane is None):
+                lane = self.lanes[host] = _HostLane(self, host, self.threads_per_host)
+            return lane
+
+    # run func(*args) on the threads of the host serving path; returns a Future
+    def submit(self, path, func, *args):
+        return self._lane(host_of(path)).submit(func, args)
+
+    # run func(*args) on the threads of the host serving path, and wait for the result
+    # operations issued from an executor thread run inline, so that they cannot deadlock waiting for their own lane
+    def run(self, path, func, *args):
+        if (getattr(_local, 'in_executor', False)):
+            return func(*args)
+        return self.submit(path, func, *args).result()
+
+    # apply func(item) to all items, with up to window operations in flight, and yield (item, future) in the order of items
+    # get_path(item) gives the path each operation works on, hence the host it is queued to
+    def imap(self, items, get_path, func, window = 16):
+        pending = deque()
+        for item in items:
+            pending.append((item, self.submit(get_path(item), func, item)))
+            if (len(pending) >= window):
+                (item, future) = pending.popleft()
+                future.event.wait()
+                yield (item, future)
+        while (pending):
+            (item, future) = pending.popleft()
+            future.event.wait()
+            yield (item, future)
+
+    def get_stats(self):
+        with self.lock:
+            return dict((host, str(lane.stats)) for host, lane in self.lanes.items())
+
+    # stop the threads of all hosts, once the operations already queued are done
+    def shutdown(self, timeout = None):
+        with self.lock:
+            lanes = list(self.lanes.values())
+            self.lanes = {}
+        for lane in lanes:
+            lane.stop()
+        for lane in lanes:
+            lane.join(timeout)
+
+_io_executor = None
+_io_executor_lock = threading.Lock()
+
+# get the process-wide I/O executor, or None if disabled (setting debug.io.threads_per_host)
+def get_io_executor():
+    global _io_executor
+    with _io_executor_lock:
+        if (_io_executor is None):
+            from resources.lib.helpers import addon # not at module level: helpers imports this module
+            threads_per_host = addon.getSettingInt('debug.io.threads_per_host')
+            _io_executor = IOExecutor(threads_per_host) if (threads_per_host > 0) else False
+        return _io_executor or None
+
+def stop_io_executor():
+    global _io_executor
+    with _io_executor_lock:
+        if (_io_executor):
+            _io_executor.shutdown(timeout = 5)
+        _io_executor = None
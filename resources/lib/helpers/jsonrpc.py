@@ -1,11 +1,11 @@
-import xbmc
 import json
 from resources.lib.helpers import addon_name, addon_icon, Error
 from resources.lib.helpers.log import log
+from resources.lib.helpers.transport import get_transport, TransportError
 
 ### JSON-RPC related helpers
 class JSONRPCError(Error):
-    def __init__(self, method, err_msg, command, ex):
+    def __init__(self, method, err_msg, command, ex = None):
         super(self.__class__, self).__init__('error executing %s: %s - command was: %s' % (method, str(err_msg), str(command)), ex)
         self.method = method
         self.command = command
@@ -21,9 +21,12 @@ def exec_jsonrpc(method, id='unknown', **kwargs):
     if kwargs:
         command['params'] = kwargs
 
-    # perfom the actual JSON-RPC call
+    # perfom the actual JSON-RPC call, through the configured transport (in-process by default)
     log.debug('JSON-RPC > executing: %s' % method)
-    response = json.loads(xbmc.executeJSONRPC(json.dumps(command)))
+    try:
+        response = get_transport().call(command)
+    except TransportError as e:
+        raise JSONRPCError(method, e, command, e.ex)
 
     if response:
         if 'error' in response:
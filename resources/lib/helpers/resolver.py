@@ -0,0 +1,134 @@
+from __future__ import unicode_literals
+import re
+import threading
+import time
+from collections import OrderedDict
+import xbmcvfs
+
+# resolution of the nfo file of a video, following the naming schemes supported by Kodi
+# - regular file: <video>.nfo
+# - DVD folder (.../VIDEO_TS/VIDEO_TS.IFO): movie.nfo in the movie folder, or VIDEO_TS/VIDEO_TS.nfo
+# - Blu-ray folder (.../BDMV/index.bdmv): movie.nfo in the movie folder, or BDMV/index.nfo
+# - stacked files (stack://.../movie-cd1.avi , .../movie-cd2.avi): movie.nfo (the stack title), or movie-cd1.nfo
+# the first existing candidate wins; if there is none, the first candidate is where a new nfo gets saved
+# a movie.nfo next to regular or stacked files is only looked for if each movie has its own folder (setting
+# movies.general.movie_nfo, like the 'movies are in separate folders' option of Kodi sources): in a flat folder, it
+# would be taken as the nfo of every movie; it is never where a new nfo gets saved
+# checking each candidate would cost a round-trip per name on network shares, so candidates are looked up in a listing
+# of their folder instead, cached and validated by the mtime of the folder (a single stat call)
+
+STACK_PREFIX = 'stack://'
+STACK_SEPARATOR = ' , '
+# same as Kodi's default moviestacking expression: title, stack part (cd1, part 2...), rest of the name, extension
+STACK_REGEX = re.compile(r'^(.*?)([ _.-]*(?:cd|dvd|p(?:ar)?t|dis[ck])[ _.-]*[0-9]+)(.*?)(\.[^.]+)$', re.IGNORECASE)
+
+# (folder, file name) of a path; works with both local paths and vfs URLs (smb://...)
+def split_path(path):
+    pos = max(path.rfind('/'), path.rfind('\\')) + 1
+    return (path[:pos], path[pos:])
+
+def strip_extension(name):
+    pos = name.rfind('.')
+    return name[:pos] if (pos > 0) else name
+
+# paths of the files of a stack
+def split_stack(video_path):
+    return [ part.replace(',,', ',') for part in video_path[len(STACK_PREFIX):].split(STACK_SEPARATOR) ]
+
+# candidate nfo paths for a video, as (folder, file name), by order of preference
+# movie_nfo: whether each movie has its own folder, where movie.nfo may be used (see above)
+def get_nfo_candidates(video_path, movie_nfo = False):
+    if (video_path.startswith(STACK_PREFIX)):
+        first = split_stack(video_path)[0]
+        (folder, name) = split_path(first)
+        candidates = []
+        match = STACK_REGEX.match(name)
+        if (match):
+            candidates.append((folder, match.group(1) + match.group(3) + '.nfo'))
+        candidates.append((folder, strip_extension(name) + '.nfo'))
+    else:
+        (folder, name) = split_path(video_path)
+        lower_name = name.lower()
+        if (lower_name == 'video_ts.ifo' or lower_name == 'index.bdmv'):
+            movie_folder = split_path(folder.rstrip('/\\'))[0]
+            return [ (movie_folder, 'movie.nfo'), (folder, strip_extension(name) + '.nfo') ]
+        candidates = [ (folder, strip_extension(name) + '.nfo') ]
+    if (movie_nfo):
+        candidates.append((folder, 'movie.nfo'))
+    return candidates
+
+class NFOResolver(object):
+    def __init__(self, max_folders = 1024, movie_nfo = False):
+        self.max_folders = max_folders # nb of folder listings kept
+        self.movie_nfo = movie_nfo # see get_nfo_candidates()
+        self.listings = OrderedDict() # folder => (mtime, listed_at, set of file names); most recently used last
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # names of the files in a folder, or None if it cannot be listed
+    def list_folder(self, folder):
+        try:
+            mtime = xbmcvfs.Stat(folder).st_mtime()
+        except Exception:
+            mtime = 0
+        if (not mtime):
+            return None # no way to tell whether a listing is still valid
+        with self.lock:
+            listing = self.listings.get(folder)
+            # a listing made within the same second as the last change of the folder may have missed part of it
+            if (listing and listing[0] == mtime and listing[1] > mtime + 1):
+                self.listings[folder] = self.listings.pop(folder) # move to end
+                self.hits += 1
+                return listing[2]
+            self.misses += 1
+        listed_at = time.time()
+        try:
+            names = frozenset(name.decode('utf-8') if (isinstance(name, bytes)) else name for name in xbmcvfs.listdir(folder)[1])
+        except Exception:
+            return None
+        with self.lock:
+            self.listings.pop(folder, None)
+            self.listings[folder] = (mtime, listed_at, names)
+            while (len(self.listings) > self.max_folders):
+                self.listings.popitem(last = False)
+        return names
+
+    # path of the existing nfo file of a video, or None if there is none
+    def find(self, video_path):
+        for folder, name in get_nfo_candidates(video_path, self.movie_nfo):
+            names = self.list_folder(folder)
+            if ((name in names) if (names is not None) else xbmcvfs.exists(folder + name)):
+                return folder + name
+        return None
+
+    # path of the nfo file of a video: the existing one, else where a new one should be saved
+    def resolve(self, video_path):
+        found = self.find(video_path)
+        if (found):
+            return found
+        (folder, name) = get_nfo_candidates(video_path, self.movie_nfo)[0]
+        return folder + name
+
+    def get_stats(self):
+        with self.lock:
+            return { 'folders': len(self.listings), 'hits': self.hits, 'misses': self.misses }
+
+# without cache: each candidate is checked on its own
+class UncachedNFOResolver(NFOResolver):
+    def list_folder(self, folder):
+        return None
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+# get the process-wide nfo resolver; folder listings are not cached if disabled (setting debug.nfo.listing_cache)
+def get_nfo_resolver():
+    global _resolver
+    with _resolver_lock:
+        if (_resolver is None):
+            from resources.lib.helpers import addon # not at module level: helpers imports this module
+            max_folders = addon.getSettingInt('debug.nfo.listing_cache')
+            movie_nfo = addon.getSettingBool('movies.general.movie_nfo')
+            _resolver = NFOResolver(max_folders, movie_nfo) if (max_folders > 0) else UncachedNFOResolver(movie_nfo = movie_nfo)
+        return _resolver
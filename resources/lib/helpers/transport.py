@@ -0,0 +1,245 @@
+from __future__ import unicode_literals
+from abc import ABCMeta, abstractmethod
+import codecs
+import itertools
+import json
+import socket
+import threading
+from resources.lib.helpers import Error
+
+# JSON-RPC transports: how commands reach Kodi
+#   - InProcessTransport: xbmc.executeJSONRPC(), only available inside the Kodi interpreter
+#   - TCPTransport: Kodi's JSON-RPC TCP server (port 9090 by default, see Settings > Services > Control),
+#     usable from any host, with a pool of persistent connections
+# a transport takes a command (dict) and returns the response (dict), raising TransportError if the call could not complete
+
+class TransportError(Error):
+    pass
+class TransportTimeoutError(TransportError):
+    pass
+
+class Transport(object):
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def call(self, command, timeout = None):
+        """Send the command, and wait for its response."""
+
+    # send several commands at once, and return their responses (in the same order)
+    def call_many(self, commands, timeout = None):
+        return [ self.call(command, timeout) for command in commands ]
+
+    def close(self):
+        pass
+
+class InProcessTransport(Transport):
+    def __init__(self):
+        import xbmc # only available within Kodi
+        self.xbmc = xbmc
+
+    def call(self, command, timeout = None):
+        return json.loads(self.xbmc.executeJSONRPC(json.dumps(command)))
+
+###########################################
+### TCP transport, with connection pool ###
+###########################################
+
+# a call sent on a connection, waiting for its response
+class _PendingCall(object):
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+    def set_response(self, response):
+        self.response = response
+        self.event.set()
+
+    def set_error(self, error):
+        self.error = error
+        self.event.set()
+
+# a single TCP connection to Kodi
+# requests are pipelined: several of them may be in flight at the same time, and responses are dispatched by id
+# from a reader thread, in whatever order Kodi sends them
+class _Connection(object):
+    RECV_SIZE = 65536
+
+    def __init__(self, host, port, connect_timeout, on_notification = None):
+        self.sock = socket.create_connection((host, port), connect_timeout)
+        self.sock.settimeout(None) # reads are blocking, timeouts are handled per call
+        self.on_notification = on_notification
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.alive = True
+        self.reader = threading.Thread(target = self._read_loop, name = 'jsonrpc-tcp-reader')
+        self.reader.daemon = True
+        self.reader.start()
+
+    def send(self, command):
+        call = _PendingCall(command['id'])
+        with self.lock:
+            if (not self.alive):
+                raise TransportError('connection closed')
+            self.pending[call.request_id] = call
+        try:
+            with self.write_lock:
+                self.sock.sendall(json.dumps(command).encode('utf-8'))
+        except (socket.error, IOError) as e:
+            self.close(TransportError('connection lost while sending', e))
+            raise TransportError('connection lost while sending', e)
+        return call
+
+    # give up waiting for a call (on timeout)
+    def forget(self, call):
+        with self.lock:
+            self.pending.pop(call.request_id, None)
+
+    def close(self, error = None):
+        with self.lock:
+            if (not self.alive):
+                return
+            self.alive = False
+            pending = self.pending.values()
+            self.pending = {}
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, IOError):
+            pass
+        self.sock.close()
+        # fail all calls still in flight
+        for call in pending:
+            call.set_error(error or TransportError('connection closed'))
+
+    # Kodi does not delimit messages: JSON objects are simply sent back to back
+    def _read_loop(self):
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder('utf-8')('replace') # a character may be split between two chunks
+        buf = ''
+        error = None
+        try:
+            while (True):
+                chunk = self.sock.recv(self.RECV_SIZE)
+                if (not chunk):
+                    error = TransportError('connection closed by peer')
+                    break
+                buf += utf8.decode(chunk)
+                while (True):
+                    buf = buf.lstrip()
+                    if (not buf):
+                        break
+                    try:
+                        message, end = decoder.raw_decode(buf)
+                    except ValueError:
+                        break # incomplete message, wait for more data
+                    buf = buf[end:]
+                    self._dispatch(message)
+        except (socket.error, IOError) as e:
+            error = TransportError('connection lost while reading', e)
+        self.close(error)
+
+    def _dispatch(self, message):
+        if (isinstance(message, dict) and 'id' in message):
+            with self.lock:
+                call = self.pending.pop(message['id'], None)
+            if (call):
+                call.set_response(message)
+        elif (self.on_notification):
+            # no id: this is a notification (e.g. VideoLibrary.OnUpdate)
+            self.on_notification(message)
+
+class TCPTransport(Transport):
+    DEFAULT_PORT = 9090
+
+    def __init__(self, host, port = DEFAULT_PORT, pool_size = 2, timeout = 30, connect_timeout = 5, on_notification = None):
+        self.host = host
+        self.port = port
+        self.pool_size = max(pool_size, 1)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.on_notification = on_notification
+        self.connections = [ None ] * self.pool_size
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.round_robin = itertools.count()
+
+    # get an alive connection from the pool, (re)connecting if needed
+    # slots are used in turn, unless a specific one is given
+    def _get_connection(self, slot = None):
+        with self.lock:
+            if (slot is None):
+                slot = next(self.round_robin) % self.pool_size
+            conn = self.connections[slot]
+            if (conn is None or not conn.alive):
+                try:
+                    conn = _Connection(self.host, self.port, self.connect_timeout, self.on_notification)
+                except (socket.error, IOError) as e:
+                    raise TransportError('cannot connect to %s:%d' % (self.host, self.port), e)
+                self.connections[slot] = conn
+            return (slot, conn)
+
+    # send a command without waiting for its response
+    # returns a handle to be given to wait()
+    def send(self, command):
+        with self.lock:
+            request_id = next(self.ids)
+        # use our own ids on the wire, so that calls from different callers cannot collide
+        wire_command = dict(command)
+        wire_command['id'] = request_id
+        (slot, conn) = self._get_connection()
+        try:
+            return (conn, conn.send(wire_command), command.get('id'))
+        except TransportError:
+            # connection was dead (and is now closed): reconnect once on the same slot
+            (slot, conn) = self._get_connection(slot)
+            return (conn, conn.send(wire_command), command.get('id'))
+
+    def wait(self, handle, timeout = None):
+        conn, call, caller_id = handle
+        timeout = timeout or self.timeout
+        if (not call.event.wait(timeout)):
+            conn.forget(call)
+            raise TransportTimeoutError('no response after %ds' % timeout)
+        if (call.error):
+            raise call.error
+        response = call.response
+        response['id'] = caller_id
+        return response
+
+    def call(self, command, timeout = None):
+        return self.wait(self.send(command), timeout)
+
+    # pipelined: all commands are sent before waiting for the first response
+    def call_many(self, commands, timeout = None):
+        handles = [ self.send(command) for command in commands ]
+        return [ self.wait(handle, timeout) for handle in handles ]
+
+    def close(self):
+        with self.lock:
+            connections = self.connections
+            self.connections = [ None ] * self.pool_size
+        for conn in connections:
+            if (conn):
+                conn.close()
+
+#####################################################
+### process-wide transport, in-process by default ###
+#####################################################
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    global _transport
+    with _transport_lock:
+        if (_transport is None):
+            _transport = InProcessTransport()
+        return _transport
+
+def set_transport(transport):
+    global _transport
+    with _transport_lock:
+        old, _transport = _transport, transport
+    if (old and old is not transport):
+        old.close()
@@ -0,0 +1,88 @@
+from __future__ import unicode_literals
+import json
+import os
+import threading
+import time
+from resources.lib.helpers import addon, addon_profile
+from resources.lib.helpers.log import Logger
+
+# journal of task results
+# a task over a whole library may report as many errors as there are videos (e.g. the share went offline mid-import):
+# instead of keeping them all in memory until the end of the task, and dumping them to the log at once, every error,
+# warning and modified nfo is appended to a JSON lines file as it happens; the task result only keeps counters and a few
+# samples (see TaskResult)
+# the file is rotated by size: task_journal.jsonl, then task_journal.jsonl.1 (older), ... up to BACKUPS files
+
+JOURNAL_FILE = 'task_journal.jsonl'
+
+class ResultJournal(object):
+    BACKUPS = 3
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size # in bytes, per file
+        self.lock = threading.Lock()
+        self.log = Logger(self.__class__.__name__)
+        self.fp = None
+        self.size = 0
+        self.failed = False # stop trying after an I/O error, not to flood the log
+
+    # append a record: kind is 'error', 'warning' or 'modified'
+    def write(self, source, kind, path, message = None):
+        record = { 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'task': source, 'kind': kind, 'path': path }
+        if (message is not None):
+            record['message'] = message
+        line = (json.dumps(record, ensure_ascii = False) + '\n').encode('utf-8')
+        with self.lock:
+            if (self.failed):
+                return
+            try:
+                if (self.fp is None):
+                    self.fp = open(self.path, 'ab')
+                    self.size = self.fp.tell()
+                if (self.size and self.size + len(line) > self.max_size):
+                    self._rotate()
+                self.fp.write(line)
+                self.size += len(line)
+            except (IOError, OSError) as e:
+                self.failed = True
+                self.log.warning('cannot write to task journal \'%s\': %s' % (self.path, str(e)))
+
+    def _rotate(self):
+        self.fp.close()
+        self.fp = None
+        if (os.path.exists('%s.%d' % (self.path, self.BACKUPS))):
+            os.remove('%s.%d' % (self.path, self.BACKUPS))
+        for n in range(self.BACKUPS - 1, 0, -1):
+            if (os.path.exists('%s.%d' % (self.path, n))):
+                os.rename('%s.%d' % (self.path, n), '%s.%d' % (self.path, n + 1))
+        os.rename(self.path, '%s.1' % self.path)
+        self.fp = open(self.path, 'ab')
+        self.size = 0
+
+    # make the records written so far visible to readers
+    def flush(self):
+        with self.lock:
+            if (self.fp is not None):
+                try:
+                    self.fp.flush()
+                except (IOError, OSError):
+                    pass
+
+    def close(self):
+        with self.lock:
+            if (self.fp is not None):
+                self.fp.close()
+                self.fp = None
+
+_journal = None
+_journal_lock = threading.Lock()
+
+# get the process-wide task journal, or None if disabled (setting debug.journal.max_size)
+def get_result_journal():
+    global _journal
+    with _journal_lock:
+        if (_journal is None):
+            max_size = addon.getSettingInt('debug.journal.max_size') * 1024 * 1024 # setting in MB
+            _journal = ResultJournal(os.path.join(addon_profile, JOURNAL_FILE), max_size) if (max_size > 0) else False
+        return _journal or None
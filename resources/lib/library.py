@@ -1,4 +1,5 @@
 from resources.lib.helpers import Error
+from resources.lib.helpers.resolver import split_path, split_stack, STACK_PREFIX
 from resources.lib.helpers.jsonrpc import exec_jsonrpc, JSONRPCError
 
 # define all the possible JSON-RPC methods, for each and every video type
@@ -11,6 +12,9 @@ JSONRPC_METHODS = {
         'details': {
             'method': 'VideoLibrary.GetMovieDetails', # JSON-RPC method
             'result_key': 'moviedetails' # JSON data field to extract
+        },
+        'set': {
+            'method': 'VideoLibrary.SetMovieDetails', # JSON-RPC method
         }
     },
     'set': {
@@ -35,6 +39,51 @@ def get_list(video_type, **kwargs):
     except JSONRPCError as e:
         raise LibraryError('Kodi JSON-RPC error: %s' % str(e), e)
 
+# iterate over all entries from the library for the given video_type, fetching them page by page
+# only one page is held in memory at a time
+# pages are fetched by offset: entries must not be removed or added meanwhile (e.g. refreshed), or some would be skipped
+def iter_list(video_type, page_size = 500, **kwargs):
+    start = 0
+    while (True):
+        kwargs['limits'] = { 'start': start, 'end': start + page_size }
+        try:
+            method = JSONRPC_METHODS[video_type]['list']['method']
+            result_key = JSONRPC_METHODS[video_type]['list']['result_key']
+            result = exec_jsonrpc(method, **kwargs)
+        except KeyError as e:
+            raise LibraryError('cannot retrieve list of %ss: invalid key for BaseTask.JSONRPC_METHODS' % video_type, e)
+        except JSONRPCError as e:
+            raise LibraryError('Kodi JSON-RPC error: %s' % str(e), e)
+        # the result key is missing when there is no entry at all
+        entries = result.get(result_key, []) if (result) else []
+        for entry in entries:
+            yield entry
+        start += len(entries)
+        total = result['limits']['total'] if (result and 'limits' in result) else 0
+        if (not entries or start >= total):
+            return
+
+# get the ID of the library entry of a video file, or None if there is none
+# e.g. to follow an entry across a refresh, which gives it a new ID
+def find_id(video_type, video_path):
+    (path, filename) = split_path(video_path)
+    if (video_path.startswith(STACK_PREFIX)):
+        # the file name of a stack is the whole stack:// URL
+        (path, filename) = (split_path(split_stack(video_path)[0])[0], video_path)
+    try:
+        method = JSONRPC_METHODS[video_type]['list']['method']
+        result_key = JSONRPC_METHODS[video_type]['list']['result_key']
+        result = exec_jsonrpc(method, properties = [ 'file' ], filter = { 'and': [ { 'field': 'path', 'operator': 'is', 'value': path }, { 'field': 'filename', 'operator': 'is', 'value': filename } ] })
+    except KeyError as e:
+        raise LibraryError('cannot retrieve list of %ss: invalid key for BaseTask.JSONRPC_METHODS' % video_type, e)
+    except JSONRPCError as e:
+        raise LibraryError('Kodi JSON-RPC error: %s' % str(e), e)
+    # the result key is missing when there is no matching entry
+    for entry in (result.get(result_key, []) if (result) else []):
+        if (entry['file'] == video_path):
+            return entry[video_type + 'id']
+    return None
+
 # get details for a given library entry
 def get_details(video_type, video_id, **kwargs):
     try:
@@ -48,3 +97,16 @@ def get_details(video_type, video_id, **kwargs):
         raise LibraryError('cannot retrieve details for %s #%d: invalid key for BaseTask.JSONRPC_METHODS' % (video_type, video_id), e)
     except JSONRPCError as e:
         raise LibraryError('Kodi JSON-RPC error: %s' % str(e), e)
+
+# set some properties of a given library entry, without refreshing it
+def set_details(video_type, video_id, **kwargs):
+    try:
+        method = JSONRPC_METHODS[video_type]['set']['method']
+        kwargs[video_type + 'id'] = video_id
+        result = exec_jsonrpc(method, **kwargs)
+    except KeyError as e:
+        raise LibraryError('cannot set details for %s #%d: invalid key for BaseTask.JSONRPC_METHODS' % (video_type, video_id), e)
+    except JSONRPCError as e:
+        raise LibraryError('Kodi JSON-RPC error: %s' % str(e), e)
+    if (result != 'OK'):
+        raise LibraryError('cannot set details for %s #%d: %s' % (video_type, video_id, result))
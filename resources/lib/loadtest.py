@@ -0,0 +1,362 @@
+from __future__ import unicode_literals
+import argparse
+import codecs
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+
+from resources.lib.helpers import addon, load_file, save_file
+from resources.lib.helpers.transport import Transport, set_transport
+from resources.lib.monitor import NFOMonitor
+from resources.lib.tasks.export_base import ExportBatchTask
+
+# load test of the service, outside of Kodi
+# a synthetic library (NFO files + in-memory library behind a fake JSON-RPC transport) is driven by a stream of
+# notifications sent to NFOMonitor.onNotification at a given rate, as Kodi would: playcount updates, and optionally
+# library scans with new entries; each task records when it was queued, started and finished, from which we get queue
+# wait, execution time and end-to-end latency (notification => nfo on disk), plus the utilization of worker threads
+# the same stream is replayed for each nb of threads, and the report can be appended to a JSON lines file to be tracked over time
+# with --adaptive, the nb of threads is only the upper bound of the adaptive worker pool (see ConcurrencyController)
+# with --rebuild, the throughput of rebuilding all NFOs from the library (see MovieNFOBuildHandler) is measured instead
+# with --rules, the throughput of exporting all NFOs is measured with tag rules (see rules.py), then with a script giving
+# the same tags, and with neither as a reference, each on a copy of the same synthetic library
+
+NFO_TEMPLATE = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<movie>
+    <title>Movie %(id)d</title>
+    <year>%(year)d</year>
+    <plot>Synthetic movie #%(id)d, generated for load testing.</plot>
+    <genre>Drama</genre>
+    <actor>
+        <name>Actor %(actor)d</name>
+        <role>Role</role>
+    </actor>
+    <fileinfo>
+        <streamdetails>
+            <video>
+                <height>1080</height>
+            </video>
+            <audio>
+                <language>eng</language>
+            </audio>
+        </streamdetails>
+    </fileinfo>
+</movie>
+'''
+
+# tag rules matching some of the synthetic NFOs, and a script giving the same tags, written as a user would
+RULES = {
+    'replace_tags': False,
+    'rules': [
+        { 'tag': 'audio: en', 'audio_language': 'eng' },
+        { 'tag': 'subs: fr', 'subtitle_language': 'fre' },
+        { 'tag': 'favorite actors', 'actor': [ 'Actor 7', 'Actor 13' ] },
+        { 'tag': 'video: HD', 'min_video_height': 720 },
+        { 'tag': 'video: UltraHD / 4k', 'video_height': 2160 },
+        { 'tag': 'top 250', 'top250': True },
+        { 'tag': 'collection: 7', 'path': r'movie_\d*7[/\\]' },
+    ]
+}
+
+RULES_SCRIPT = r'''import re
+audio_languages = set([ elt.get_text().strip().lower() for audio in root.find_all('audio') for elt in audio.find_all('language', recursive = False) ])
+subtitle_languages = set([ elt.get_text().strip().lower() for subtitle in root.find_all('subtitle') for elt in subtitle.find_all('language', recursive = False) ])
+actors = set([ elt.get_text().strip().lower() for actor in root.find_all('actor') for elt in actor.find_all('name', recursive = False) ])
+video_heights = set([ int(elt.get_text().strip()) for video in root.find_all('video') for elt in video.find_all('height', recursive = False) if (elt.get_text().strip().isdigit()) ])
+top250 = [ elt for elt in root.find_all('top250', recursive = False) if (elt.get_text().strip().isdigit() and int(elt.get_text().strip()) > 0) ]
+tags = set()
+if ('eng' in audio_languages):
+    tags.add('audio: en')
+if ('fre' in subtitle_languages):
+    tags.add('subs: fr')
+if ('actor 7' in actors or 'actor 13' in actors):
+    tags.add('favorite actors')
+if ([ height for height in video_heights if (height >= 720) ]):
+    tags.add('video: HD')
+if (2160 in video_heights):
+    tags.add('video: UltraHD / 4k')
+if (top250):
+    tags.add('top 250')
+if (re.search(r'movie_\d*7[/\\]', video_path, re.IGNORECASE | re.UNICODE)):
+    tags.add('collection: 7')
+existing = set([ elt.get_text().strip() for elt in root.find_all('tag', recursive = False) ])
+for tag in sorted(tags - existing):
+    elt = soup.new_tag('tag')
+    elt.string = tag
+    root.append(elt)
+'''
+
+# all the details of a movie, as needed to rebuild its nfo
+def make_details(movie_id, nb_cast):
+    return {
+        'title': 'Movie %d' % movie_id, 'originaltitle': 'Movie %d' % movie_id, 'sorttitle': '', 'year': 1950 + movie_id % 70,
+        'ratings': { 'imdb': { 'default': True, 'rating': 5 + movie_id % 50 / 10.0, 'votes': 1000 + movie_id } }, 'top250': 0,
+        'plotoutline': 'Synthetic movie', 'plot': 'Synthetic movie #%d, generated for load testing.\nSecond line & more.' % movie_id,
+        'tagline': '', 'runtime': 6000, 'art': { 'poster': 'image://poster_%d.jpg/' % movie_id, 'fanart': 'image://fanart_%d.jpg/' % movie_id },
+        'mpaa': 'PG', 'lastplayed': '', 'imdbnumber': 'tt%07d' % movie_id, 'genre': [ 'Drama', 'War' ], 'country': [ 'France' ], 'setid': 0,
+        'tag': [ 'synthetic' ], 'writer': [ 'Writer %d' % (movie_id % 20) ], 'director': [ 'Director %d' % (movie_id % 30) ], 'premiered': '2000-01-01',
+        'studio': [ 'Studio' ], 'trailer': '', 'dateadded': '2020-01-01 00:00:00', 'resume': { 'position': 0, 'total': 0 },
+        'streamdetails': {
+            'video': [ { 'codec': 'h264', 'aspect': 1.78, 'width': 1920, 'height': 1080, 'stereomode': '', 'duration': 6000 } ],
+            'audio': [ { 'codec': 'ac3', 'language': 'eng', 'channels': 6 }, { 'codec': 'aac', 'language': 'fre', 'channels': 2 } ],
+            'subtitle': [ { 'language': 'eng' } ],
+        },
+        'cast': [ { 'name': 'Actor %d' % n, 'role': 'Role %d' % n, 'order': n, 'thumbnail': 'image://actor_%d.jpg/' % n } for n in range(nb_cast) ],
+    }
+
+# in-memory library, served through the JSON-RPC transport interface
+class FakeLibrary(Transport):
+    def __init__(self, library_dir, nb_movies, latency = 0, nb_cast = 5):
+        self.latency = latency # simulated JSON-RPC round-trip, in seconds
+        self.nb_cast = nb_cast
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.movies = {}
+        for movie_id in range(1, nb_movies + 1):
+            self.add_movie(library_dir, movie_id)
+
+    def add_movie(self, library_dir, movie_id):
+        video_path = os.path.join(library_dir, 'movie_%05d' % movie_id, 'movie_%05d.mkv' % movie_id)
+        if (not os.path.isdir(os.path.dirname(video_path))):
+            os.makedirs(os.path.dirname(video_path))
+        save_file(os.path.splitext(video_path)[0] + '.nfo', NFO_TEMPLATE % { 'id': movie_id, 'year': 1950 + movie_id % 70, 'actor': movie_id % 50 })
+        with self.lock:
+            self.movies[movie_id] = dict(make_details(movie_id, self.nb_cast), movieid = movie_id, file = video_path, label = 'Movie %d' % movie_id, playcount = 0, userrating = 0)
+
+    def set_playcount(self, movie_id, playcount):
+        with self.lock:
+            self.movies[movie_id]['playcount'] = playcount
+
+    def call(self, command, timeout = None):
+        if (self.latency):
+            time.sleep(self.latency)
+        method = command['method']
+        params = command.get('params', {})
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if (method == 'VideoLibrary.GetMovieDetails'):
+                result = { 'moviedetails': dict(self.movies[params['movieid']]) }
+            elif (method == 'VideoLibrary.GetMovies'):
+                ids = sorted(self.movies)
+                limits = params.get('limits', { 'start': 0, 'end': len(ids) })
+                page = [ dict(self.movies[movie_id]) for movie_id in ids[limits['start']:limits['end']] ]
+                result = { 'movies': page, 'limits': { 'start': limits['start'], 'end': limits['start'] + len(page), 'total': len(ids) } }
+            else:
+                result = 'OK'
+        return { 'jsonrpc': '2.0', 'id': command.get('id'), 'result': result }
+
+# monitor keeping a reference to every task it queues
+class RecordingMonitor(NFOMonitor):
+    def __init__(self, nb_threads):
+        self.recorded = []
+        super(RecordingMonitor, self).__init__(nb_threads = nb_threads)
+
+    def add_task(self, task):
+        self.recorded.append(task)
+        super(RecordingMonitor, self).add_task(task)
+
+# list of (delay from start, method, data) notifications
+def make_stream(nb_movies, nb_events, rate, scan_every = 0, scan_size = 0, seed = 0):
+    rand = random.Random(seed)
+    events = []
+    next_id = nb_movies + 1
+    t = 0.0
+    for i in range(nb_events):
+        if (scan_every and i and i % scan_every == 0):
+            events.append((t, 'VideoLibrary.OnScanStarted', None))
+            for n in range(scan_size):
+                events.append((t, 'VideoLibrary.OnUpdate', { 'item': { 'type': 'movie', 'id': next_id }, 'added': True }))
+                next_id += 1
+            events.append((t, 'VideoLibrary.OnScanFinished', None))
+        events.append((t, 'VideoLibrary.OnUpdate', { 'item': { 'type': 'movie', 'id': rand.randint(1, nb_movies) }, 'playcount': 1 }))
+        t += 1.0 / rate
+    return events
+
+# nearest-rank percentiles of a list of durations, in ms
+def percentiles(values):
+    if (not values):
+        return None
+    values = sorted(values)
+    def rank(p):
+        return values[min(int(p * len(values)), len(values) - 1)]
+    return dict((k, round(1000 * v, 1)) for k, v in [ ('p50', rank(0.5)), ('p90', rank(0.9)), ('p99', rank(0.99)), ('max', values[-1]) ])
+
+def run_once(work_dir, nb_threads, args):
+    library_dir = os.path.join(work_dir, 'library_%d' % nb_threads) # a new library for each run, not to benefit from warm caches
+    library = FakeLibrary(library_dir, args.movies, args.rpc_latency / 1000.0)
+    set_transport(library)
+    stream = make_stream(args.movies, args.events, args.rate, args.scan_every, args.scan_size, args.seed)
+    monitor = RecordingMonitor(nb_threads)
+    lag = []
+    start = time.time()
+    for delay, method, data in stream:
+        wait = start + delay - time.time()
+        if (wait > 0):
+            time.sleep(wait)
+        else:
+            lag.append(-wait)
+        if (data and data.get('added')):
+            library.add_movie(library_dir, data['item']['id'])
+        elif (data and 'playcount' in data):
+            library.set_playcount(data['item']['id'], data['playcount'])
+        monitor.onNotification('xbmc', method, json.dumps(data) if (data) else 'null')
+    monitor.stop_all_threads() # waits for all queued tasks
+    wall_time = time.time() - start
+    set_transport(None)
+
+    concurrency = monitor.concurrency.get_stats() if (monitor.concurrency) else None
+    tasks = [ task for task in monitor.recorded if (task.finished_at) ]
+    busy = sum(task.finished_at - task.started_at for task in tasks)
+    span = (max(task.finished_at for task in tasks) - min(task.queued_at for task in tasks)) if (tasks) else 0
+    by_class = {}
+    for task in tasks:
+        by_class.setdefault(task.__class__.__name__, []).append(task)
+    return {
+        'nb_threads': nb_threads,
+        'nb_notifications': len(stream),
+        'nb_tasks': len(tasks),
+        'wall_time': round(wall_time, 2),
+        'throughput': round(len(tasks) / span, 1) if (span) else 0, # tasks per second
+        'utilization': round(busy / (nb_threads * span), 3) if (span) else 0,
+        'max_injection_lag_ms': round(1000 * max(lag), 1) if (lag) else 0, # how late notifications were sent, if the harness could not keep up
+        'jsonrpc_calls': library.calls,
+        'concurrency': concurrency,
+        'tasks': dict((name, {
+            'count': len(items),
+            'queue_wait': percentiles([ t.started_at - t.queued_at for t in items ]),
+            'execution': percentiles([ t.finished_at - t.started_at for t in items ]),
+            'end_to_end': percentiles([ t.finished_at - t.queued_at for t in items ]),
+        }) for name, items in by_class.items()),
+    }
+
+# rebuild all the NFOs of a library from its details, as after a corruption
+def run_rebuild(work_dir, args):
+    library_dir = os.path.join(work_dir, 'library_rebuild')
+    library = FakeLibrary(library_dir, args.movies, args.rpc_latency / 1000.0, args.cast)
+    for movie in library.movies.values():
+        save_file(os.path.splitext(movie['file'])[0] + '.nfo', 'corrupted') # no root tag: the nfo must be rebuilt
+    set_transport(library)
+    task = ExportBatchTask('movie', sorted(library.movies))
+    start = time.time()
+    task.run()
+    wall_time = time.time() - start
+    set_transport(None)
+    nb_rebuilt = len([ movie for movie in library.movies.values() if (os.path.getsize(os.path.splitext(movie['file'])[0] + '.nfo') > len('corrupted')) ])
+    return {
+        'nb_movies': args.movies,
+        'nb_cast': args.cast,
+        'nb_rebuilt': nb_rebuilt,
+        'wall_time': round(wall_time, 2),
+        'throughput': round(nb_rebuilt / wall_time, 1) if (wall_time) else 0, # NFOs per second
+        'jsonrpc_calls': library.calls,
+    }
+
+# export all the NFOs of a library with tag rules, with the equivalent script, and with neither
+def run_rules(work_dir, args):
+    rules_path = os.path.join(work_dir, 'rules.json')
+    save_file(rules_path, json.dumps(RULES, indent = 4))
+    script_path = os.path.join(work_dir, 'rules_script.py')
+    save_file(script_path, RULES_SCRIPT)
+    addon.setSetting('movies.general.rules.path', rules_path)
+    addon.setSetting('movies.general.script.path', script_path)
+    run = { 'nb_movies': args.movies, 'variants': {} }
+    tags = {}
+    for variant in [ 'none', 'rules', 'script' ]:
+        addon.setSetting('movies.general.rules', 'true' if (variant == 'rules') else 'false')
+        addon.setSetting('movies.general.script', 'true' if (variant == 'script') else 'false')
+        library = FakeLibrary(os.path.join(work_dir, 'library_%s' % variant), args.movies, args.rpc_latency / 1000.0)
+        set_transport(library)
+        task = ExportBatchTask('movie', sorted(library.movies))
+        start = time.time()
+        task.run()
+        wall_time = time.time() - start
+        set_transport(None)
+        tags[variant] = dict((movie_id, sorted(re.findall(r'<tag>(.*?)</tag>', load_file(os.path.splitext(movie['file'])[0] + '.nfo'))))
+            for movie_id, movie in library.movies.items())
+        run['variants'][variant] = {
+            'wall_time': round(wall_time, 2),
+            'throughput': round(args.movies / wall_time, 1) if (wall_time) else 0, # NFOs per second
+            'nb_tagged': len([ movie_tags for movie_tags in tags[variant].values() if (movie_tags) ]),
+        }
+    run['same_tags'] = (tags['rules'] == tags['script'])
+    return run
+
+def format_rules(run):
+    lines = [ '%-6s %d NFOs in %.1fs, %.1f NFOs/s, %d tagged' % (variant, run['nb_movies'], stats['wall_time'], stats['throughput'], stats['nb_tagged'])
+        for variant, stats in sorted(run['variants'].items()) ]
+    (rules, script) = (run['variants']['rules']['wall_time'], run['variants']['script']['wall_time'])
+    lines.append('rules vs script: x%.2f faster, %s' % (script / rules if (rules) else 0, 'same tags' if (run['same_tags']) else 'DIFFERENT TAGS'))
+    return '\n'.join(lines) + '\n'
+
+def format_rebuild(run):
+    return 'rebuild: %d/%d NFOs (%d actors each) in %.1fs, %.1f NFOs/s\n' % (run['nb_rebuilt'], run['nb_movies'], run['nb_cast'], run['wall_time'], run['throughput'])
+
+def format_run(run):
+    lines = [ '%d threads: %d notifications => %d tasks in %.1fs, %.1f tasks/s, utilization %d%%' % (
+        run['nb_threads'], run['nb_notifications'], run['nb_tasks'], run['wall_time'], run['throughput'], 100 * run['utilization']) ]
+    if (run['concurrency']):
+        lines[0] += ', adaptive limit %(limit)d (%(increases)d increases, %(decreases)d decreases)' % run['concurrency']
+    for name, stats in sorted(run['tasks'].items()):
+        lines.append('  %-16s x%-5d' % (name, stats['count']) + ' / '.join('%s p50 %.0fms p90 %.0fms p99 %.0fms max %.0fms' % (
+            key.replace('_', ' '), stats[key]['p50'], stats[key]['p90'], stats[key]['p99'], stats[key]['max']) for key in [ 'queue_wait', 'execution', 'end_to_end' ]))
+    return '\n'.join(lines) + '\n'
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description = 'Measure the latency of the nfo sync service under a synthetic stream of notifications, without Kodi.')
+    parser.add_argument('-m', '--movies', type = int, default = 200, help = 'nb of movies in the synthetic library (default: 200)')
+    parser.add_argument('-e', '--events', type = int, default = 200, help = 'nb of playcount notifications (default: 200)')
+    parser.add_argument('-r', '--rate', type = float, default = 20, help = 'notifications per second (default: 20)')
+    parser.add_argument('--scan-every', type = int, default = 0, help = 'simulate a library scan every N notifications (default: never)')
+    parser.add_argument('--scan-size', type = int, default = 5, help = 'nb of movies added by each simulated scan (default: 5)')
+    parser.add_argument('-t', '--threads', default = '1,2,4', help = 'comma-separated list of nb of worker threads to test (default: 1,2,4)')
+    parser.add_argument('--adaptive', action = 'store_true', help = 'let the adaptive worker pool choose the nb of tasks in parallel, up to the nb of threads')
+    parser.add_argument('--rpc-latency', type = float, default = 5, help = 'simulated JSON-RPC round-trip, in ms (default: 5)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed of the notification stream')
+    parser.add_argument('--rebuild', action = 'store_true', help = 'measure the throughput of rebuilding all NFOs of the library instead')
+    parser.add_argument('--cast', type = int, default = 100, help = 'nb of actors per movie, when rebuilding NFOs (default: 100)')
+    parser.add_argument('--rules', action = 'store_true', help = 'measure the throughput of tag rules against the equivalent script instead')
+    parser.add_argument('--report', help = 'append the results, as a JSON line, to this file')
+    return parser.parse_args(argv)
+
+def main(work_dir, argv = None):
+    args = parse_args(argv if (argv is not None) else sys.argv[1:])
+    out = codecs.getwriter('utf-8')(sys.stdout)
+    # measure the sync itself, not the extras
+    for key, value in [ ('movies.auto.notify', 'false'), ('movies.import.autoclean', 'false'), ('movies.throttle.active', 'false'),
+            ('debug.workers.adaptive', 'true' if (args.adaptive) else 'false') ]:
+        addon.setSetting(key, value)
+
+    runs = []
+    try:
+        if (args.rebuild):
+            addon.setSetting('movies.export.rebuild', 'true')
+            run = run_rebuild(work_dir, args)
+            out.write(format_rebuild(run))
+            runs.append(run)
+        elif (args.rules):
+            run = run_rules(work_dir, args)
+            out.write(format_rules(run))
+            runs.append(run)
+        else:
+            for nb_threads in [ int(n) for n in args.threads.split(',') ]:
+                run = run_once(work_dir, nb_threads, args)
+                out.write(format_run(run))
+                runs.append(run)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    if (args.report):
+        report = {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'version': addon.getAddonInfo('version'),
+            'config': dict((k, v) for k, v in vars(args).items() if (k != 'report')),
+            'runs': runs,
+        }
+        with open(args.report, 'a') as fp:
+            fp.write(json.dumps(report, sort_keys = True) + '\n')
+    return 0
@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+import hashlib
+import json
+import threading
+from resources.lib.helpers import addon, load_data, save_data, FileError
+from resources.lib.helpers.log import Logger
+
+# memoization of script results
+# most of the time, a script applied to an nfo it already processed leaves it unchanged (e.g. tags already set): for each
+# nfo and task family, we keep the hash of the script, of its input (canonical: frozen tree + video path) and of its output
+# when the same script meets the same input again, and its output was identical to its input, the script is skipped,
+# and so is the serialization of the nfo
+# entries recorded with another version of the script are stale: see is_stale()
+
+MEMO_FILE = 'script_memo.json'
+
+def hash_text(text):
+    return hashlib.sha1(text if (isinstance(text, bytes)) else text.encode('utf-8')).hexdigest()
+
+# hash of a script, or None if there is no script
+def hash_script(script):
+    return hash_text(script.content) if (script and script.content) else None
+
+# canonical hash of the input of a script: the frozen tree (see nfo.diff.freeze()), and the path of the video
+def hash_input(frozen, video_path):
+    return hash_text(json.dumps([ video_path, frozen ], separators = (',', ':')))
+
+class ScriptMemo(object):
+    def __init__(self, path = MEMO_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.log = Logger(self.__class__.__name__)
+        self.dirty = False
+        # nfo_path => { task_family => [ script_hash, input_hash, output_hash ] }
+        try:
+            self.entries = json.loads(load_data(self.path))
+        except (FileError, ValueError):
+            self.entries = {}
+
+    # output hash of the script applied to this input, if known
+    def lookup(self, nfo_path, task_family, script_hash, input_hash):
+        with self.lock:
+            entry = self.entries.get(nfo_path, {}).get(task_family)
+        if (entry and entry[0] == script_hash and entry[1] == input_hash):
+            return entry[2]
+        return None
+
+    def record(self, nfo_path, task_family, script_hash, input_hash, output_hash):
+        with self.lock:
+            self.entries.setdefault(nfo_path, {})[task_family] = [ script_hash, input_hash, output_hash ]
+            self.dirty = True
+
+    def forget(self, nfo_path, task_family):
+        with self.lock:
+            if (self.entries.get(nfo_path, {}).pop(task_family, None)):
+                self.dirty = True
+
+    # True if the nfo was processed by another version of the script
+    def is_stale(self, nfo_path, task_family, script_hash):
+        with self.lock:
+            entry = self.entries.get(nfo_path, {}).get(task_family)
+        return bool(entry and entry[0] != script_hash)
+
+    def save(self):
+        with self.lock:
+            if (not self.dirty):
+                return
+            content = json.dumps(self.entries, separators = (',', ':'))
+            self.dirty = False
+        try:
+            save_data(self.path, content)
+        except FileError as e:
+            self.log.warning('cannot save script memo: %s' % str(e))
+
+_memo = None
+_memo_lock = threading.Lock()
+
+# get the process-wide script memo, or None if disabled (setting debug.script.memo)
+def get_script_memo():
+    global _memo
+    with _memo_lock:
+        if (_memo is None):
+            _memo = ScriptMemo() if (addon.getSettingBool('debug.script.memo')) else False
+        return _memo or None
@@ -0,0 +1,218 @@
+from __future__ import unicode_literals
+import json
+import os
+import threading
+import time
+from resources.lib.helpers import addon, addon_profile
+from resources.lib.helpers.log import Logger
+
+# live metrics of the service
+# the monitor, the scheduler and the tasks feed counters, gauges and histograms of a process-wide registry, which is
+# periodically exported to the addon profile, in Prometheus text format (metrics.prom, e.g. for node_exporter's textfile
+# collector) and in JSON (metrics.json, with per-second rates of counters since the previous export)
+# updates are a lock + an addition, cheap enough to be always on
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class Counter(object):
+    TYPE = 'counter'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount = 1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [ ('', {}, self.value) ]
+
+class Gauge(object):
+    TYPE = 'gauge'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.func = None # if set, the value is computed on export
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount = 1):
+        self.inc(-amount)
+
+    def set_function(self, func):
+        self.func = func
+
+    def samples(self):
+        if (self.func):
+            try:
+                return [ ('', {}, self.func()) ]
+            except Exception:
+                return []
+        return [ ('', {}, self.value) ]
+
+class Histogram(object):
+    TYPE = 'histogram'
+
+    def __init__(self, buckets = DURATION_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [ 0 ] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self.lock:
+            for i, bound in enumerate(self.buckets):
+                if (value <= bound):
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        with self.lock:
+            samples = []
+            cumulated = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulated += count
+                samples.append(('_bucket', { 'le': '%g' % bound }, cumulated))
+            samples.append(('_bucket', { 'le': '+Inf' }, self.count))
+            samples.append(('_sum', {}, self.sum))
+            samples.append(('_count', {}, self.count))
+            return samples
+
+class MetricsRegistry(object):
+    def __init__(self, prefix = 'nfosync_'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.families = {} # name => (class, help, { labels => metric })
+
+    # get or create the metric with the given name and labels
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = tuple(sorted((labels or {}).items()))
+        with self.lock:
+            family = self.families.get(name)
+            if (family is None):
+                family = self.families[name] = (cls, help, {})
+            elif (family[0] is not cls):
+                raise ValueError('metric %s already registered as a %s' % (name, family[0].TYPE))
+            metric = family[2].get(key)
+            if (metric is None):
+                metric = family[2][key] = cls(**kwargs)
+            return metric
+
+    def counter(self, name, help = '', labels = None):
+        return self._get(Counter, name, help, labels)
+    def gauge(self, name, help = '', labels = None):
+        return self._get(Gauge, name, help, labels)
+    def histogram(self, name, help = '', labels = None, buckets = DURATION_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets = buckets)
+
+    # list of (name, type, help, [ (sample name, labels dict, value) ])
+    def collect(self):
+        with self.lock:
+            families = [ (name, family[0], family[1], list(family[2].items())) for name, family in sorted(self.families.items()) ]
+        result = []
+        for name, cls, help, metrics in families:
+            samples = []
+            for key, metric in sorted(metrics):
+                for suffix, labels, value in metric.samples():
+                    all_labels = dict(key)
+                    all_labels.update(labels)
+                    samples.append((self.prefix + name + suffix, all_labels, value))
+            result.append((self.prefix + name, cls.TYPE, help, samples))
+        return result
+
+    # Prometheus text exposition format
+    def to_prometheus(self):
+        lines = []
+        for name, type, help, samples in self.collect():
+            lines.append('# HELP %s %s' % (name, help.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, type))
+            for sample_name, labels, value in samples:
+                label_str = ','.join('%s="%s"' % (k, ('%s' % v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in sorted(labels.items()))
+                lines.append('%s%s %s' % (sample_name, '{%s}' % label_str if (label_str) else '', repr(float(value)) if (isinstance(value, float)) else value))
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        return dict((name, { 'type': type, 'help': help, 'samples': [ { 'name': sample_name, 'labels': labels, 'value': value } for sample_name, labels, value in samples ] })
+            for name, type, help, samples in self.collect())
+
+registry = MetricsRegistry()
+
+# thread periodically writing the metrics to the addon profile
+class MetricsExporter(threading.Thread):
+    def __init__(self, registry, interval, directory):
+        super(MetricsExporter, self).__init__(name = 'metrics-exporter')
+        self.daemon = True
+        self.registry = registry
+        self.interval = interval
+        self.directory = directory
+        self.stopped = threading.Event()
+        self.log = Logger(self.__class__.__name__)
+        self.last_counters = None # (time, { sample key => value }), to compute rates
+
+    def run(self):
+        while (not self.stopped.wait(self.interval)):
+            self.export()
+        self.export() # last state, on shutdown
+
+    def stop(self):
+        self.stopped.set()
+
+    def export(self):
+        now = time.time()
+        data = self.registry.to_dict()
+        # per-second rates of counters since the previous export
+        counters = {}
+        for name, family in data.items():
+            if (family['type'] == 'counter'):
+                for sample in family['samples']:
+                    counters[sample['name'] + json.dumps(sample['labels'], sort_keys = True)] = sample['value']
+        rates = {}
+        if (self.last_counters):
+            (last_time, last_values) = self.last_counters
+            elapsed = now - last_time
+            if (elapsed > 0):
+                rates = dict((k, (v - last_values.get(k, 0)) / elapsed) for k, v in counters.items())
+        self.last_counters = (now, counters)
+        try:
+            self._write('metrics.prom', self.registry.to_prometheus())
+            self._write('metrics.json', json.dumps({ 'time': now, 'metrics': data, 'rates': rates }, sort_keys = True))
+        except EnvironmentError as e:
+            self.log.warning('cannot export metrics: %s' % str(e))
+
+    # write atomically, so that readers never see a partial file
+    def _write(self, filename, content):
+        path = os.path.join(self.directory, filename)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(content.encode('utf-8'))
+        if (os.name == 'nt' and os.path.exists(path)):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+_exporter = None
+
+# start exporting metrics, every debug.metrics.interval seconds (0: no export)
+def start_metrics_exporter():
+    global _exporter
+    interval = addon.getSettingInt('debug.metrics.interval')
+    if (interval <= 0 or _exporter):
+        return
+    _exporter = MetricsExporter(registry, interval, addon_profile)
+    _exporter.start()
+
+def stop_metrics_exporter():
+    global _exporter
+    if (_exporter):
+        _exporter.stop()
+        _exporter.join(5)
+    _exporter = None
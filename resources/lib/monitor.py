@@ -2,19 +2,29 @@ from __future__ import unicode_literals
 import xbmc
 import xbmcgui
 import json
-from resources.lib.helpers import addon
+import time
+from resources.lib.helpers import addon, load_data, save_data, FileError
 from resources.lib.helpers.log import Logger
 from resources.lib.helpers.jsonrpc import exec_jsonrpc, JSONRPCError
 
-from Queue import Queue
+import itertools
+from Queue import PriorityQueue
 from resources.lib.tasks import Thread
+from resources.lib.coordination import Coordinator, start_coordinator, stop_coordinator
+from resources.lib.scheduler import ConcurrencyController
+from resources.lib.resume import get_resume_exporter
+from resources.lib.metrics import registry as metrics
 
 # import various tasks
 from resources.lib.tasks.import_single import ImportSingleTask
 from resources.lib.tasks.import_all import ImportAllTask
-from resources.lib.tasks.export_base import ExportSingleTask
+from resources.lib.tasks.export_base import ExportSingleTask, ExportBatchTask, ExportReconcileTask
 
 class NFOMonitor(xbmc.Monitor):
+    INSTANCE_ID_FILE = 'instance_id.tmp'
+    # notifications we act upon; others are ignored without even being decoded
+    HANDLED_METHODS = frozenset([ 'VideoLibrary.OnScanStarted', 'VideoLibrary.OnScanFinished', 'VideoLibrary.OnUpdate', 'Player.OnPause', 'Player.OnStop' ])
+
     def __init__(self, nb_threads = 2):
         super(NFOMonitor, self).__init__()
         # init custom logging
@@ -22,16 +32,57 @@ class NFOMonitor(xbmc.Monitor):
 
         # init multithreading
         self.log.info('initializing multithreading with %d threads' % nb_threads)
-        self.tasks = Queue() # task queue
+        self.tasks = PriorityQueue() # task queue, see add_task()
+        self.sequence = itertools.count() # FIFO order among tasks of same priority
+        metrics.gauge('queue_depth', 'Nb of tasks waiting in the queue').set_function(self.tasks.qsize)
+        metrics.gauge('workers', 'Nb of worker threads').set(nb_threads)
+        # the threads are only an upper bound: the nb of tasks running in parallel is adjusted to the observed latency
+        self.concurrency = None
+        if (addon.getSettingBool('debug.workers.adaptive')):
+            self.concurrency = ConcurrencyController(addon.getSettingInt('debug.workers.min'), nb_threads, backlog = self.tasks.qsize, log = Logger('ConcurrencyController'))
+            self.log.info('adaptive worker pool: %d to %d tasks in parallel' % (self.concurrency.min_workers, self.concurrency.max_workers))
+            metrics.gauge('worker_limit', 'Nb of tasks allowed to run in parallel').set_function(lambda: self.concurrency.limit)
         self.threads = [] # thread list
         for i in range(nb_threads):
             # start as many threads as requested and add them to the list
-            w = Thread(self.tasks)
+            w = Thread(self.tasks, concurrency = self.concurrency, add_task = self.add_task)
             # w.daemon = True
             # add new thread to the list of threads
             self.threads.append(w)
             w.start()
 
+        # while the library is being scanned, per-item events are buffered, then processed as a single batch once the scan is over
+        self.scanning = False
+        self.scan_added = set() # IDs of movies added during the scan
+        self.scan_watched = set() # IDs of movies whose playcount was updated during the scan
+
+        # init multi-room coordination, if applicable
+        if (addon.getSettingBool('movies.multiroom.active')):
+            self.start_coordination()
+
+    def start_coordination(self):
+        shared_dir = xbmc.translatePath(addon.getSetting('movies.multiroom.shared_dir')).decode('utf-8')
+        if (not shared_dir or '://' in shared_dir):
+            self.log.warning('multi-room coordination needs a shared folder mounted locally, got \'%s\' => not coordinating' % shared_dir)
+            return
+        # keep the same instance ID across restarts, so that we can reclaim our own leftover locks
+        try:
+            instance_id = load_data(self.INSTANCE_ID_FILE).strip()
+        except FileError:
+            instance_id = Coordinator.new_instance_id()
+            try:
+                save_data(self.INSTANCE_ID_FILE, instance_id)
+            except FileError as e:
+                self.log.warning('cannot save instance ID: %s' % str(e))
+        try:
+            coordinator = start_coordinator(shared_dir, instance_id, log = Logger('Coordinator'))
+            self.log.info('multi-room coordination started as instance %s in \'%s\'' % (coordinator.instance_id, shared_dir))
+        except (IOError, OSError) as e:
+            self.log.warning('cannot start multi-room coordination in \'%s\': %s' % (shared_dir, str(e)))
+
+    def stop_coordination(self):
+        stop_coordinator()
+
     def stop_all_threads(self):
         self.log.info('aborting monitor worker threads')
         self.tasks.join()
@@ -40,15 +91,27 @@ class NFOMonitor(xbmc.Monitor):
         self.log.info('all monitor worker threads have been stopped')
 
     def add_task(self, task):
-        self.tasks.put(task)
+        task.queued_at = time.time()
+        metrics.counter('tasks_queued_total', 'Nb of tasks queued', { 'task': task.__class__.__name__ }).inc()
+        self.tasks.put((task.PRIORITY, next(self.sequence), task))
 
     def onNotification(self, sender, method, data):
         # self.log.debug('notification received: %s' % method)
-        data_dict = json.loads(data)
+        if (method not in self.HANDLED_METHODS):
+            return
+        metrics.counter('notifications_total', 'Nb of library notifications received', { 'method': method }).inc()
+        if (method == 'VideoLibrary.OnScanStarted'):
+            self.log.info('library scan started => deferring per-item tasks until it is finished')
+            self.scanning = True
+            return
         if (method == 'VideoLibrary.OnScanFinished'):
-            self.log.info('library scan finished => launching ImportAllTask to check if there are modified NFOs')
-            self.add_task(ImportAllTask('movie'))
-        elif (method == 'VideoLibrary.OnUpdate' and 'playcount' in data_dict):
+            self.on_scan_finished()
+            return
+        data_dict = json.loads(data)
+        if (method == 'Player.OnPause' or method == 'Player.OnStop'):
+            self.on_playback_state(method, data_dict)
+            return
+        if (method == 'VideoLibrary.OnUpdate' and 'playcount' in data_dict):
             # perform additional checks
             try:
                 if (data_dict['item']['type'] != 'movie' or not data_dict['item']['id']):
@@ -56,8 +119,46 @@ class NFOMonitor(xbmc.Monitor):
             except KeyError:
                 # gracefully return
                 return
+            if (self.scanning):
+                self.scan_watched.add(data_dict['item']['id'])
+                return
             self.log.info('watched status updated => launching ExportSingleTask for %s #%d' % (data_dict['item']['type'], data_dict['item']['id']))
             self.add_task(ExportSingleTask(data_dict['item']['type'], data_dict['item']['id']))
         elif (method == 'VideoLibrary.OnUpdate' and 'added' in data_dict and data_dict['added'] == True):
+            if (self.scanning and data_dict['item']['type'] == 'movie'):
+                # will be processed by the ImportAllTask launched at the end of the scan
+                self.scan_added.add(data_dict['item']['id'])
+                return
             self.log.info('new entry added => we need to check if it needs refresh => launching ImportSingleTask for %s #%d' % (data_dict['item']['type'], data_dict['item']['id']))
             self.add_task(ImportSingleTask(data_dict['item']['type'], data_dict['item']['id'], silent = True))
+
+    # export the watched state changes made while the service was not running, in the background
+    def reconcile(self):
+        self.log.info('launching ExportReconcileTask to catch up with changes made while the service was not running')
+        self.add_task(ExportReconcileTask('movie'))
+
+    # the resume point of the movie may have changed: it is exported later on, with others (see resume.py)
+    def on_playback_state(self, method, data_dict):
+        exporter = get_resume_exporter()
+        try:
+            item = data_dict['item']
+            if (not exporter or item['type'] != 'movie' or not item.get('id')):
+                return
+        except (KeyError, TypeError):
+            return
+        exporter.mark(item['id'])
+        if (method == 'Player.OnStop'):
+            exporter.request_flush()
+
+    # launch a single batch for all the events buffered during the scan
+    def on_scan_finished(self):
+        self.log.info('library scan finished => launching ImportAllTask to check if there are modified NFOs')
+        import_task = ImportAllTask('movie', extra_ids = self.scan_added)
+        if (self.scan_watched):
+            # the import refreshes entries (under new IDs): the export has to wait for it
+            self.log.info('watched status updated for %d movies during the scan => launching ExportBatchTask after ImportAllTask' % len(self.scan_watched))
+            import_task.chain(ExportBatchTask('movie', self.scan_watched))
+        self.add_task(import_task)
+        self.scanning = False
+        self.scan_added = set()
+        self.scan_watched = set()
@@ -1,7 +1,10 @@
 from __future__ import unicode_literals
 from bs4 import BeautifulSoup, Tag
 from resources.lib.helpers import Error
-from resources.lib.helpers import get_nfo_path, load_nfo, save_nfo, FileError
+from resources.lib.helpers import get_nfo_path, load_nfo, save_nfo, save_file, FileError
+from resources.lib.nfo.diff import freeze, thaw, diff, DiffStats
+from resources.lib.nfo.cache import get_tree_cache, is_exact
+from resources.lib.nfo.template import element, render_frozen_nfo
 import resources.lib.library as Library
 LibraryError = Library.LibraryError # just as a convenience
 
@@ -14,7 +17,7 @@ class NFOHandlerError(Error):
 # the handler is given video_details in args, and is responsible for instantiating soup related vars
 # basically it holds soup, root, and old_raw members, as well as all details about the video
 class NFOHandler(object):
-    JSONRPC_PROPS = ['file', 'playcount', 'userrating'] # fields to get from library
+    JSONRPC_PROPS = ['file', 'playcount', 'userrating', 'resume'] # fields to get from library
 
     def __init__(self, task, video_type, video_id, family = 'load'):
         self.family = family
@@ -22,6 +25,13 @@ class NFOHandler(object):
         self.video_type = video_type
         self.video_id = video_id
         self.modified = False
+        self._soup = None
+        self._root = None
+        self.old_raw = None
+        self.loaded_state = None # frozen XML tree as loaded from file, to be compared against on save
+        self.cache_hit = None # whether the tree came from the tree cache (None if not loaded from file)
+        self.dirty_nodes = [] # nodes updated since loading
+        self.diff = None # DiffStats computed on save
         # retrieve details about the entry from the library
         # the list of needed props is provided by the handler itself
         try:
@@ -40,24 +50,120 @@ class NFOHandler(object):
     def make_xml(self):
         pass
 
-    # load XML content from file
+    # the XML tree is built on first access, when loaded from the tree cache
+    @property
+    def soup(self):
+        if (self._soup is None and self._has_pending_tree()):
+            self._make_tree()
+        return self._soup
+    @soup.setter
+    def soup(self, soup):
+        self._soup = soup
+    @property
+    def root(self):
+        if (self._root is None and self._has_pending_tree()):
+            self._make_tree()
+        return self._root
+    @root.setter
+    def root(self, root):
+        self._root = root
+
+    # whether there is a frozen state to build the XML tree from, on first access
+    def _has_pending_tree(self):
+        return (self.loaded_state is not None)
+
+    def _make_tree(self):
+        if (self.old_raw):
+            # cached tree that cannot be rebuilt from its frozen state: parse it again
+            try:
+                (self._soup, self._root, self.old_raw) = load_nfo(self.nfo_path, self.video_type, raw = self.old_raw)
+            except FileError as e:
+                raise NFOHandlerError('error loading nfo file', self.nfo_path, e)
+        else:
+            self._soup = BeautifulSoup('', 'html.parser')
+            self._root = thaw(self.loaded_state, self._soup)
+
+    # load XML content from file, or from the tree cache if the file did not change since it was cached
     def load(self):
+        cache = get_tree_cache()
+        key = cache.stat_key(self.nfo_path) if (cache) else None
+        cached = cache.get(self.nfo_path, key) if (key) else None
+        self.dirty_nodes = []
+        if (cached):
+            self.cache_hit = True
+            (self.loaded_state, self.old_raw) = cached
+            return
+        self.cache_hit = False if (cache) else None
         try:
             (self.soup, self.root, self.old_raw) = load_nfo(self.nfo_path, self.video_type)
         except FileError as e:
             raise NFOHandlerError('error loading nfo file', self.nfo_path, e)
+        self.loaded_state = freeze(self.root)
+        if (key):
+            cache.put(self.nfo_path, key, self.loaded_state, None if (is_exact(self.root)) else self.old_raw)
+
+    # free the XML tree; the handler cannot be used afterwards
+    # bs4 trees are full of parent / sibling reference cycles, so we break them explicitly instead of waiting for the gc
+    def close(self):
+        if (self._soup is not None):
+            self._soup.decompose()
+        self._soup = None
+        self._root = None
+        self.old_raw = None
+        self.loaded_state = None
+        self.dirty_nodes = []
 
-    # save XML content to nfo file, only if XML content is different from the initial one
+    # frozen state of the current tree; does not build the tree if it was not modified since loaded from cache
+    def current_state(self):
+        if (self.loaded_state is not None and not self.dirty_nodes):
+            return self.loaded_state
+        return freeze(self.root)
+
+    # replace the whole XML tree (e.g. by the one modified by a script in another process)
+    def replace_tree(self, soup, root):
+        old_soup = self.soup
+        self._soup = soup
+        self._root = root
+        if (old_soup is not None):
+            old_soup.decompose()
+        self.mark_dirty(root)
+
+    # flag a node as updated; anything that modifies the tree outside add_tag() / del_tags() should call this
+    def mark_dirty(self, node = None):
+        self.dirty_nodes.append(node if (node is not None) else self.root)
+
+    # save XML content to nfo file, only if XML content is semantically different from the initial one
     # returns True if there was no error, AND the content was actually saved
     def save(self):
+        # content loaded from file: skip serialization altogether if nothing changed
+        new_state = None
+        if (self.loaded_state is not None):
+            self.diff = DiffStats()
+            if (self.dirty_nodes):
+                new_state = freeze(self.root)
+                diff(self.loaded_state, new_state, self.diff)
+            if (not self.diff):
+                self.modified = False
+                return False
+        cache = get_tree_cache()
         try:
-            self.modified = save_nfo(self.nfo_path, self.root, self.old_raw)
-            return self.modified
+            self.modified = save_nfo(self.nfo_path, self.root)
         except FileError as e:
+            if (cache):
+                cache.invalidate(self.nfo_path)
             raise NFOHandlerError('error saving nfo file', self.nfo_path, e)
+        # keep the saved tree in cache, as the nfo is likely to be loaded again soon (e.g. after the library refresh)
+        if (cache):
+            key = cache.stat_key(self.nfo_path)
+            if (key and is_exact(self.root)):
+                cache.put(self.nfo_path, key, new_state or freeze(self.root))
+            else:
+                cache.invalidate(self.nfo_path)
+        return self.modified
 
     # append a tag to root node
-    # value may be either a string, a Tag to be inserted inside the new element, or None
+    # value may be either a string, a Tag to be inserted inside the new element, a tuple of frozen elements to be inserted
+    # inside the new element (see template.element()), or None
     # if None, value will be retrieved from the entry details
     def add_tag(self, tag_name, value = None, parent = None, replace = False):
         # get default value from details if needed
@@ -77,9 +183,13 @@ class NFOHandler(object):
             # append the element to root
             elt = self.soup.new_tag(tag_name)
             parent.append(elt)
+            self.mark_dirty(parent)
             # set element content
             if (isinstance(value, Tag)):
                 elt.append(value)
+            elif (isinstance(value, tuple)):
+                for child in value:
+                    self._append_frozen(elt, child)
             else:
                 elt.string = str(value)
             return elt
@@ -88,6 +198,17 @@ class NFOHandler(object):
         except Exception as e:
             raise NFOHandlerError('error updating the XML content (add)', self.nfo_path, e)
 
+    def _append_frozen(self, parent, frozen):
+        (name, attrs, text, children) = frozen
+        elt = self.soup.new_tag(name)
+        for k, v in attrs:
+            elt[k] = v
+        parent.append(elt)
+        if (text):
+            elt.string = text
+        for child in children:
+            self._append_frozen(elt, child)
+
     # append a tag to root node
     # value may be either a string, a Tag to be inserted inside the new element, or None
     # if None, value will be retrieved from the entry details
@@ -100,6 +221,7 @@ class NFOHandler(object):
         try:
             for elt in parent.find_all(tag_name, recursive = False):
                 elt.decompose()
+                self.mark_dirty(parent)
         except Exception as e:
             raise NFOHandlerError('error updating the XML content (del)', self.nfo_path, e)
 
@@ -114,28 +236,90 @@ class NFOLoadHandler(NFOHandler):
 
 # build the NFO from scratch
 # "virtual" class, to be derived for each video type
+# elements are built in their frozen form (see template.py), and rendered to text directly; the XML tree is only built
+# if something needs it (e.g. a script), in which case the NFO is rendered from the tree, as usual
 class NFOBuildHandler(NFOHandler):
     # JSONRPC_PROPS and TAGS to be set in derived classes
     TAGS = [] # tags to generate; they will be processed sequentially in make_xml()
 
     def __init__(self, task, video_type, video_id):
         super(NFOBuildHandler, self).__init__(task, video_type, video_id, family = 'build')
+        self.elements = None # frozen children of the root, until the XML tree is built
 
-    # initialize the soup, root, old_raw members
+    # initialize the list of elements
     def make_xml(self):
-        # build new XML content
-        self.soup = BeautifulSoup('', 'html.parser')
-        self.root = self.soup.new_tag(self.video_type)
-        self.soup.append(self.root)
-
+        self._soup = None
+        self._root = None
+        elements = []
         # append child nodes
         try:
             for tag_name in self.TAGS:
-                self.build_tag(tag_name)
+                elements.extend(self.build_tag(tag_name))
         except Exception as e:
             raise NFOHandlerError('error building the NFO', self.nfo_path, e)
+        self.elements = elements
 
     # to be overridden
-    # called from loop in make_xml()
+    # called from loop in make_xml(); returns the list of frozen elements to append to the root (see template.element())
     def build_tag(self, tag_name):
-        self.add_tag(tag_name)
+        return [ element(tag_name, self.entry[tag_name]) ]
+
+    def built_state(self):
+        return element(self.video_type, children = self.elements)
+
+    def _has_pending_tree(self):
+        return (self.elements is not None)
+
+    def _make_tree(self):
+        self._soup = BeautifulSoup('', 'html.parser')
+        self._root = thaw(self.built_state(), self._soup)
+        self.elements = None
+
+    def current_state(self):
+        if (self.elements is not None):
+            return self.built_state()
+        return super(NFOBuildHandler, self).current_state()
+
+    # text elements of the root are handled without building the XML tree
+    def add_tag(self, tag_name, value = None, parent = None, replace = False):
+        if (self.elements is None or parent is not None or isinstance(value, Tag)):
+            return super(NFOBuildHandler, self).add_tag(tag_name, value, parent, replace)
+        if (not value):
+            try:
+                value = self.entry[tag_name]
+            except KeyError:
+                raise NFOHandlerError('cannot add tag \'%s\': no default value in video details' % tag_name, self.nfo_path)
+        if (replace):
+            self.elements = [ elt for elt in self.elements if (elt[0] != tag_name) ]
+        self.elements.append(element(tag_name, children = value) if (isinstance(value, tuple)) else element(tag_name, value))
+        return None
+
+    def del_tags(self, tag_name, parent = None):
+        if (self.elements is None or parent is not None):
+            return super(NFOBuildHandler, self).del_tags(tag_name, parent)
+        self.elements = [ elt for elt in self.elements if (elt[0] != tag_name) ]
+
+    # save the rendered elements, or the XML tree if it was built
+    def save(self):
+        if (self.elements is None):
+            return super(NFOBuildHandler, self).save()
+        frozen = self.built_state()
+        cache = get_tree_cache()
+        try:
+            save_file(self.nfo_path, render_frozen_nfo(frozen))
+        except FileError as e:
+            if (cache):
+                cache.invalidate(self.nfo_path)
+            raise NFOHandlerError('error saving nfo file', self.nfo_path, e)
+        if (cache):
+            key = cache.stat_key(self.nfo_path)
+            if (key):
+                cache.put(self.nfo_path, key, frozen)
+            else:
+                cache.invalidate(self.nfo_path)
+        self.modified = True
+        return True
+
+    def close(self):
+        super(NFOBuildHandler, self).close()
+        self.elements = None
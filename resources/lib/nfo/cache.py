@@ -0,0 +1,102 @@
+from __future__ import unicode_literals
+import threading
+from collections import OrderedDict
+import xbmcvfs
+from bs4 import Tag, Comment, Declaration, Doctype, ProcessingInstruction
+from resources.lib.helpers import addon
+
+# process-wide cache of parsed NFO files
+# the same NFO is often loaded several times in a row (e.g. import => refresh => 'added' notification => import again),
+# so we keep the frozen tree (see nfo.diff.freeze()) of the most recently used ones, within a memory budget
+# entries are keyed by (nfo_path, mtime, size), and validated with a single stat call
+# frozen trees are immutable: each handler gets its own copy of the tree (built on first access), so that changes made
+# by tasks and scripts never reach the cache
+
+class TreeCache(object):
+    COST_FACTOR = 6 # rough memory footprint of a frozen tree, relative to the size of the raw file
+
+    def __init__(self, budget):
+        self.budget = budget # in bytes
+        self.entries = OrderedDict() # nfo_path => (key, frozen, raw, cost); most recently used last
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # cheap validation key of the file: (mtime, size), or None if the file cannot be stat'ed
+    @staticmethod
+    def stat_key(nfo_path):
+        try:
+            stat = xbmcvfs.Stat(nfo_path)
+            key = (stat.st_mtime(), stat.st_size())
+        except Exception:
+            return None
+        return key if (key != (0, 0)) else None
+
+    # returns (frozen, raw) if the cached entry is still valid, else None
+    # raw is only kept for trees that cannot be rebuilt exactly from their frozen state (see is_exact())
+    def get(self, nfo_path, key):
+        with self.lock:
+            entry = self.entries.get(nfo_path)
+            if (entry is None or entry[0] != key):
+                self.misses += 1
+                return None
+            self.entries[nfo_path] = self.entries.pop(nfo_path) # move to end
+            self.hits += 1
+            return (entry[1], entry[2])
+
+    def put(self, nfo_path, key, frozen, raw = None):
+        cost = self.COST_FACTOR * (len(raw) if (raw) else self.estimate_size(frozen))
+        if (cost > self.budget):
+            return
+        with self.lock:
+            self._remove(nfo_path)
+            self.entries[nfo_path] = (key, frozen, raw, cost)
+            self.size += cost
+            # evict least recently used entries
+            while (self.size > self.budget):
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, nfo_path):
+        with self.lock:
+            self._remove(nfo_path)
+
+    def _remove(self, nfo_path):
+        entry = self.entries.pop(nfo_path, None)
+        if (entry):
+            self.size -= entry[3]
+
+    # approximate size of the XML content of a frozen tree
+    @classmethod
+    def estimate_size(cls, frozen):
+        (name, attrs, text, children) = frozen
+        return 2 * len(name) + 5 + len(text) + sum(len(k) + len(v) + 4 for k, v in attrs) + sum(cls.estimate_size(child) for child in children)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return (float(self.hits) / lookups) if (lookups) else 0.0
+
+# True if the tree can be rebuilt from its frozen state without losing anything meaningful:
+# no comment / processing instruction, and no text mixed with child elements
+def is_exact(root):
+    for node in root.descendants:
+        if (isinstance(node, (Comment, Declaration, Doctype, ProcessingInstruction))):
+            return False
+        if (isinstance(node, Tag)):
+            continue
+        if (node.strip() and any(isinstance(sibling, Tag) for sibling in node.parent.children)):
+            return False
+    return True
+
+_tree_cache = None
+_tree_cache_lock = threading.Lock()
+
+# get the process-wide cache, or None if disabled (setting debug.cache.size, in MB)
+def get_tree_cache():
+    global _tree_cache
+    with _tree_cache_lock:
+        if (_tree_cache is None):
+            budget = addon.getSettingInt('debug.cache.size') * 1024 * 1024
+            _tree_cache = TreeCache(budget) if (budget > 0) else False
+        return _tree_cache or None
@@ -0,0 +1,120 @@
+from __future__ import unicode_literals
+from difflib import SequenceMatcher
+from bs4 import Tag, NavigableString, Comment, Declaration, Doctype, ProcessingInstruction
+
+# semantic comparison of XML trees
+# trees are first frozen into nested tuples: (name, attrs, text, children), that are hashable and cheap to compare
+# formatting (indentation, attribute order, comments) is ignored, so is the relative order of elements with different names,
+# as Kodi does not care about it; the order of elements sharing the same name (actors, tags, ...) is significant
+
+IGNORED_STRINGS = (Comment, Declaration, Doctype, ProcessingInstruction)
+
+# freeze a bs4 Tag into nested tuples
+def freeze(tag):
+    children = []
+    texts = []
+    for child in tag.children:
+        if (isinstance(child, Tag)):
+            children.append(freeze(child))
+        elif (not isinstance(child, IGNORED_STRINGS)):
+            texts.append(child)
+    attrs = []
+    for k, v in tag.attrs.items():
+        # multi-valued attributes (e.g. class) are returned as lists by bs4
+        attrs.append((k, ' '.join(v) if (isinstance(v, list)) else v))
+    return (tag.name, tuple(sorted(attrs)), ''.join(texts).strip(), tuple(children))
+
+# build a bs4 Tag back from a frozen tree, as the only child of soup (that must be empty)
+# much faster than parsing, as links between nodes are set directly; only what freeze() keeps is restored (no comment,
+# no whitespace, text placed before child elements), which is enough for trees made of leaf elements and containers
+def thaw(frozen, soup):
+    last = [ soup ] # last node appended, in document order
+    def link(node, parent):
+        node.parent = parent
+        last[0].next_element = node
+        node.previous_element = last[0]
+        last[0] = node
+    def build(frozen, parent):
+        (name, attrs, text, children) = frozen
+        tag = Tag(None, soup.builder, name, attrs = dict(attrs))
+        link(tag, parent)
+        contents = []
+        if (text):
+            string = NavigableString(text)
+            link(string, tag)
+            contents.append(string)
+        for child in children:
+            contents.append(build(child, tag))
+        for prev, node in zip(contents, contents[1:]):
+            prev.next_sibling = node
+            node.previous_sibling = prev
+        tag.contents = contents
+        return tag
+    root = build(frozen, soup)
+    soup.contents = [ root ]
+    return root
+
+# count the elements of a frozen tree
+def count_elements(frozen):
+    return 1 + sum(count_elements(child) for child in frozen[3])
+
+class DiffStats(object):
+    def __init__(self):
+        self.added = 0 # elements added
+        self.removed = 0 # elements removed
+        self.changed = 0 # elements with modified text or attributes
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+    __bool__ = __nonzero__
+
+    def __str__(self):
+        return '%d added, %d removed, %d changed' % (self.added, self.removed, self.changed)
+
+    # accumulate stats from another DiffStats object
+    def add(self, other):
+        self.added += other.added
+        self.removed += other.removed
+        self.changed += other.changed
+
+# compute the semantic difference between two frozen trees
+def diff(old, new, stats = None):
+    if (stats is None):
+        stats = DiffStats()
+    if (old == new):
+        return stats
+    if (old[0] != new[0]):
+        stats.removed += count_elements(old)
+        stats.added += count_elements(new)
+        return stats
+    if (old[1] != new[1] or old[2] != new[2]):
+        stats.changed += 1
+    if (old[3] != new[3]):
+        _diff_children(old[3], new[3], stats)
+    return stats
+
+def _group_by_name(children):
+    groups = {}
+    for child in children:
+        groups.setdefault(child[0], []).append(child)
+    return groups
+
+def _diff_children(old_children, new_children, stats):
+    old_groups = _group_by_name(old_children)
+    new_groups = _group_by_name(new_children)
+    for name in set(old_groups) | set(new_groups):
+        a = old_groups.get(name, [])
+        b = new_groups.get(name, [])
+        if (a == b):
+            continue
+        for op, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk = False).get_opcodes():
+            if (op == 'equal'):
+                continue
+            # pair up replaced elements, then count the remaining ones as added or removed
+            pairs = zip(a[i1:i2], b[j1:j2])
+            for x, y in pairs:
+                diff(x, y, stats)
+            for x in a[i1 + len(pairs):i2]:
+                stats.removed += count_elements(x)
+            for y in b[j1 + len(pairs):j2]:
+                stats.added += count_elements(y)
@@ -0,0 +1,153 @@
+from __future__ import unicode_literals
+import json
+import threading
+from resources.lib.helpers import addon, load_data, save_data, FileError
+from resources.lib.helpers.log import Logger
+from resources.lib.memo import hash_text
+
+# targeted library updates, instead of refreshes
+# a refresh (VideoLibrary.RefreshMovie) makes Kodi delete and re-add the entry, reading the nfo, art and streams again,
+# which is by far the most expensive operation of a sync; yet most changes of an nfo are about fields Kodi can set
+# directly (VideoLibrary.SetMovieDetails): tags, plot...
+# the top-level elements of the nfo are split into:
+# - settable fields, compared against the library entry, and sent as is if different
+# - everything else (actors, streams, art, ratings...), only known through a digest recorded on the last refresh: if it
+#   changed since (or was never recorded), a refresh is needed anyway
+# the names of the settable fields present in the nfo are part of the digest, as removing a field requires a refresh
+# the watched state (playcount, watched, lastplayed) and dateadded are not settable fields: a refresh only imports them
+# with the importwatchedstate advanced setting, which we cannot read, so setting them would go beyond what Kodi does
+# list fields: Kodi splits each element on its item separator (' / ' by default), so <genre>Action / Drama</genre> is
+# ['Action', 'Drama'] in the library; lists are split the same way and compared regardless of order, but an element
+# holding several items also goes into the digest: Kodi may be configured with another separator, so any change to it
+# is left to a refresh
+# repeated single-valued elements (e.g. two <plot>): only the first one is compared, the others go into the digest
+# a digest is recorded when an entry is refreshed, or when an import finds the library already in sync with the nfo
+# (see ImportTask.stage_refresh()): until then, e.g. on the first import of a library, an nfo always needs a refresh
+
+# nfo element => (library property, kind), per video type
+SETTABLE_FIELDS = {
+    'movie': {
+        'title': ('title', 'text'),
+        'originaltitle': ('originaltitle', 'text'),
+        'sorttitle': ('sorttitle', 'text'),
+        'plot': ('plot', 'text'),
+        'outline': ('plotoutline', 'text'),
+        'tagline': ('tagline', 'text'),
+        'mpaa': ('mpaa', 'text'),
+        'trailer': ('trailer', 'text'),
+        'premiered': ('premiered', 'text'),
+        'year': ('year', 'int'),
+        'top250': ('top250', 'int'),
+        'userrating': ('userrating', 'int'),
+        'runtime': ('runtime', 'minutes'), # minutes in the nfo, seconds in the library
+        'genre': ('genre', 'list'),
+        'tag': ('tag', 'list'),
+        'country': ('country', 'list'),
+        'studio': ('studio', 'list'),
+        'director': ('director', 'list'),
+        'credits': ('writer', 'list'),
+    },
+}
+
+DIGEST_FILE = 'field_digests.json'
+ITEM_SEPARATOR = ' / ' # default itemSeparator of Kodi (advancedsettings.xml)
+
+# library properties needed to compare the settable fields of the given video type
+def get_field_properties(video_type):
+    return sorted(set(prop for prop, kind in SETTABLE_FIELDS.get(video_type, {}).values()))
+
+# split the frozen tree of an nfo (see nfo.diff.freeze()) into settable fields and the digest of everything else
+# returns ({ element name => value }, digest)
+def split_fields(frozen, video_type):
+    fields = SETTABLE_FIELDS.get(video_type, {})
+    values = {}
+    others = []
+    for child in frozen[3]:
+        name = child[0]
+        kind = fields[name][1] if (name in fields and not child[3]) else None
+        try:
+            if (kind == 'list'):
+                items = [ item.strip() for item in child[2].split(ITEM_SEPARATOR) if (item.strip()) ]
+                values.setdefault(name, []).extend(items)
+                if (len(items) > 1):
+                    others.append(child)
+            elif (name in values):
+                others.append(child) # repeated element: only the first one is set
+            elif (kind == 'int' or kind == 'minutes'):
+                values[name] = int(child[2] or 0)
+            elif (kind == 'text'):
+                values[name] = child[2]
+            else:
+                others.append(child)
+        except ValueError:
+            others.append(child) # not understood: left to Kodi
+    others.sort(key = lambda child: child[0]) # stable: elements sharing a name keep their order
+    digest = hash_text(json.dumps([ sorted(values), others ], separators = (',', ':')))
+    return (values, digest)
+
+# library properties to set for the entry to reflect the given field values; empty if already up to date
+def diff_fields(values, entry, video_type):
+    fields = SETTABLE_FIELDS.get(video_type, {})
+    changes = {}
+    for name, value in values.items():
+        (prop, kind) = fields[name]
+        current = entry.get(prop)
+        if (kind == 'minutes'):
+            value = value * 60
+        elif (kind == 'text'):
+            current = (current or '').strip()
+        elif (kind == 'list'):
+            if (sorted(current or []) == sorted(value)):
+                continue
+        if (current != value):
+            changes[prop] = value
+    return changes
+
+# digests of the non-settable part of nfo files, as of the last time Kodi read them
+class FieldDigests(object):
+    def __init__(self, path = DIGEST_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.log = Logger(self.__class__.__name__)
+        self.dirty = False
+        try:
+            self.entries = json.loads(load_data(self.path)) # nfo_path => digest
+        except (FileError, ValueError):
+            self.entries = {}
+
+    def get(self, nfo_path):
+        with self.lock:
+            return self.entries.get(nfo_path)
+
+    def record(self, nfo_path, digest):
+        with self.lock:
+            if (self.entries.get(nfo_path) != digest):
+                self.entries[nfo_path] = digest
+                self.dirty = True
+
+    def forget(self, nfo_path):
+        with self.lock:
+            if (self.entries.pop(nfo_path, None)):
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if (not self.dirty):
+                return
+            content = json.dumps(self.entries, separators = (',', ':'))
+            self.dirty = False
+        try:
+            save_data(self.path, content)
+        except FileError as e:
+            self.log.warning('cannot save field digests: %s' % str(e))
+
+_digests = None
+_digests_lock = threading.Lock()
+
+# get the process-wide field digests, or None if targeted updates are disabled (setting debug.import.set_details)
+def get_field_digests():
+    global _digests
+    with _digests_lock:
+        if (_digests is None):
+            _digests = FieldDigests() if (addon.getSettingBool('debug.import.set_details')) else False
+        return _digests or None
@@ -0,0 +1,245 @@
+from __future__ import unicode_literals
+import re
+from xml.sax.saxutils import escape, unescape
+from resources.lib.helpers import Error
+from resources.lib.helpers import load_file, save_file, FileError
+from resources.lib.nfo import NFOHandler, NFOHandlerError
+from resources.lib.nfo.diff import DiffStats
+from resources.lib.nfo.cache import get_tree_cache
+
+# in-place patching of simple elements of the nfo (e.g. watched, userrating after a playback)
+# instead of parsing the whole file into a tree, re-rendering and saving it, the content is scanned once by a tokenizer
+# that only locates the direct children of the root element; new values are then spliced into the original content,
+# so that everything else (formatting, comments, order of elements) is kept as is
+# elements with children (e.g. resume) are replaced as a whole, as long as their children are simple text elements
+# inserted lines use the line endings of the file (CRLF if it has any, LF otherwise)
+# anything the tokenizer cannot make sense of raises an error, and the task falls back to the full parse
+
+class PatchError(Error):
+    pass
+
+# any markup: comment, CDATA section, processing instruction, declaration, or tag (group 1: '/' if closing tag,
+# group 2: tag name, group 3: '/' if self-closing tag)
+TOKEN_REGEX = re.compile(r'''<(?:!--.*?--|!\[CDATA\[.*?\]\]|\?.*?\?|![^>]*|(/?)([^\s/>!?]+)(?:\s+[^\s=/>]+\s*=\s*(?:"[^"]*"|'[^']*'))*\s*(/?))>''', re.DOTALL)
+CHILD_REGEX = re.compile(r'<([^\s/>!?]+)\s*>([^<]*)</\1\s*>')
+DEFAULT_INDENT = '    '
+
+# position of a direct child of the root element
+class ElementSpan(object):
+    __slots__ = [ 'start', 'end', 'inner_start', 'inner_end', 'simple' ]
+
+    def __init__(self, start, inner_start):
+        self.start = start # start of the opening tag
+        self.inner_start = inner_start # end of the opening tag, None if self-closing
+        self.inner_end = None # start of the closing tag, None if self-closing
+        self.end = None # end of the closing tag
+        self.simple = True # no markup in its content
+
+# scan the content of a nfo file
+# returns ({ name => [ ElementSpan ] } for the direct children of the root element, start of the root closing tag, indentation of children)
+# raises PatchError if the content is not well-formed, or if the root element is not root_tag
+def scan(content, root_tag):
+    children = {}
+    stack = []
+    current = None # direct child of the root being read
+    root_close = None
+    indent = None
+    pos = content.find('<')
+    while (pos >= 0):
+        match = TOKEN_REGEX.match(content, pos)
+        if (not match):
+            raise PatchError('unexpected \'<\' at offset %d' % pos)
+        name = match.group(2)
+        if (name is None):
+            # comment, CDATA... only allowed outside of the direct children we may patch
+            if (current):
+                current.simple = False
+        elif (root_close is not None):
+            raise PatchError('element after the root element at offset %d' % pos)
+        elif (match.group(1)):
+            # closing tag
+            name = name.lower()
+            if (not stack or stack[-1] != name):
+                raise PatchError('unbalanced closing tag </%s> at offset %d' % (name, pos))
+            stack.pop()
+            if (len(stack) == 1):
+                current.inner_end = match.start()
+                current.end = match.end()
+                current = None
+            elif (not stack):
+                root_close = match.start()
+        else:
+            # opening tag
+            name = name.lower()
+            if (not stack and name != root_tag):
+                raise PatchError('root element is <%s>, expected <%s>' % (name, root_tag))
+            if (len(stack) == 1):
+                span = ElementSpan(match.start(), None if (match.group(3)) else match.end())
+                children.setdefault(name, []).append(span)
+                if (indent is None):
+                    line_start = content.rfind('\n', 0, match.start()) + 1
+                    indent = content[line_start:match.start()] if (line_start and not content[line_start:match.start()].strip()) else DEFAULT_INDENT
+                if (match.group(3)):
+                    span.end = match.end()
+                else:
+                    current = span
+            elif (current):
+                current.simple = False
+            if (not match.group(3)):
+                stack.append(name)
+        pos = content.find('<', match.end())
+    if (root_close is None):
+        raise PatchError('no closing tag for the root element <%s>' % root_tag)
+    return (children, root_close, indent or DEFAULT_INDENT)
+
+# the single direct child of the root with this name, or None if missing
+# raises PatchError if the element cannot be patched (its text, if simple is True; the whole element otherwise)
+def find_child(children, name, simple = True):
+    spans = children.get(name, [])
+    if (len(spans) > 1):
+        raise PatchError('several <%s> elements' % name)
+    if (simple and spans and not spans[0].simple):
+        raise PatchError('<%s> is not a simple element' % name)
+    return spans[0] if (spans) else None
+
+# line ending used by the content of a nfo file
+def get_newline(content):
+    return '\r\n' if ('\r\n' in content) else '\n'
+
+# markup of an element whose children are frozen text elements (see template.element()), as a direct child of the root
+def render_compound(name, children, indent, newline = '\n'):
+    lines = [ '<%s>' % name ]
+    for (child_name, attrs, text, grand_children) in children:
+        if (attrs or grand_children):
+            raise PatchError('<%s> is not a simple element' % child_name)
+        lines.append('%s%s<%s>%s</%s>' % (indent, indent, child_name, escape(text), child_name))
+    lines.append('%s</%s>' % (indent, name))
+    return newline.join(lines)
+
+# (name, text) of the children of an element, if they are all simple text elements
+def read_children(content, span):
+    inner = content[span.inner_start:span.inner_end] if (span.inner_start is not None) else ''
+    return [ (name.lower(), unescape(text).strip()) for name, text in CHILD_REGEX.findall(inner) ]
+
+# apply patches to the content of a nfo file, as scanned by scan()
+# patches: list of (name, value); each direct child of the root with this name gets the new value, or is appended if missing
+# value is either a text, or a tuple of frozen text elements replacing the whole element
+# returns the new content, and the DiffStats of the changes
+def patch(content, scanned, patches):
+    (children, root_close, indent) = scanned
+    newline = get_newline(content)
+    line_start = content.rfind('\n', 0, root_close) + 1
+    at_line_start = (line_start > 0 and not content[line_start:root_close].strip())
+    splices = [] # (start, end, order, text)
+    stats = DiffStats()
+    for order, (name, value) in enumerate(patches):
+        if (isinstance(value, tuple)):
+            span = find_child(children, name, simple = False)
+            if (span is not None and read_children(content, span) == [ (child[0], child[2]) for child in value ]):
+                continue
+            markup = render_compound(name, value, indent, newline)
+            if (span is not None):
+                splices.append((span.start, span.end, order, markup))
+                stats.changed += 1
+            elif (at_line_start):
+                splices.append((line_start, line_start, order, indent + markup + newline))
+                stats.added += 1
+            else:
+                splices.append((root_close, root_close, order, markup))
+                stats.added += 1
+            continue
+        value = '%s' % value
+        span = find_child(children, name)
+        if (span is None):
+            element = '<%s>%s</%s>' % (name, escape(value), name)
+            if (at_line_start):
+                splices.append((line_start, line_start, order, indent + element + newline))
+            else:
+                splices.append((root_close, root_close, order, element))
+            stats.added += 1
+            continue
+        old_value = unescape(content[span.inner_start:span.inner_end]).strip() if (span.inner_start is not None) else ''
+        if (old_value == value):
+            continue
+        if (span.inner_start is not None):
+            splices.append((span.inner_start, span.inner_end, order, escape(value)))
+        else:
+            splices.append((span.start, span.end, order, '<%s>%s</%s>' % (name, escape(value), name)))
+        stats.changed += 1
+    parts = []
+    pos = 0
+    for start, end, order, text in sorted(splices):
+        parts.append(content[pos:start])
+        parts.append(text)
+        pos = end
+    parts.append(content[pos:])
+    return (''.join(parts), stats)
+
+# nfo handler patching the file in place; only supports add_tag(name, value, replace = True) on the root element, value
+# being a text or a tuple of frozen text elements
+class NFOPatchHandler(NFOHandler):
+    def __init__(self, task, video_type, video_id):
+        super(NFOPatchHandler, self).__init__(task, video_type, video_id, family = 'patch')
+        self.raw = None
+        self.scanned = None # see scan()
+        self.patches = [] # list of (name, value)
+
+    # load the file content, and check that it can be patched
+    def make_xml(self):
+        try:
+            self.raw = load_file(self.nfo_path)
+        except FileError as e:
+            raise NFOHandlerError('error loading nfo file', self.nfo_path, e)
+        try:
+            self.scanned = scan(self.raw, self.video_type)
+        except PatchError as e:
+            raise NFOHandlerError('cannot patch nfo file: %s' % e.message, self.nfo_path)
+
+    def add_tag(self, tag_name, value = None, parent = None, replace = False):
+        if (parent is not None or not replace or (value is not None and not isinstance(value, (int, float, basestring, tuple)))):
+            raise NFOHandlerError('cannot patch nfo file: only text elements of the root can be replaced', self.nfo_path)
+        if (not value):
+            try:
+                value = self.entry[tag_name]
+            except KeyError:
+                raise NFOHandlerError('cannot add tag \'%s\': no default value in video details' % tag_name, self.nfo_path)
+        # check right away, so that the task can still fall back to the full parse
+        try:
+            find_child(self.scanned[0], tag_name, simple = not isinstance(value, tuple))
+            if (isinstance(value, tuple)):
+                render_compound(tag_name, value, '')
+        except PatchError as e:
+            raise NFOHandlerError('cannot patch nfo file: %s' % e.message, self.nfo_path)
+        self.patches.append((tag_name, value))
+
+    def del_tags(self, tag_name, parent = None):
+        raise NFOHandlerError('cannot patch nfo file: elements cannot be removed', self.nfo_path)
+
+    def current_state(self):
+        raise NFOHandlerError('cannot patch nfo file: no XML tree', self.nfo_path)
+
+    # save the patched content, only if a value actually changed
+    def save(self):
+        try:
+            (content, self.diff) = patch(self.raw, self.scanned, self.patches)
+        except PatchError as e:
+            raise NFOHandlerError('cannot patch nfo file: %s' % e.message, self.nfo_path)
+        if (not self.diff):
+            self.modified = False
+            return False
+        # cache entries are keyed by mtime and size, which may both stay the same (e.g. watched: False => True)
+        cache = get_tree_cache()
+        if (cache):
+            cache.invalidate(self.nfo_path)
+        try:
+            save_file(self.nfo_path, content)
+        except FileError as e:
+            raise NFOHandlerError('error saving nfo file', self.nfo_path, e)
+        self.modified = True
+        return True
+
+    def close(self):
+        super(NFOPatchHandler, self).close()
+        self.raw = None
+        self.scanned = None
+        self.patches = []
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+from bs4.dammit import EntitySubstitution
+from resources.lib.helpers import NFO_HEADER, reindent
+
+# building nfo content without bs4
+# elements are built directly in their frozen form (see nfo.diff.freeze()): (name, attrs, text, children) tuples,
+# and rendered to text by emulating Tag.prettify() + reindent(), so that the output is the same as rendering the
+# equivalent bs4 tree; if the tree is needed (e.g. by a script), it can be built at once with nfo.diff.thaw()
+
+escape = EntitySubstitution.substitute_xml
+quote = EntitySubstitution.quoted_attribute_value
+
+# frozen element; text and attribute values may be of any type
+def element(name, text = '', attrs = None, children = ()):
+    return (name, tuple(sorted((k, '%s' % v) for k, v in attrs.items())) if (attrs) else (), ('%s' % text).strip(), tuple(children))
+
+# same output as Tag.prettify() on the thawed tree
+def prettify(frozen):
+    parts = []
+    _prettify(frozen, 1, False, parts)
+    return ''.join(parts)
+
+def _prettify(frozen, level, has_next_sibling, parts):
+    (name, attrs, text, children) = frozen
+    indent = ' ' * (level - 1)
+    parts.append('%s<%s' % (indent, name))
+    for k, v in attrs:
+        parts.append(' %s=%s' % (k, quote(escape(v))))
+    parts.append('>\n')
+    text = escape(text).strip()
+    if (text):
+        parts.append('%s %s\n' % (indent, text))
+    last = len(children) - 1
+    for i, child in enumerate(children):
+        _prettify(child, level + 1, i < last, parts)
+    if (children):
+        parts.append('\n') # the last child is not followed by a new line
+    parts.append('%s</%s>' % (indent, name))
+    if (has_next_sibling):
+        parts.append('\n')
+
+# generate the nfo file content from a frozen tree; same as helpers.render_nfo() on the thawed tree
+def render_frozen_nfo(frozen):
+    return NFO_HEADER + reindent(prettify(frozen))
@@ -0,0 +1,47 @@
+from __future__ import unicode_literals
+import threading
+from collections import OrderedDict
+import xbmcvfs
+
+# nfo files written by this service
+# an import refreshes the library entries whose nfo was modified outside of Kodi, even when the script leaves the nfo
+# unchanged; but an nfo we wrote ourselves (watched state, resume point, import script...) already matches the library,
+# or was refreshed right after being saved, so refreshing it again would only make Kodi read the video files for nothing
+# we keep the mtime of each nfo right after saving it: as long as the nfo still has this mtime, nobody else touched it
+# this is kept in memory only: after a restart, nfo files written by the previous run count as modified outside
+
+class WrittenNFOs(object):
+    def __init__(self, max_entries = 10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # nfo_path => mtime after our last save; most recent last
+        self.lock = threading.Lock()
+
+    # the nfo was just saved by this service
+    def record(self, nfo_path):
+        try:
+            mtime = xbmcvfs.Stat(nfo_path).st_mtime()
+        except Exception:
+            mtime = 0
+        with self.lock:
+            self.entries.pop(nfo_path, None)
+            if (not mtime):
+                return
+            self.entries[nfo_path] = mtime
+            while (len(self.entries) > self.max_entries):
+                self.entries.popitem(last = False)
+
+    # True if the nfo was last written by this service, and not modified since
+    def is_own(self, nfo_path, mtime):
+        with self.lock:
+            return (mtime is not None and self.entries.get(nfo_path) == mtime)
+
+_written = None
+_written_lock = threading.Lock()
+
+# get the process-wide registry of nfo files written by this service
+def get_written_nfos():
+    global _written
+    with _written_lock:
+        if (_written is None):
+            _written = WrittenNFOs()
+        return _written
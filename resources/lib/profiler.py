@@ -0,0 +1,181 @@
+from __future__ import unicode_literals
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from StringIO import StringIO
+from resources.lib.helpers import addon, addon_profile
+from resources.lib.helpers.log import Logger
+
+# opt-in profiling of tasks, to find out where the time goes on a user installation without patching the addon
+# two modes (setting debug.profile.mode):
+# - cprofile: deterministic, exact call counts, but only sees the thread running the task, and slows it down noticeably
+# - sampler: the stacks of the task thread and of the threads it starts (pipeline stages) are sampled every few ms;
+#   cheap, and covers the pipeline, but statistical
+# each profiled task writes a dump (.prof: pstats format / .folded: collapsed stacks, as used by flamegraph tools) and a
+# text summary of the top functions into the 'profiles' directory of the addon profile, oldest files being removed
+# beyond a nb of runs or a total size
+
+PROFILE_DIR = 'profiles'
+MODE_OFF = 'off'
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLER = 'sampler'
+
+# statistical profiler, sampling the stacks of a set of threads
+class StackSampler(object):
+    INTERVAL = 0.005 # seconds between two samples
+
+    def __init__(self, thread_ident):
+        self.thread_ident = thread_ident # thread running the task
+        self.known = set() # threads alive before the task started: not part of it
+        self.stacks = {} # collapsed stack => nb of samples
+        self.nb_samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.known = set(t.ident for t in threading.enumerate()) - set([ self.thread_ident ])
+        self.thread = threading.Thread(target = self._run, name = 'profiler-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        own_ident = threading.current_thread().ident
+        while (not self.stopped.wait(self.INTERVAL)):
+            for ident, frame in sys._current_frames().items():
+                if (ident == own_ident or ident in self.known):
+                    continue
+                stack = []
+                while (frame is not None):
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.nb_samples += 1
+
+    # collapsed stacks, one per line: 'outer;...;inner count'
+    def dump(self):
+        return ''.join('%s %d\n' % (stack, count) for stack, count in sorted(self.stacks.items()))
+
+    # top functions by nb of samples where they are running (self) or on the stack (total)
+    def summary(self, top):
+        own, total = {}, {}
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for frame in set(frames):
+                total[frame] = total.get(frame, 0) + count
+        nb = sum(self.stacks.values()) or 1
+        lines = [ '%d samples every %dms (%d thread samples)' % (self.nb_samples, 1000 * self.INTERVAL, nb), '' ]
+        for title, counts in [ ('self', own), ('total', total) ]:
+            lines.append('top %d functions by %s samples:' % (top, title))
+            for frame, count in sorted(counts.items(), key = lambda x: -x[1])[:top]:
+                lines.append('%7d %5.1f%%  %s' % (count, 100.0 * count / nb, frame))
+            lines.append('')
+        return '\n'.join(lines)
+
+class TaskProfiler(object):
+    def __init__(self, mode, directory, task_names = None, max_runs = 20, max_size = 20 * 1024 * 1024, top = 40):
+        self.mode = mode
+        self.directory = directory
+        self.task_names = task_names # set of task class names to profile, or None for all
+        self.max_runs = max_runs
+        self.max_size = max_size # in bytes, for all files
+        self.top = top
+        self.lock = threading.Lock()
+        self.nb_runs = 0 # to name the files of runs ending within the same second
+        self.log = Logger(self.__class__.__name__)
+
+    def wants(self, task):
+        return (not self.task_names or task.__class__.__name__ in self.task_names)
+
+    # run func() under the profiler, and dump the results
+    def profile(self, task, func):
+        if (not self.wants(task)):
+            return func()
+        start = time.time()
+        if (self.mode == MODE_SAMPLER):
+            profiler = StackSampler(threading.current_thread().ident)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            return func()
+        finally:
+            if (self.mode == MODE_SAMPLER):
+                profiler.stop()
+            else:
+                profiler.disable()
+            try:
+                self.dump(task, profiler, time.time() - start)
+            except Exception as e:
+                self.log.warning('cannot save profile of %s: %s: %s' % (task.signature, e.__class__.__name__, str(e)))
+
+    def dump(self, task, profiler, duration):
+        if (not os.path.isdir(self.directory)):
+            os.makedirs(self.directory)
+        with self.lock:
+            self.nb_runs += 1
+            base = os.path.join(self.directory, '%s-%04d-%s' % (time.strftime('%Y%m%d-%H%M%S'), self.nb_runs % 10000, task.__class__.__name__))
+        header = '%s, %.2fs, %s\n\n' % (task.signature, duration, self.mode)
+        if (self.mode == MODE_SAMPLER):
+            dump_path = base + '.folded'
+            with open(dump_path, 'wb') as fp:
+                fp.write(profiler.dump().encode('utf-8'))
+            summary = profiler.summary(self.top)
+        else:
+            dump_path = base + '.prof'
+            profiler.dump_stats(dump_path)
+            stream = StringIO()
+            stats = pstats.Stats(profiler, stream = stream)
+            stats.sort_stats('cumulative').print_stats(self.top)
+            stats.sort_stats('time').print_stats(self.top)
+            summary = stream.getvalue()
+            if (isinstance(summary, bytes)):
+                summary = summary.decode('utf-8', 'replace')
+        with open(base + '.txt', 'wb') as fp:
+            fp.write((header + summary).encode('utf-8'))
+        self.log.info('profile of %s saved: %s' % (task.signature, dump_path))
+        self.rotate()
+
+    # remove the oldest runs beyond max_runs, or max_size
+    def rotate(self):
+        with self.lock:
+            runs = {} # base name => [ (path, size) ]
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                runs.setdefault(os.path.splitext(name)[0], []).append((path, os.path.getsize(path)))
+            total = sum(size for files in runs.values() for path, size in files)
+            names = sorted(runs) # names start with a timestamp: oldest first
+            while (names and (len(names) > self.max_runs or total > self.max_size)):
+                for path, size in runs[names.pop(0)]:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    total -= size
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+# get the process-wide task profiler, or None if disabled (setting debug.profile.mode)
+def get_task_profiler():
+    global _profiler
+    with _profiler_lock:
+        if (_profiler is None):
+            mode = addon.getSetting('debug.profile.mode')
+            if (mode in [ MODE_CPROFILE, MODE_SAMPLER ]):
+                task_names = set(name.strip() for name in addon.getSetting('debug.profile.tasks').split(',') if (name.strip()))
+                _profiler = TaskProfiler(mode, os.path.join(addon_profile, PROFILE_DIR), task_names = task_names or None,
+                    max_runs = max(addon.getSettingInt('debug.profile.max_runs'), 1), max_size = addon.getSettingInt('debug.profile.max_size') * 1024 * 1024)
+            else:
+                _profiler = False
+        return _profiler or None
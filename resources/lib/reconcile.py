@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+import json
+import threading
+from resources.lib.helpers import addon, load_data, save_data, FileError
+from resources.lib.helpers.log import Logger
+
+# reconciliation of the watched state at startup
+# export is driven by notifications: whatever changed while the service was not running (another client writing to a
+# shared database, a database restore...) never reaches the nfo files
+# for each video, we keep the values of the last export to its nfo (watched, userrating, resume); at startup, these
+# values are compared against the library, fetched at once, and only the mismatches are exported again, so that nfo
+# files already in sync are not even looked for
+# on the very first run, there is nothing to compare against: instead of exporting the whole library, the current values
+# are recorded as exported, assuming the nfo files are in sync (as they were supposed to be before reconciliation)
+
+STATE_FILE = 'exported_states.json'
+
+# values of the library entry that an export writes to the nfo, depending on the settings
+# returns an empty dict if export does not write anything
+def get_exported_state(entry):
+    state = {}
+    if (addon.getSettingBool('movies.export.watched')):
+        state['watched'] = (entry['playcount'] > 0)
+    if (addon.getSettingBool('movies.export.userrating')):
+        state['userrating'] = entry['userrating']
+    if (addon.getSettingBool('movies.export.resume')):
+        resume = entry.get('resume') or {}
+        state['resume'] = [ resume.get('position', 0), resume.get('total', 0) ]
+    return state
+
+class ExportedStates(object):
+    def __init__(self, path = STATE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.log = Logger(self.__class__.__name__)
+        self.dirty = False
+        self.new = False # True if there was no (valid) file yet: nothing to compare against
+        try:
+            self.entries = json.loads(load_data(self.path)) # video_path => exported state
+        except (FileError, ValueError):
+            self.entries = {}
+            self.new = True
+
+    # True if the nfo of the video is known to hold this state
+    def matches(self, video_path, state):
+        with self.lock:
+            return (self.entries.get(video_path) == state)
+
+    def record(self, video_path, state):
+        with self.lock:
+            if (self.entries.get(video_path) != state):
+                self.entries[video_path] = state
+                self.dirty = True
+
+    def forget(self, video_path):
+        with self.lock:
+            if (self.entries.pop(video_path, None) is not None):
+                self.dirty = True
+
+    # drop the entries of videos that are no longer in the library
+    def retain(self, video_paths):
+        with self.lock:
+            for video_path in [ path for path in self.entries if (path not in video_paths) ]:
+                del self.entries[video_path]
+                self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if (not self.dirty):
+                return
+            content = json.dumps(self.entries, separators = (',', ':'))
+            self.dirty = False
+        try:
+            save_data(self.path, content)
+        except FileError as e:
+            self.log.warning('cannot save exported states: %s' % str(e))
+
+_states = None
+_states_lock = threading.Lock()
+
+# get the process-wide exported states, or None if reconciliation is disabled (setting movies.export.reconcile)
+def get_exported_states():
+    global _states
+    with _states_lock:
+        if (_states is None):
+            _states = ExportedStates() if (addon.getSettingBool('movies.export.reconcile')) else False
+        return _states or None
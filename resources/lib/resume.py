@@ -0,0 +1,100 @@
+from __future__ import unicode_literals
+import threading
+import time
+from resources.lib.helpers import addon
+from resources.lib.helpers.log import Logger
+from resources.lib.metrics import registry as metrics
+from resources.lib.tasks.export_base import ExportBatchTask
+
+# export of resume points
+# the resume point of a movie changes on every stop (and pause), often several times in a row: writing the nfo each time
+# would keep the NAS busy for nothing, so movies are only marked as dirty, and exported in batches:
+# - on a timer, every interval
+# - shortly after the end of a playback (Kodi saves the resume point asynchronously)
+# - on shutdown
+# the resume point is read from the library when the batch runs, so the last value wins, and a movie is written at most
+# once per interval (except on shutdown)
+
+class ResumeExporter(threading.Thread):
+    TICK = 1.0 # seconds between two checks of pending flushes
+    END_DELAY = 2.0 # seconds between the end of a playback and the flush
+
+    def __init__(self, add_task, interval):
+        super(ResumeExporter, self).__init__(name = 'resume-exporter')
+        self.daemon = True
+        self.add_task = add_task # queues a task (see NFOMonitor.add_task())
+        self.interval = interval # in seconds
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.log = Logger(self.__class__.__name__)
+        self.dirty = set() # IDs of movies whose resume point may have changed
+        self.last_flushed = {} # movie ID => time of the last flush it was part of
+        self.next_flush = time.time() + interval
+        self.requested_flush = None # time of a flush requested by the end of a playback
+
+    # the resume point of a movie may have changed
+    def mark(self, video_id):
+        with self.lock:
+            self.dirty.add(video_id)
+        metrics.counter('resume_marks_total', 'Nb of resume point changes notified').inc()
+
+    # flush shortly, e.g. because a playback ended
+    def request_flush(self):
+        with self.lock:
+            self.requested_flush = time.time() + self.END_DELAY
+
+    def run(self):
+        while (not self.stopped.wait(self.TICK)):
+            self.tick()
+
+    # flush if the interval is over, or if a flush was requested
+    def tick(self):
+        now = time.time()
+        with self.lock:
+            due = (now >= self.next_flush or (self.requested_flush is not None and now >= self.requested_flush))
+        if (due):
+            self.flush()
+
+    def stop(self):
+        self.stopped.set()
+        self.flush(force = True) # last resume points, on shutdown
+
+    # queue an export of the dirty movies; movies flushed less than an interval ago wait for the next flush, unless forced
+    def flush(self, force = False):
+        now = time.time()
+        with self.lock:
+            self.next_flush = now + self.interval
+            self.requested_flush = None
+            ready = set(video_id for video_id in self.dirty if (force or now - self.last_flushed.get(video_id, 0) >= self.interval))
+            if (not ready):
+                return
+            self.dirty -= ready
+            for video_id in ready:
+                self.last_flushed[video_id] = now
+            # forget movies that cannot be held back anymore
+            self.last_flushed = dict((video_id, t) for video_id, t in self.last_flushed.items() if (now - t < self.interval))
+        self.log.debug('exporting resume points of %d movies (%d held back)' % (len(ready), len(self.dirty)))
+        metrics.counter('resume_flushes_total', 'Nb of batches of resume points exported').inc()
+        self.add_task(ExportBatchTask('movie', ready, silent = True))
+
+_exporter = None
+
+# start exporting resume points (setting movies.export.resume)
+def start_resume_exporter(add_task):
+    global _exporter
+    if (not addon.getSettingBool('movies.export.resume') or _exporter):
+        return
+    _exporter = ResumeExporter(add_task, max(addon.getSettingInt('movies.export.resume.interval'), 1))
+    _exporter.start()
+
+# get the resume point exporter, or None if resume points are not exported
+def get_resume_exporter():
+    return _exporter
+
+# flush the pending resume points, and stop
+def stop_resume_exporter():
+    global _exporter
+    if (_exporter):
+        _exporter.stop()
+        _exporter.join()
+        _exporter = None
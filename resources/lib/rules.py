@@ -0,0 +1,190 @@
+from __future__ import unicode_literals
+import json
+import re
+import threading
+import xbmcvfs
+from bs4 import Tag
+from resources.lib.helpers import Error
+from resources.lib.helpers.log import Logger
+
+# declarative tag rules
+# most scripts have the same shape: look for a few facts in the nfo (audio language, actor...), then add a tag
+# rules express this in a JSON file, compiled once; all the facts needed by the rules are collected in a single pass over
+# the tree, and the resulting tags are merged into the nfo in one step
+#
+# file format (see resources/script_examples/example_03-tag_rules.json):
+# {
+#     "replace_tags": false,    # remove all existing <tag> elements first (default: keep them, only add missing ones)
+#     "rules": [
+#         { "tag": "audio: fr", "audio_language": "fre" },
+#         { "tag": "video: UltraHD / 4k", "min_video_height": 2160 },
+#         ...
+#     ]
+# }
+# within a rule, all conditions must be met; a condition given a list of values is met if any of them is
+# conditions:
+#   path                regular expression, searched in the path of the video file (case insensitive)
+#   audio_language      language of an audio stream
+#   subtitle_language   language of a subtitle stream
+#   actor               name of an actor
+#   video_height        height of a video stream (exact value)
+#   min_video_height    minimum height of a video stream
+#   top250              true if the movie is in IMDB top 250, false if not
+
+class RulesError(Error):
+    pass
+
+# facts collected from the tree, as (parent element name, element name) => fact name
+# e.g. <audio><language>fre</language></audio> => audio_language
+FACT_ELEMENTS = {
+    ('audio', 'language'): 'audio_language',
+    ('subtitle', 'language'): 'subtitle_language',
+    ('actor', 'name'): 'actor',
+    ('video', 'height'): 'video_height',
+}
+
+def _as_list(value):
+    return value if (isinstance(value, list)) else [ value ]
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+# compile a condition into (fact name, predicate on the set of values of this fact)
+def _compile_condition(name, value):
+    if (name == 'path'):
+        regexes = [ re.compile(pattern, re.IGNORECASE | re.UNICODE) for pattern in _as_list(value) ]
+        return ('path', lambda paths: any(regex.search(path) for regex in regexes for path in paths))
+    if (name in ('audio_language', 'subtitle_language', 'actor')):
+        expected = frozenset(v.strip().lower() for v in _as_list(value))
+        return (name, lambda values: not expected.isdisjoint(values))
+    if (name == 'video_height'):
+        expected = frozenset(int(v) for v in _as_list(value))
+        return (name, lambda values: not expected.isdisjoint(values))
+    if (name == 'min_video_height'):
+        minimum = int(value)
+        return ('video_height', lambda values: any(v >= minimum for v in values))
+    if (name == 'top250'):
+        expected = bool(value)
+        return (name, lambda values: bool(values) == expected)
+    raise RulesError('unknown condition \'%s\'' % name)
+
+class Rule(object):
+    def __init__(self, definition):
+        try:
+            self.tag = definition['tag'].strip()
+            self.conditions = [ _compile_condition(k, v) for k, v in definition.items() if (k != 'tag') ]
+        except (KeyError, AttributeError, TypeError, ValueError, re.error) as e:
+            raise RulesError('invalid rule: %s' % json.dumps(definition), e)
+        if (not self.tag or not self.conditions):
+            raise RulesError('invalid rule: %s' % json.dumps(definition))
+
+    @property
+    def facts(self):
+        return set(fact for fact, predicate in self.conditions)
+
+    def matches(self, facts):
+        return all(predicate(facts[fact]) for fact, predicate in self.conditions)
+
+class RuleSet(object):
+    def __init__(self, content, label = 'raw'):
+        self.label = label
+        self.log = Logger('rules[%s]' % label)
+        try:
+            definition = json.loads(content)
+            self.replace_tags = bool(definition.get('replace_tags', False))
+            self.rules = [ Rule(rule) for rule in definition['rules'] ]
+        except RulesError:
+            raise
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise RulesError('invalid rules file', e)
+        # only collect the facts some rule depends on
+        self.facts = set()
+        for rule in self.rules:
+            self.facts |= rule.facts
+        self.fact_elements = dict((k, v) for k, v in FACT_ELEMENTS.items() if (v in self.facts))
+
+    # collect facts from the tree, in a single pass over all its elements
+    def collect(self, root, video_path):
+        facts = dict((fact, set()) for fact in self.facts)
+        facts['path'] = set([ video_path ]) if (video_path) else set()
+        facts['tag'] = set()
+        for elt in root.descendants:
+            if (not isinstance(elt, Tag)):
+                continue
+            parent = elt.parent
+            if (parent is root):
+                if (elt.name == 'tag'):
+                    facts['tag'].add(elt.get_text().strip())
+                elif (elt.name == 'top250' and 'top250' in self.facts):
+                    if ((_to_int(elt.get_text()) or 0) > 0):
+                        facts['top250'].add(True)
+                continue
+            fact = self.fact_elements.get((parent.name, elt.name))
+            if (fact is None):
+                continue
+            value = elt.get_text().strip()
+            if (fact == 'video_height'):
+                value = _to_int(value)
+                if (value is None):
+                    continue
+            else:
+                value = value.lower()
+            facts[fact].add(value)
+        return facts
+
+    # compute the tags given by the rules
+    def evaluate(self, root, video_path = None):
+        facts = self.collect(root, video_path)
+        return (set(rule.tag for rule in self.rules if (rule.matches(facts))), facts['tag'])
+
+    # apply the rules to the tree: add the missing tags (and remove the other ones if replace_tags is set)
+    # returns True if the tree was modified
+    def apply(self, soup, root, video_path = None):
+        (tags, existing) = self.evaluate(root, video_path)
+        modified = False
+        if (self.replace_tags and existing - tags):
+            for elt in root.find_all('tag', recursive = False):
+                if (elt.get_text().strip() not in tags):
+                    elt.decompose()
+            existing &= tags
+            modified = True
+        for tag in sorted(tags - existing):
+            elt = soup.new_tag('tag')
+            elt.string = tag
+            root.append(elt)
+            modified = True
+        if (modified):
+            self.log.debug('tags: %s' % ', '.join(sorted(tags)))
+        return modified
+
+# compiled rules, per file, validated by the mtime and size of the file
+_rules_cache = {}
+_rules_cache_lock = threading.Lock()
+
+# load and compile a rules file, or get it from cache if it did not change
+def load_rules(path):
+    if (not xbmcvfs.exists(path)):
+        raise RulesError('rules file does not exist: \'%s\'' % path)
+    try:
+        stat = xbmcvfs.Stat(path)
+        key = (stat.st_mtime(), stat.st_size())
+    except Exception:
+        key = None
+    with _rules_cache_lock:
+        cached = _rules_cache.get(path)
+        if (cached and key and cached[0] == key):
+            return cached[1]
+    try:
+        fp = xbmcvfs.File(path)
+        content = fp.read()
+        fp.close()
+    except Exception as e:
+        raise RulesError('cannot load rules file: \'%s\'' % path, e)
+    rule_set = RuleSet(content.decode('utf-8') if (isinstance(content, bytes)) else content, label = path)
+    if (key):
+        with _rules_cache_lock:
+            _rules_cache[path] = (key, rule_set)
+    return rule_set
@@ -0,0 +1,259 @@
+from __future__ import unicode_literals
+import threading
+import time
+import xbmc
+from resources.lib.helpers import addon
+from resources.lib.helpers.log import Logger
+from resources.lib.metrics import registry as metrics
+
+# throttling of background work
+# syncing a large library means many NFO reads/writes and library refreshes, typically on the same NAS the videos are
+# played from: while a video is playing, or when I/O gets slow, we reduce the nb of tasks running in parallel, and
+# slow down I/O and refreshes, so that playback does not stutter
+# the throttle level goes up immediately, and back down one step at a time once conditions are back to normal
+
+LEVEL_NONE = 0 # full speed
+LEVEL_LIGHT = 1 # slow I/O, or video playing
+LEVEL_HEAVY = 2 # video playing, and slow I/O
+LEVEL_NAMES = [ 'none', 'light', 'heavy' ]
+
+class ThrottleController(object):
+    CHECK_INTERVAL = 1.0 # seconds between two checks of the player state
+    RAMP_UP_INTERVAL = 10.0 # seconds at a lower level of constraints before decreasing the throttle level by one step
+    LATENCY_WEIGHT = 0.2 # weight of the last measure in the I/O latency moving average
+    IO_DELAYS = [ 0, 0.05, 0.25 ] # pause before each I/O operation, per level, in seconds
+    REFRESH_INTERVALS = [ 0, 1.0, 5.0 ] # minimum time between two library refreshes, per level, in seconds
+
+    def __init__(self, nb_workers, latency_threshold = 0.5, log = None):
+        self.nb_workers = max(nb_workers, 1)
+        self.latency_threshold = latency_threshold # in seconds
+        self.log = log
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.player = xbmc.Player()
+        self.level = LEVEL_NONE
+        self.playing = False
+        self.io_latency = 0.0 # moving average, in seconds
+        self.nb_active = 0 # nb of tasks currently running
+        self.last_check = 0
+        self.last_level_change = 0
+        self.last_refresh = 0
+        # stats
+        self.max_level = LEVEL_NONE
+        self.nb_delayed_tasks = 0
+        self.delay_time = 0.0 # total time spent pacing I/O and refreshes
+
+    # update the throttle level, at most every CHECK_INTERVAL; returns the current level
+    def update(self):
+        now = time.time()
+        with self.lock:
+            if (now - self.last_check < self.CHECK_INTERVAL):
+                return self.level
+            self.last_check = now
+            try:
+                self.playing = self.player.isPlayingVideo()
+            except Exception:
+                self.playing = False
+            target = (LEVEL_LIGHT if (self.playing) else LEVEL_NONE) + (1 if (self.io_latency > self.latency_threshold) else 0)
+            if (target > self.level or (target < self.level and now - self.last_level_change >= self.RAMP_UP_INTERVAL)):
+                level = target if (target > self.level) else self.level - 1
+                if (self.log):
+                    self.log.debug('throttle level %s => %s (playing: %s, I/O latency: %dms)' % (LEVEL_NAMES[self.level], LEVEL_NAMES[level], self.playing, self.io_latency * 1000))
+                self.level = level
+                self.last_level_change = now
+                self.max_level = max(self.max_level, level)
+            elif (target == self.level):
+                self.last_level_change = now # ramp up only after RAMP_UP_INTERVAL without constraints
+            return self.level
+
+    # nb of tasks allowed to run in parallel at the current level
+    @property
+    def max_workers(self):
+        if (self.level == LEVEL_NONE):
+            return self.nb_workers
+        if (self.level == LEVEL_LIGHT):
+            return max(self.nb_workers // 2, 1)
+        return 1
+
+    # to be called by worker threads before starting a task; returns False if the task must wait
+    def acquire_worker(self):
+        self.update()
+        with self.lock:
+            if (self.nb_active >= self.max_workers):
+                self.nb_delayed_tasks += 1
+                return False
+            self.nb_active += 1
+            return True
+
+    def release_worker(self):
+        with self.lock:
+            self.nb_active -= 1
+
+    # report the duration of an I/O operation (nfo load, library refresh...)
+    def record_io(self, duration):
+        with self.lock:
+            self.io_latency += self.LATENCY_WEIGHT * (duration - self.io_latency)
+
+    # pause before an I/O operation, depending on the current level
+    def pace_io(self):
+        delay = self.IO_DELAYS[self.update()]
+        if (delay):
+            time.sleep(delay)
+            with self.lock:
+                self.delay_time += delay
+
+    # wait until the next library refresh is allowed, depending on the current level
+    def pace_refresh(self):
+        with self.refresh_lock:
+            delay = self.last_refresh + self.REFRESH_INTERVALS[self.update()] - time.time()
+            if (delay > 0):
+                time.sleep(delay)
+                with self.lock:
+                    self.delay_time += delay
+            self.last_refresh = time.time()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'level': LEVEL_NAMES[self.level],
+                'max_level': LEVEL_NAMES[self.max_level],
+                'playing': self.playing,
+                'io_latency_ms': int(self.io_latency * 1000),
+                'max_workers': self.max_workers,
+                'active_workers': self.nb_active,
+                'delayed_tasks': self.nb_delayed_tasks,
+                'delay_time': round(self.delay_time, 2),
+            }
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+# get the process-wide throttle controller, or None if disabled (setting movies.throttle.active)
+def get_throttle():
+    global _throttle
+    with _throttle_lock:
+        if (_throttle is None):
+            if (addon.getSettingBool('movies.throttle.active')):
+                _throttle = ThrottleController(addon.getSettingInt('debug.nb_threads'),
+                    latency_threshold = addon.getSettingInt('debug.throttle.io_latency') / 1000.0, log = Logger('ThrottleController'))
+                metrics.gauge('throttle_level', 'Current throttle level (0: none, 1: light, 2: heavy)').set_function(lambda: _throttle.level)
+                metrics.gauge('io_latency_seconds', 'Moving average of I/O latency').set_function(lambda: _throttle.io_latency)
+            else:
+                _throttle = False
+        return _throttle or None
+
+# adaptive sizing of the worker pool
+# the best nb of tasks running in parallel depends on where the time goes: a library on a local disk is CPU bound, a NAS
+# or a busy Kodi is latency bound, and both change over time; instead of a fixed nb of threads, the nb of workers allowed
+# to run is adjusted the same way TCP adjusts its congestion window (AIMD):
+# - additive increase: while tasks are waiting in the queue, i.e. the allowed workers cannot keep up, one more worker is allowed
+#   at each interval, as long as the per-item latency stays close to the best one observed
+# - multiplicative decrease: as soon as the per-item latency goes well above the best one observed, which means that
+#   running more tasks in parallel only makes each of them slower, the nb of workers is halved
+# the best latency slowly drifts up, so that a permanent change of conditions (e.g. NAS gone to sleep) becomes the new
+# baseline instead of keeping the pool at its minimum forever
+# latency and baseline are tracked per task class: a pipelined import of the whole library spends far less time per item
+# than the export of a single movie, whose latency would otherwise always look congested
+
+class ConcurrencyController(object):
+    ADJUST_INTERVAL = 2.0 # seconds between two decisions
+    LATENCY_WEIGHT = 0.3 # weight of the last task in the per-item latency moving average
+    LATENCY_TOLERANCE = 2.0 # latency / baseline ratio above which the nb of workers is decreased
+    DECREASE_FACTOR = 0.5
+    BASELINE_DRIFT = 1.1 # growth of the baseline at each interval, while the latency stays above it
+
+    def __init__(self, min_workers, max_workers, backlog = None, log = None):
+        self.max_workers = max(max_workers, 1)
+        self.min_workers = min(max(min_workers, 1), self.max_workers)
+        self.backlog = backlog # function returning the nb of tasks waiting
+        self.log = log
+        self.lock = threading.Lock()
+        self.limit = max(self.min_workers, min(2, self.max_workers)) # same as the former default nb of threads
+        self.nb_active = 0 # nb of tasks currently running
+        self.item_latency = {} # task class => moving average, in seconds
+        self.baseline = {} # task class => best per-item latency observed, in seconds
+        self.nb_samples = {} # task class => nb of tasks reported since the last decision
+        self.last_adjust = time.time()
+        # stats
+        self.nb_increases = 0
+        self.nb_decreases = 0
+
+    # take a decision, at most every ADJUST_INTERVAL; returns the current limit
+    def update(self):
+        now = time.time()
+        with self.lock:
+            if (now - self.last_adjust < self.ADJUST_INTERVAL):
+                return self.limit
+            self.last_adjust = now
+            backlog = self.backlog() if (self.backlog) else 0
+            limit = self.limit
+            # only the task classes reported since the last decision tell anything about the current limit
+            congested = False
+            for task_class in self.nb_samples:
+                self.baseline[task_class] = min(self.item_latency[task_class], self.baseline[task_class] * self.BASELINE_DRIFT)
+                if (self.item_latency[task_class] > self.baseline[task_class] * self.LATENCY_TOLERANCE):
+                    congested = True
+            if (congested and limit > self.min_workers):
+                limit = max(int(limit * self.DECREASE_FACTOR), self.min_workers)
+                direction = 'decrease'
+            elif (not congested and backlog > 0 and limit < self.max_workers):
+                limit += 1
+                direction = 'increase'
+            sampled = self.nb_samples
+            self.nb_samples = {}
+            if (limit == self.limit):
+                return self.limit
+            if (self.log):
+                self.log.info('worker limit %d => %d (backlog: %d, item latency / baseline: %s)' % (self.limit, limit, backlog,
+                    ', '.join('%s %dms / %dms' % (task_class, self.item_latency[task_class] * 1000, self.baseline[task_class] * 1000)
+                        for task_class in sorted(sampled)) or 'n/a'))
+            if (direction == 'increase'):
+                self.nb_increases += 1
+            else:
+                self.nb_decreases += 1
+                self.item_latency = {} # judge the new limit on its own tasks only
+            metrics.counter('worker_limit_changes_total', 'Nb of decisions of the adaptive worker pool', { 'direction': direction }).inc()
+            self.limit = limit
+            return self.limit
+
+    # to be called by worker threads before starting a task; returns False if the task must wait
+    def acquire_worker(self):
+        limit = self.update()
+        with self.lock:
+            if (self.nb_active >= limit):
+                return False
+            self.nb_active += 1
+            return True
+
+    def release_worker(self):
+        with self.lock:
+            self.nb_active -= 1
+
+    # report a finished task, by the name of its class; tasks without any item say nothing about the per-item latency
+    def record_task(self, task_class, duration, nb_items):
+        if (nb_items <= 0):
+            return
+        latency = duration / nb_items
+        with self.lock:
+            if (task_class not in self.item_latency):
+                self.item_latency[task_class] = latency
+            else:
+                self.item_latency[task_class] += self.LATENCY_WEIGHT * (latency - self.item_latency[task_class])
+            if (task_class not in self.baseline or self.item_latency[task_class] < self.baseline[task_class]):
+                self.baseline[task_class] = self.item_latency[task_class]
+            self.nb_samples[task_class] = self.nb_samples.get(task_class, 0) + 1
+            item_latency = self.item_latency[task_class]
+        metrics.gauge('item_latency_seconds', 'Moving average of the processing time per library entry', { 'task': task_class }).set(item_latency)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'min_workers': self.min_workers,
+                'max_workers': self.max_workers,
+                'active_workers': self.nb_active,
+                'item_latency_ms': dict((task_class, int(latency * 1000)) for task_class, latency in self.item_latency.items()),
+                'baseline_ms': dict((task_class, int(latency * 1000)) for task_class, latency in self.baseline.items()),
+                'increases': self.nb_increases,
+                'decreases': self.nb_decreases,
+            }
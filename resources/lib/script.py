@@ -10,6 +10,9 @@ class ScriptExecError(ScriptError):
 class ScriptFileError(ScriptError):
     pass
 
+# scripts containing this marker are always executed in-process, e.g. because they use Kodi modules (see script_pool.py)
+IN_PROCESS_MARKER = 'nfo-sync: in-process'
+
 # base script handler class
 # able to execute some raw script if given on constructor
 class ScriptHandler(object):
@@ -28,6 +31,9 @@ class ScriptHandler(object):
     @property
     def signature(self):
         return 'script[%s]' % self.label
+    @property
+    def in_process(self):
+        return (IN_PROCESS_MARKER in self.content)
 
     def execute(self, locals_dict = {}):
         # check that we have content at least
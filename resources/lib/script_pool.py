@@ -0,0 +1,226 @@
+from __future__ import unicode_literals
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from Queue import Queue, Empty
+import xbmc
+import bs4
+from bs4 import BeautifulSoup
+from resources.lib.helpers import addon
+from resources.lib.helpers.log import Logger
+from resources.lib.script import ScriptError, ScriptExecError
+
+# execution of user scripts in separate processes
+# in-process, scripts run under the interpreter lock of Kodi: a slow or runaway script stalls the task, and CPU-heavy
+# scripts cannot use more than one core; here the nfo is serialized, sent to a pool of worker processes running
+# script_worker.py with an external Python interpreter, and the modified nfo is sent back
+# each execution is bounded in wall time (the worker is killed beyond the timeout) and in CPU time (RLIMIT_CPU)
+# scripts needing Kodi modules must run in-process: see ScriptHandler.in_process
+
+WORKER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script_worker.py')
+
+class ScriptTimeoutError(ScriptExecError):
+    pass
+class ScriptWorkerError(ScriptError):
+    pass
+
+# error raised by the script in the worker process, rebuilt for logging
+class RemoteScriptException(Exception):
+    def __init__(self, error_type, message):
+        super(RemoteScriptException, self).__init__('%s: %s' % (error_type, message))
+
+class ScriptStats(object):
+    def __init__(self):
+        self.nb_calls = 0
+        self.nb_errors = 0
+        self.nb_timeouts = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, duration):
+        self.nb_calls += 1
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+
+    def __str__(self):
+        return '%d calls, avg %dms, max %dms, %d errors, %d timeouts' % (self.nb_calls,
+            1000 * self.total_time / self.nb_calls if (self.nb_calls) else 0, 1000 * self.max_time, self.nb_errors, self.nb_timeouts)
+
+class _Worker(object):
+    def __init__(self, interpreter, env):
+        with open(os.devnull, 'wb') as devnull:
+            self.process = subprocess.Popen([ interpreter, WORKER_PATH ], stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = devnull,
+                env = env, close_fds = (os.name != 'nt'))
+        self.scripts = set() # keys of the scripts already sent to this worker
+        self.responses = Queue()
+        reader = threading.Thread(target = self._read, name = 'script-worker-%d' % self.process.pid)
+        reader.daemon = True
+        reader.start()
+
+    def _read(self):
+        try:
+            for line in iter(self.process.stdout.readline, b''):
+                self.responses.put(line)
+        finally:
+            self.responses.put(None) # end of stream: the process died
+
+    @property
+    def alive(self):
+        return (self.process.poll() is None)
+
+    # send a request, and wait for its response
+    # returns None if the worker died, raises Empty on timeout
+    def call(self, request, timeout):
+        try:
+            self.process.stdin.write(json.dumps(request).encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            return None
+        line = self.responses.get(timeout = timeout)
+        return json.loads(line.decode('utf-8')) if (line) else None
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+
+class ScriptPool(object):
+    def __init__(self, interpreter, size = 2, timeout = 10, cpu_limit = 10, log = None):
+        self.interpreter = interpreter
+        self.size = max(size, 1)
+        self.timeout = timeout # wall time limit per execution, in seconds
+        self.cpu_limit = cpu_limit # CPU time limit per execution, in seconds
+        self.log = log
+        self.idle = Queue()
+        self.nb_workers = 0
+        self.lock = threading.Lock()
+        self.stats = {} # script label => ScriptStats
+        # make the BeautifulSoup package used by Kodi available to the workers
+        self.env = dict(os.environ)
+        bs4_dir = os.path.dirname(os.path.dirname(os.path.abspath(bs4.__file__)))
+        self.env[str('PYTHONPATH')] = os.pathsep.join([ bs4_dir ] + ([ os.environ['PYTHONPATH'] ] if (os.environ.get('PYTHONPATH')) else []))
+
+    def _get_worker(self):
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            spawn = (self.nb_workers < self.size)
+            if (spawn):
+                self.nb_workers += 1
+        if (not spawn):
+            return self.idle.get()
+        try:
+            return _Worker(self.interpreter, self.env)
+        except (IOError, OSError) as e:
+            with self.lock:
+                self.nb_workers -= 1
+            raise ScriptWorkerError('cannot start script worker with \'%s\'' % self.interpreter, e)
+
+    def _release_worker(self, worker):
+        if (worker.alive):
+            self.idle.put(worker)
+        else:
+            with self.lock:
+                self.nb_workers -= 1
+
+    def _get_stats(self, label):
+        with self.lock:
+            return self.stats.setdefault(label, ScriptStats())
+
+    # update the stats of a script; the same script runs in several task threads at once
+    def _record(self, stats, duration = None, errors = 0, timeouts = 0):
+        with self.lock:
+            if (duration is not None):
+                stats.add(duration)
+            stats.nb_errors += errors
+            stats.nb_timeouts += timeouts
+
+    # execute the script against a copy of the tree, in a worker process
+    # returns the modified tree, as (soup, root)
+    def execute(self, script, root_tag, root, locals_dict):
+        stats = self._get_stats(script.label)
+        key = hashlib.sha1(script.content if (isinstance(script.content, bytes)) else script.content.encode('utf-8')).hexdigest()
+        request = {
+            'key': key,
+            'nfo': '%s' % root,
+            'root_tag': root_tag,
+            'locals': locals_dict,
+            'cpu_limit': self.cpu_limit,
+        }
+        worker = self._get_worker()
+        start = time.time()
+        try:
+            if (key not in worker.scripts):
+                request['content'] = script.content.decode('utf-8') if (isinstance(script.content, bytes)) else script.content
+            response = worker.call(request, self.timeout)
+            if (response is None):
+                self._record(stats, errors = 1)
+                raise ScriptWorkerError('script worker process died')
+            worker.scripts.add(key)
+        except Empty:
+            worker.kill()
+            self._record(stats, timeouts = 1)
+            raise ScriptTimeoutError('script execution timed out after %ds' % self.timeout)
+        finally:
+            self._record(stats, duration = time.time() - start)
+            self._release_worker(worker)
+
+        for level, msg in response.get('logs', []):
+            getattr(script.log, level, script.log.debug)(msg)
+        if (not response['ok']):
+            self._record(stats, errors = 1)
+            raise ScriptExecError('script execution failed', RemoteScriptException(response.get('error_type'), response.get('error')))
+        soup = BeautifulSoup(response['nfo'], 'html.parser')
+        return (soup, soup.find(root_tag))
+
+    # summary of the stats of a script, or None if it never ran in the pool
+    def get_stats(self, label):
+        with self.lock:
+            stats = self.stats.get(label)
+            return ('%s' % stats) if (stats) else None
+
+    def close(self):
+        while (True):
+            try:
+                worker = self.idle.get_nowait()
+            except Empty:
+                break
+            try:
+                worker.process.stdin.close()
+                worker.process.wait()
+            except (IOError, OSError):
+                worker.kill()
+
+_script_pool = None
+_script_pool_lock = threading.Lock()
+
+# get the process-wide pool of script workers, or None if scripts should run in-process
+# (setting movies.general.script.isolated off, or no usable interpreter)
+def get_script_pool():
+    global _script_pool
+    with _script_pool_lock:
+        if (_script_pool is None):
+            _script_pool = False
+            if (addon.getSettingBool('movies.general.script.isolated')):
+                interpreter = xbmc.translatePath(addon.getSetting('movies.general.script.interpreter'))
+                if (interpreter and os.path.isfile(interpreter)):
+                    _script_pool = ScriptPool(interpreter, addon.getSettingInt('debug.script.processes'),
+                        timeout = addon.getSettingInt('debug.script.timeout'), cpu_limit = addon.getSettingInt('debug.script.cpu_limit'),
+                        log = Logger('ScriptPool'))
+                else:
+                    Logger('ScriptPool').warning('no valid python interpreter configured (\'%s\') => running scripts in-process' % interpreter)
+        return _script_pool or None
+
+def stop_script_pool():
+    global _script_pool
+    with _script_pool_lock:
+        if (_script_pool):
+            _script_pool.close()
+        _script_pool = None
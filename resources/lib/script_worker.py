@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import json
+import sys
+import time
+import traceback
+try:
+    from StringIO import StringIO # Python 2: accepts both str and unicode
+except ImportError:
+    from io import StringIO
+try:
+    import resource
+    import signal
+except ImportError: # Windows: no CPU limit
+    resource = None
+from bs4 import BeautifulSoup
+
+# worker process executing user scripts out of Kodi (see script_pool.py)
+# runs with any Python interpreter having BeautifulSoup 4, without Kodi modules, and talks to the addon through
+# line-delimited JSON on stdin / stdout:
+#   request:  { "key": script hash, "content": script source (only on first use of a script by this worker),
+#               "nfo": XML content, "root_tag": "movie", "locals": { video_path, nfo_path, ... }, "cpu_limit": seconds }
+#   response: { "ok": true, "nfo": modified XML content, "logs": [ [ level, message ], ... ], "cpu_time": seconds }
+#          or { "ok": false, "error": message, "error_type": exception class, "logs": [...] }
+# anything the script prints goes to the logs, so that it cannot corrupt the protocol
+
+PY2 = (sys.version_info[0] == 2)
+
+class CPULimitExceeded(Exception):
+    pass
+
+class ScriptLog(object):
+    def __init__(self):
+        self.entries = []
+    def _add(self, level, msg):
+        self.entries.append([ level, msg if (isinstance(msg, type(''))) else str(msg) ])
+    def debug(self, msg):
+        self._add('debug', msg)
+    def info(self, msg):
+        self._add('info', msg)
+    def notice(self, msg):
+        self._add('notice', msg)
+    def warning(self, msg):
+        self._add('warning', msg)
+    def error(self, msg):
+        self._add('error', msg)
+    def fatal(self, msg):
+        self._add('fatal', msg)
+
+def _on_cpu_limit(signum, frame):
+    raise CPULimitExceeded('CPU time limit exceeded')
+
+def _cpu_time():
+    if (not resource):
+        return time.clock() if (PY2) else time.process_time()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+# allow the script to use cpu_limit more seconds of CPU time; SIGXCPU is raised as an exception beyond that
+def _set_cpu_limit(cpu_limit):
+    if (not resource or not cpu_limit):
+        return
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = int(_cpu_time()) + int(cpu_limit) + 1
+    if (hard != resource.RLIM_INFINITY):
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+# lift the limit once the script is done: the worker itself must not get SIGXCPU while idle or serializing the nfo
+def _clear_cpu_limit(cpu_limit):
+    if (not resource or not cpu_limit):
+        return
+    hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+    resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+def run(request, scripts):
+    key = request['key']
+    if (key not in scripts):
+        if ('content' not in request):
+            return { 'ok': False, 'error': 'unknown script', 'error_type': 'KeyError', 'missing': True }
+        content = request['content']
+        scripts[key] = compile(content.encode('utf-8') if (PY2) else content, '<script>', 'exec')
+    log = ScriptLog()
+    soup = BeautifulSoup(request['nfo'], 'html.parser')
+    root = soup.find(request['root_tag'])
+    locals_dict = dict(request['locals'])
+    locals_dict.update({ 'soup': soup, 'root': root, 'log': log })
+    output = StringIO()
+    start = _cpu_time()
+    _set_cpu_limit(request.get('cpu_limit'))
+    sys.stdout = output
+    try:
+        exec(scripts[key], {}, locals_dict)
+    except Exception as e:
+        return { 'ok': False, 'error': '%s' % e, 'error_type': e.__class__.__name__, 'traceback': traceback.format_exc(), 'logs': log.entries }
+    finally:
+        _clear_cpu_limit(request.get('cpu_limit'))
+        sys.stdout = sys.__stdout__
+        if (output.getvalue()):
+            log.debug(output.getvalue().rstrip())
+    return { 'ok': True, 'nfo': '%s' % root, 'logs': log.entries, 'cpu_time': _cpu_time() - start }
+
+def main():
+    if (resource):
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    out = sys.stdout
+    scripts = {}
+    while True:
+        line = sys.stdin.readline()
+        if (not line):
+            break
+        try:
+            response = run(json.loads(line), scripts)
+        except Exception as e:
+            response = { 'ok': False, 'error': '%s' % e, 'error_type': e.__class__.__name__ }
+        out.write(json.dumps(response) + '\n')
+        out.flush()
+
+if __name__ == '__main__':
+    main()
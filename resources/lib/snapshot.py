@@ -0,0 +1,182 @@
+from __future__ import unicode_literals
+import mmap
+import os
+import struct
+from array import array
+
+# compact snapshot of the library, persisted between two imports
+# one fixed-size record per entry, sorted by file path, followed by all file paths packed in a single utf-8 blob:
+#   header: magic, format version, nb of records, size of the paths blob
+#   record: video ID, path offset, path length, playcount, userrating, nfo mtime
+# snapshots are built with parallel arrays (SnapshotBuilder), and read back through a memory map (MappedSnapshot),
+# so that neither of them needs one Python object per entry
+# entries are keyed by file path: the video ID of an entry changes every time it is refreshed (Kodi removes it, then adds
+# it again), its path does not
+
+MAGIC = b'NFOS'
+VERSION = 2
+HEADER = struct.Struct(str('<4sHxxII'))
+RECORD = struct.Struct(str('<IIIHbxd'))
+
+class SnapshotError(Exception):
+    pass
+
+class SnapshotEntry(object):
+    __slots__ = ('video_id', 'path', 'playcount', 'userrating', 'nfo_mtime')
+
+    def __init__(self, video_id, path, playcount, userrating, nfo_mtime):
+        self.video_id = video_id
+        self.path = path
+        self.playcount = playcount
+        self.userrating = userrating
+        self.nfo_mtime = nfo_mtime
+
+    # True if anything we track differs between two entries of the same path
+    def differs(self, other):
+        return (self.playcount != other.playcount or self.userrating != other.userrating or self.nfo_mtime != other.nfo_mtime)
+
+# snapshot being built, column by column
+class SnapshotBuilder(object):
+    def __init__(self):
+        self.video_ids = array(str('I'))
+        self.path_offsets = array(str('I'))
+        self.path_lengths = array(str('I'))
+        self.playcounts = array(str('H'))
+        self.userratings = array(str('b'))
+        self.nfo_mtimes = array(str('d'))
+        self.paths = bytearray()
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    def add(self, video_id, path, playcount = 0, userrating = 0, nfo_mtime = 0):
+        encoded = path.encode('utf-8')
+        self.video_ids.append(video_id)
+        self.path_offsets.append(len(self.paths))
+        self.path_lengths.append(len(encoded))
+        self.paths.extend(encoded)
+        self.playcounts.append(min(max(int(playcount or 0), 0), 0xFFFF))
+        self.userratings.append(min(max(int(userrating or 0), -128), 127))
+        self.nfo_mtimes.append(float(nfo_mtime or 0))
+
+    def entry(self, i):
+        offset = self.path_offsets[i]
+        path = bytes(self.paths[offset:offset + self.path_lengths[i]]).decode('utf-8')
+        return SnapshotEntry(self.video_ids[i], path, self.playcounts[i], self.userratings[i], self.nfo_mtimes[i])
+
+    # indexes of the entries, sorted by (utf-8 encoded) file path
+    def sorted_indexes(self):
+        paths, offsets, lengths = self.paths, self.path_offsets, self.path_lengths
+        return sorted(range(len(offsets)), key = lambda i: paths[offsets[i]:offsets[i] + lengths[i]])
+
+    # iterate over entries, sorted by file path
+    def __iter__(self):
+        for i in self.sorted_indexes():
+            yield self.entry(i)
+
+    # write the snapshot to disk, atomically
+    def save(self, path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, len(self), len(self.paths)))
+            for i in self.sorted_indexes():
+                fp.write(RECORD.pack(self.video_ids[i], self.path_offsets[i], self.path_lengths[i], self.playcounts[i], self.userratings[i], self.nfo_mtimes[i]))
+            fp.write(bytes(self.paths))
+        if (os.path.exists(path)):
+            os.remove(path) # Windows does not allow renaming over an existing file
+        os.rename(tmp_path, path)
+
+# snapshot read from disk through a memory map; records are decoded on access only
+class MappedSnapshot(object):
+    def __init__(self, path):
+        self.fp = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.fp.fileno(), 0, access = mmap.ACCESS_READ)
+            (magic, version, self.count, paths_size) = HEADER.unpack_from(self.map, 0)
+            if (magic != MAGIC or version != VERSION):
+                raise SnapshotError('unsupported snapshot format')
+            self.paths_start = HEADER.size + self.count * RECORD.size
+            if (len(self.map) != self.paths_start + paths_size):
+                raise SnapshotError('truncated snapshot')
+        except (SnapshotError, struct.error, ValueError, EnvironmentError):
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if (getattr(self, 'map', None) is not None):
+            self.map.close()
+            self.map = None
+        self.fp.close()
+
+    # utf-8 encoded file path of the i-th record
+    def path_bytes(self, i):
+        (offset, length) = struct.unpack_from(str('<II'), self.map, HEADER.size + i * RECORD.size + 4)
+        start = self.paths_start + offset
+        return self.map[start:start + length]
+
+    def entry(self, i):
+        (video_id, offset, length, playcount, userrating, nfo_mtime) = RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size)
+        start = self.paths_start + offset
+        return SnapshotEntry(video_id, self.map[start:start + length].decode('utf-8'), playcount, userrating, nfo_mtime)
+
+    # binary search on file path; returns the entry, or None
+    def find(self, path):
+        key = path.encode('utf-8')
+        lo, hi = 0, self.count
+        while (lo < hi):
+            mid = (lo + hi) // 2
+            mid_key = self.path_bytes(mid)
+            if (mid_key < key):
+                lo = mid + 1
+            elif (mid_key > key):
+                hi = mid
+            else:
+                return self.entry(mid)
+        return None
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.entry(i)
+
+# load a snapshot from disk; returns None if there is none, or if it cannot be read
+def load_snapshot(path):
+    try:
+        return MappedSnapshot(path)
+    except (SnapshotError, struct.error, ValueError, EnvironmentError):
+        return None
+
+class SnapshotDiff(object):
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+    def __str__(self):
+        return '%d added, %d removed, %d changed' % (len(self.added), len(self.removed), len(self.changed))
+
+# compare two snapshots (any iterables of entries sorted by file path) in a single merge pass
+# returns a SnapshotDiff holding lists of file paths
+def diff_snapshots(old, new):
+    result = SnapshotDiff()
+    old_iter = iter(old)
+    new_iter = iter(new)
+    a = next(old_iter, None)
+    b = next(new_iter, None)
+    while (a is not None or b is not None):
+        a_key = a.path.encode('utf-8') if (a is not None) else None
+        b_key = b.path.encode('utf-8') if (b is not None) else None
+        if (b is None or (a is not None and a_key < b_key)):
+            result.removed.append(a.path)
+            a = next(old_iter, None)
+        elif (a is None or b_key < a_key):
+            result.added.append(b.path)
+            b = next(new_iter, None)
+        else:
+            if (a.differs(b)):
+                result.changed.append(b.path)
+            a = next(old_iter, None)
+            b = next(new_iter, None)
+    return result
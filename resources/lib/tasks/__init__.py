@@ -1,6 +1,9 @@
 from threading import Thread as BaseThread
 from Queue import Empty
+import itertools
 import os.path
+import threading
+import time
 
 import xbmc
 import xbmcvfs
@@ -11,8 +14,41 @@ from resources.lib.helpers.jsonrpc import exec_jsonrpc, JSONRPCError, notify
 import resources.lib.library as Library
 LibraryError = Library.LibraryError # just as a convenience
 from resources.lib.script import FileScriptHandler, ScriptError
+from resources.lib.rules import load_rules, RulesError
+from resources.lib.script_pool import get_script_pool
+from resources.lib.memo import get_script_memo, hash_script, hash_input
 from resources.lib.nfo import NFOHandler, NFOLoadHandler, NFOHandlerError
-
+from resources.lib.nfo.diff import DiffStats, freeze
+from resources.lib.nfo.fields import get_field_digests
+from resources.lib.nfo.written import get_written_nfos
+from resources.lib.reconcile import get_exported_states
+from resources.lib.coordination import get_coordinator
+from resources.lib.tasks.pipeline import Pipeline, PipelineStage
+from resources.lib.scheduler import get_throttle
+from resources.lib.metrics import registry as metrics
+from resources.lib.profiler import get_task_profiler
+from resources.lib.journal import get_result_journal
+
+
+# queue priorities: lower values are run first, and tasks of same priority in the order they were queued
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2 # background work, only run when nothing else is waiting
+
+# persistent stores updated by tasks (script memo, field digests, exported states) are rewritten as a whole: after a
+# batch task, but at most every STORE_SAVE_INTERVAL seconds after single ones (e.g. every mark as watched), and on stop
+STORE_SAVE_INTERVAL = 300
+_stores_saved_at = time.time()
+_stores_lock = threading.Lock()
+
+def save_stores(force = False):
+    global _stores_saved_at
+    with _stores_lock:
+        if (not force and time.time() - _stores_saved_at < STORE_SAVE_INTERVAL):
+            return
+        _stores_saved_at = time.time()
+    for store in [ get_script_memo(), get_field_digests(), get_exported_states() ]:
+        if (store):
+            store.save()
 
 ################################################
 ### thread class, in charge of running tasks ###
@@ -20,64 +56,158 @@ from resources.lib.nfo import NFOHandler, NFOLoadHandler, NFOHandlerError
 # see multithreading example: https://forum.kodi.tv/showthread.php?tid=165223
 
 class Thread(BaseThread):
-    def __init__(self, queue, **kwargs):
+    def __init__(self, queue, concurrency = None, add_task = None, **kwargs):
         self.tasks = queue
+        self.concurrency = concurrency # adaptive limit of the nb of tasks running in parallel (see scheduler.py)
+        self.add_task = add_task # queues a task, e.g. the ones chained to a finished task (see NFOMonitor.add_task())
         # self.running = False
-        super(Thread, self).__init__(kwargs)
+        super(Thread, self).__init__(**kwargs)
 
     def stop(self):
         self.running = False
 
     def run(self):
         self.running = True
+        throttle = get_throttle()
         # Rather than running forever, check to see if it is still OK
         while self.running:
+            # the nb of tasks running in parallel is reduced while throttling (e.g. during playback)
+            if (throttle and not throttle.acquire_worker()):
+                xbmc.sleep(100)
+                continue
+            if (self.concurrency and not self.concurrency.acquire_worker()):
+                if (throttle):
+                    throttle.release_worker()
+                xbmc.sleep(100)
+                continue
             try:
                 # Don't block
-                task = self.tasks.get(block=False)
+                (priority, sequence, task) = self.tasks.get(block=False) # see NFOMonitor.add_task()
                 # task = self.tasks.get(block=True)
-                task._run_from_thread()
+                busy = metrics.gauge('workers_busy', 'Nb of worker threads running a task')
+                busy.inc()
+                try:
+                    task._run_from_thread()
+                finally:
+                    busy.dec()
+                    # queue the tasks that had to wait for this one (see BaseTask.chain())
+                    if (self.add_task):
+                        for follower in task.followers:
+                            self.add_task(follower)
+                if (self.concurrency and task.finished_at):
+                    self.concurrency.record_task(task.__class__.__name__, task.finished_at - task.started_at, task.nb_processed)
                 del task
                 self.tasks.task_done()
             except Empty:
                 # Allow other stuff to run
                 xbmc.sleep(100)
+            finally:
+                if (throttle):
+                    throttle.release_worker()
+                if (self.concurrency):
+                    self.concurrency.release_worker()
 
 #############################################################
 ### task result class, useful to hold everything together ###
 #############################################################
 
+# kind of an error, to aggregate errors in the summary: the generic part of the message (e.g. 'error loading nfo file'),
+# or the class of exceptions without a message of their own
+def get_error_kind(ex):
+    if (isinstance(ex, Error)):
+        message = ex.message
+    elif (isinstance(ex, basestring)):
+        message = ex
+    else:
+        return ex.__class__.__name__
+    return message.split(':')[0].strip() or ex.__class__.__name__
+
+# the result of a task only keeps counters and a few samples of modified nfo files, errors and warnings, whatever the
+# nb of items: full records are streamed to the task journal as they happen (see journal.py)
 class TaskResult(object):
-    def __init__(self, status = 'idle', lines = None): # do not assign [] as default value! http://docs.python-guide.org/en/latest/writing/gotchas/#mutable-default-arguments
+    MAX_SAMPLES = 20 # nb of modified nfo files, errors and warnings kept in memory, for the log
+    __slots__ = [ 'status', 'title', 'lines', 'source', 'nb_items', 'nb_modified', 'nb_errors', 'nb_warnings', 'error_kinds',
+        'modified_samples', 'error_samples', 'warning_samples', 'script_errors', 'built', 'diff', 'nb_unchanged', 'cache_hits',
+        'cache_misses', 'nb_script_skipped', 'nb_refresh_avoided', 'throttle' ]
+
+    def __init__(self, status = 'idle', lines = None, source = None): # do not assign [] as default value! http://docs.python-guide.org/en/latest/writing/gotchas/#mutable-default-arguments
         self.status = status
         self.title = ''
         if (not lines):
             self.lines = []
         else:
             self.lines = lines if (isinstance(lines, list)) else [ lines ]
+        self.source = source # label of the task in the journal
         # we keep a track of some info here
         self.nb_items = 0
-        self.modified = []
-        self.errors = []
-        self.warnings = []
+        self.nb_modified = 0
+        self.nb_errors = 0
+        self.nb_warnings = 0
+        self.error_kinds = {} # kind => nb of errors, see get_error_kind()
+        self.modified_samples = []
+        self.error_samples = [] # list of [ nfo_path, message ]
+        self.warning_samples = []
         self.script_errors = False # tracked globally, not in errors
         self.built = False
-
-    @property
-    def nb_modified(self):
-        return len(self.modified)
-    @property
-    def nb_errors(self):
-        return len(self.errors)
-    @property
-    def nb_warnings(self):
-        return len(self.warnings)
+        self.diff = DiffStats() # cumulated semantic differences of loaded NFOs
+        self.nb_unchanged = 0 # NFOs not saved, as there was no semantic change
+        self.cache_hits = 0 # NFOs loaded from the tree cache
+        self.cache_misses = 0 # NFOs parsed from file, while the tree cache is enabled
+        self.nb_script_skipped = 0 # NFOs the script was not applied to, as it would not change them (see memo.py)
+        self.nb_refresh_avoided = 0 # library entries updated in place, or already up to date, instead of refreshed (see nfo/fields.py)
+        self.throttle = None # stats of the throttle controller at the end of the task, if throttling is active
+
+    # accumulate the results of another TaskResult (typically the one of a single item)
+    # nb_items is not merged, as it is counted by the caller; records were journaled by the other result already
+    def merge(self, other):
+        self.nb_modified += other.nb_modified
+        self.nb_errors += other.nb_errors
+        self.nb_warnings += other.nb_warnings
+        for kind, count in other.error_kinds.items():
+            self.error_kinds[kind] = self.error_kinds.get(kind, 0) + count
+        for samples, other_samples in [ (self.modified_samples, other.modified_samples), (self.error_samples, other.error_samples), (self.warning_samples, other.warning_samples) ]:
+            samples.extend(other_samples[:self.MAX_SAMPLES - len(samples)])
+        self.script_errors = self.script_errors or other.script_errors
+        self.diff.add(other.diff)
+        self.nb_unchanged += other.nb_unchanged
+        self.cache_hits += other.cache_hits
+        self.cache_misses += other.cache_misses
+        self.nb_script_skipped += other.nb_script_skipped
+        self.nb_refresh_avoided += other.nb_refresh_avoided
+
+    def add_modified(self, nfo_path):
+        self.nb_modified += 1
+        if (len(self.modified_samples) < self.MAX_SAMPLES):
+            self.modified_samples.append(nfo_path)
+        self._journal('modified', nfo_path)
 
     def add_error(self, nfo, ex):
-        if (nfo):
-            self.errors.append([ nfo.nfo_path, str(ex) ])
-        else:
-            self.errors.append([ '?', str(ex) ])
+        nfo_path = nfo.nfo_path if (nfo) else (getattr(ex, 'nfo', None) or '?')
+        self.nb_errors += 1
+        kind = get_error_kind(ex)
+        self.error_kinds[kind] = self.error_kinds.get(kind, 0) + 1
+        if (len(self.error_samples) < self.MAX_SAMPLES):
+            self.error_samples.append([ nfo_path, str(ex) ])
+        self._journal('error', nfo_path, str(ex))
+
+    def add_warning(self, msg):
+        self.nb_warnings += 1
+        if (len(self.warning_samples) < self.MAX_SAMPLES):
+            self.warning_samples.append(msg)
+        self._journal('warning', None, msg)
+
+    def _journal(self, kind, path, message = None):
+        journal = get_result_journal()
+        if (journal):
+            journal.write(self.source, kind, path, message)
+
+    # most frequent kinds of errors, as a string
+    def summarize_errors(self, nb_kinds = 3):
+        kinds = sorted(self.error_kinds.items(), key = lambda item: (-item[1], item[0]))
+        tokens = [ '%d x %s' % (count, kind) for kind, count in kinds[:nb_kinds] ]
+        if (len(kinds) > nb_kinds):
+            tokens.append('%d x other' % sum(count for kind, count in kinds[nb_kinds:]))
+        return ', '.join(tokens)
 
     # build the title and lines depending on results
     def build(self, task_family = 'process'):
@@ -104,6 +234,8 @@ class TaskResult(object):
         if (self.nb_errors > 0):
             nfo_tokens.append('%s' % plural('error', self.nb_errors))
         self.lines.append(', '.join(nfo_tokens))
+        if (len(self.error_kinds) > 1 or self.nb_errors > self.MAX_SAMPLES):
+            self.lines.append('errors: %s' % self.summarize_errors())
 
         if (self.script_errors):
             self.lines.append('script errors: see logs')
@@ -126,8 +258,24 @@ class TaskFileError(TaskPathError):
 class TaskScriptError(TaskPathError):
     pass
 
+# state of a single item while it goes through the processing stages
+class ItemJob(object):
+    def __init__(self, video_id, result):
+        self.video_id = video_id
+        self.result = result # TaskResult to account into
+        self.nfo = None
+        self.script_success = True
+        self.modified = False
+        self.done = False # no further stage to run
+
+_task_ids = itertools.count(1)
+
 # Base class for tasks, to be derived for each video type: movies, tvshow, season, episode
 class BaseTask(object):
+    LOCK_TIMEOUT = 10 # seconds to wait for a nfo locked by another instance (multi-room)
+    PIPELINE = False # process items through a staged pipeline (worth it for tasks with many items only)
+    PRIORITY = PRIORITY_NORMAL # priority in the task queue
+
     def __init__(self, task_family, video_type, ignore_script = False, silent = False):
         # create specific logger with namespace
         self.log = Logger(self.__class__.__name__)
@@ -138,18 +286,42 @@ class BaseTask(object):
         # initialize some variables
         self.items = []
         self.script = None
-
-    def __del__(self):
-        self.log.debug('task destroyed')
+        self.script_hash = None
+        self.rules = None
+        # timestamps, for latency measurements (see loadtest.py)
+        self.queued_at = None
+        self.started_at = None
+        self.finished_at = None
+        self.nb_processed = 0 # nb of items processed by the last run
+        self.label = '%s #%d' % (self.__class__.__name__, next(_task_ids)) # to tell the records of each task in the journal
+        # tasks chained to this one (see chain())
+        self.followers = []
+        self.after = None # task this one is chained to
+        self.refreshed = {} # video ID => video path of the entries refreshed by this task, if it has followers
 
     @property
     def signature(self):
         return '%s %s' % (self.video_type, self.task_family)
 
+    # have a task queued only once this one is finished, e.g. not to work on entries this one is refreshing
+    # entries refreshed by this one get a new ID: the follower can tell which ones from self.after.refreshed
+    def chain(self, task):
+        task.after = self
+        self.followers.append(task)
+        return task
+
     # that is the method that is actually called from Thread.run()
     def _run_from_thread(self):
         self.log.debug('initializing task: %s' % self.signature)
-        self.run()
+        self.started_at = time.time()
+        profiler = get_task_profiler()
+        try:
+            if (profiler):
+                profiler.profile(self, self.run)
+            else:
+                self.run()
+        finally:
+            self.finished_at = time.time()
         self.log.debug('task finished: %s' % self.signature)
 
     # main processing here, could be called directly
@@ -159,8 +331,27 @@ class BaseTask(object):
         result.build(self.task_family)
         # allow post-process actions
         self.on_process_finished(result)
+        save_stores(force = self.PIPELINE) # see STORE_SAVE_INTERVAL
         # log and optionally notify user
         self.notify_result(result, notify_user = addon.getSettingBool('movies.auto.notify'))
+        self.update_metrics(result)
+        self.nb_processed = result.nb_items
+
+    # account the task into the service metrics (see metrics.py)
+    def update_metrics(self, result):
+        labels = { 'task': self.__class__.__name__ }
+        metrics.counter('tasks_total', 'Nb of tasks run', dict(labels, status = result.status)).inc()
+        metrics.counter('items_total', 'Nb of library entries processed', labels).inc(result.nb_items)
+        metrics.counter('errors_total', 'Nb of errors reported by tasks', labels).inc(result.nb_errors)
+        metrics.counter('script_errors_total', 'Nb of tasks with script errors', labels).inc(int(result.script_errors))
+        metrics.counter('nfo_unchanged_total', 'Nb of NFOs not saved, as semantically unchanged', labels).inc(result.nb_unchanged)
+        metrics.counter('nfo_cache_hits_total', 'Nb of NFOs loaded from the tree cache', labels).inc(result.cache_hits)
+        metrics.counter('nfo_cache_misses_total', 'Nb of NFOs parsed while the tree cache is enabled', labels).inc(result.cache_misses)
+        metrics.counter('refreshes_avoided_total', 'Nb of library refreshes avoided by targeted updates', labels).inc(result.nb_refresh_avoided)
+        if (self.started_at):
+            metrics.histogram('task_duration_seconds', 'Duration of tasks', labels).observe(time.time() - self.started_at)
+            if (self.queued_at):
+                metrics.histogram('task_queue_wait_seconds', 'Time spent by tasks in the queue', labels).observe(self.started_at - self.queued_at)
 
     def process(self):
         # collect entries we should process
@@ -171,92 +362,247 @@ class BaseTask(object):
             self.log.error('error populating entries => aborting task')
             return TaskResult('aborted', 'cannot populate entries, see logs')
 
-        # early exit if nothing to process
-        if (len(self.items) == 0):
+        # instantiate a TaskResult object
+        result = TaskResult(source = self.label)
+
+        # items are consumed one by one, as they may be produced lazily (see iter_items())
+        try:
+            io_threads = addon.getSettingInt('debug.pipeline.io_threads')
+            if (self.PIPELINE and io_threads > 0):
+                self.process_pipelined(result, io_threads)
+            else:
+                for video_id in self.iter_items():
+                    if (result.nb_items == 0):
+                        self.init_script(result)
+                    # collect the nb of processed items in result
+                    result.nb_items += 1
+                    self.process_item(video_id, result)
+        except TaskError as e:
+            self.log.error(e)
+            self.log.error('error collecting entries => aborting task')
+            result.status = 'aborted'
+            result.lines.append('cannot collect entries, see logs')
+            return result
+
+        # nothing was processed
+        if (result.nb_items == 0):
             return TaskResult('complete')
 
-        # instantiate a TaskResult object
-        result = TaskResult()
+        result.status = 'complete'
+        throttle = get_throttle()
+        if (throttle):
+            result.throttle = throttle.get_stats()
+        return result
 
-        # optionally load the script we will apply on all entries
-        # we load the file now, in order to bypass it later if errors are encountered
-        if (not self.ignore_script):
+    # process items through a staged pipeline, so that network I/O, file I/O and parsing of different items overlap
+    # I/O-bound stages get io_threads workers each; the script stage is kept on a single thread, as it is CPU-bound
+    # each job accounts into its own TaskResult, merged into the main one in the original order of items
+    def process_pipelined(self, result, io_threads):
+        def iter_jobs():
+            for video_id in self.iter_items():
+                if (result.nb_items == 0):
+                    self.init_script(result) # before the first job enters the pipeline
+                result.nb_items += 1
+                yield ItemJob(video_id, TaskResult(source = self.label))
+
+        def on_job_finished(pipeline_job):
+            job = pipeline_job.item
+            if (pipeline_job.exception):
+                job.result.add_error(job.nfo, pipeline_job.exception)
+            self.finish_job(job)
+            result.merge(job.result)
+
+        # wrap our jobs into pipeline jobs, and stages into functions on the wrapped job
+        def stage(func):
+            def run(pipeline_job):
+                func(pipeline_job.item)
+                pipeline_job.done = pipeline_job.item.done
+            return run
+
+        pipeline = Pipeline([
+            PipelineStage('load', stage(self.stage_load), io_threads),
+            PipelineStage('script', stage(self.stage_script), 1),
+            PipelineStage('save', stage(self.stage_save), io_threads),
+            PipelineStage('refresh', stage(self.stage_refresh), io_threads),
+        ], log = self.log)
+        pipeline.run(iter_jobs(), on_job_finished)
+
+    # optionally load the script and tag rules we will apply on all entries
+    # we load the files once, before the first item, in order to bypass them later if errors are encountered
+    def init_script(self, result):
+        if (self.ignore_script):
+            return
+        try:
+            self.script = self.load_script()
+        except ScriptError as e:
+            self.log.notice(e)
+            self.log.notice('  => ignoring script error => resuming task without script')
+            self.script = None
+            result.script_errors = True
+        self.script_hash = hash_script(self.script)
+        try:
+            self.rules = self.load_rules()
+        except RulesError as e:
+            self.log.notice(e)
+            self.log.notice('  => ignoring rules error => resuming task without tag rules')
+            self.rules = None
+            result.script_errors = True
+
+    # process a single item: load the nfo, apply script, save and refresh
+    def process_item(self, video_id, result):
+        job = ItemJob(video_id, result)
+        try:
+            for stage in [ self.stage_load, self.stage_script, self.stage_save, self.stage_refresh ]:
+                if (job.done):
+                    break
+                stage(job)
+        finally:
+            self.finish_job(job)
+
+    ### processing stages, each one working on an ItemJob ###
+    # load: instantiate and load the nfo handler (JSON-RPC + file read + parse)
+    def stage_load(self, job):
+        throttle = get_throttle()
+        if (throttle):
+            throttle.pace_io()
+        start = time.time()
+        job.nfo = self.load_item(job.video_id, job.result)
+        if (throttle):
+            throttle.record_io(time.time() - start)
+        if (not job.nfo):
+            # skip this video if there is no valid NFOHandler
+            job.done = True
+        elif (job.nfo.cache_hit):
+            job.result.cache_hits += 1
+        elif (job.nfo.cache_hit is not None):
+            job.result.cache_misses += 1
+
+    # script: apply the tag rules, then the script to nfo content
+    def stage_script(self, job):
+        if (self.rules and not self.ignore_script):
+            self.apply_rules(job.nfo)
+        if (self.script and not self.ignore_script):
+            nfo = job.nfo
+            # skip the script if it is known to leave this very content unchanged
+            memo = get_script_memo()
+            if (memo):
+                input_hash = hash_input(nfo.current_state(), nfo.video_path)
+                if (memo.lookup(nfo.nfo_path, self.task_family, self.script_hash, input_hash) == input_hash):
+                    self.log.debug('script already applied, with no change => skipping it for nfo: %s' % nfo.nfo_path)
+                    job.result.nb_script_skipped += 1
+                    return
+            if (not self.apply_script(nfo)):
+                job.result.script_errors = True # not tracked in result.errors
+                job.script_success = False
+                if (memo):
+                    memo.forget(nfo.nfo_path, self.task_family)
+            elif (memo):
+                memo.record(nfo.nfo_path, self.task_family, self.script_hash, input_hash, hash_input(freeze(nfo.root), nfo.video_path))
+
+    # save: serialize and write the nfo file, if modified
+    def stage_save(self, job):
+        # we need to track if the script was successful, in order to decide whether we can save or not
+        if (not job.script_success):
+            if (addon.getSettingBool('movies.general.script.ignore_script_errors')):
+                self.log.warning('  => script error => ignoring and trying to save the NFO anyway [berserker mode]')
+            else:
+                self.log.warning('  => script error => NOT saving the NFO')
+        nfo = job.nfo
+        throttle = get_throttle()
+        if (throttle):
+            throttle.pace_io()
+        try:
+            job.modified = nfo.save()
+        except NFOHandlerError as e:
+            self.log.error(e)
+            job.result.add_error(nfo, e)
+            job.done = True
+            return
+        if (nfo.diff is not None):
+            job.result.diff.add(nfo.diff)
+        if (job.modified):
+            get_written_nfos().record(nfo.nfo_path)
+            metrics.counter('nfo_written_total', 'Nb of NFOs saved').inc()
+            self.log.info('saved nfo: \'%s\' (%s)' % (nfo.nfo_path, nfo.diff or 'new content'))
+        else:
+            self.log.debug('not saving to \'%s\': no semantic change' % nfo.nfo_path)
+            job.result.nb_unchanged += 1
+
+    # refresh: trigger events and refresh the library entry, if needed
+    def stage_refresh(self, job):
+        nfo = job.nfo
+        if (job.modified):
+            if (self.on_nfo_saved(nfo, job.result) and self.refresh_nfo(nfo, job.result)):
+                job.result.add_modified(nfo.nfo_path) # add to modified only if saved and refreshed
+        # the nfo itself may have been modified outside of Kodi, in which case the entry must be refreshed anyway
+        elif (self.refresh_unmodified(job) and self.refresh_nfo(nfo, job.result)):
+            job.result.add_modified(nfo.nfo_path)
+
+    # called once the job went through all stages (or was interrupted)
+    def finish_job(self, job):
+        if (job.nfo):
+            self.release_item(job.nfo)
+            job.nfo = None
+
+    # instantiate and load the nfo handler for the given item, and lock it
+    # returns None if no valid NFOHandler could be loaded
+    def load_item(self, video_id, result):
+        # instantiate a nfo handler; we use a loop here, as the derived class can implement some fallback strategy if a handler fails (see on_nfo_load_failed())
+        default_nfo = True # at first, we want the default NFOHandler
+        locked_nfo = None
+        while (True):
             try:
-                self.script = self.load_script()
-            except ScriptError as e:
-                self.log.notice(e)
-                self.log.notice('  => ignoring script error => resuming task without script')
-                self.script = None
-                result.script_errors = True
-
-        for video_id in self.items:
-            # collect the nb of processed items in result
-            result.nb_items += 1
-            # instantiate a nfo handler; we use a loop here, as the derived class can implement some fallback strategy if a handler fails (see on_nfo_load_failed())
-            default_nfo = True # at first, we want the default NFOHandler
-            while (True):
+                if (default_nfo):
+                    nfo = None # needed in case nfo cannot be instantiated
+                    nfo = self.get_nfo_handler(video_id)
+                    # make sure no other instance is processing the same nfo at the same time (multi-room)
+                    if (not self.lock_nfo(nfo)):
+                        self.log.info('nfo is being processed by another instance => skipping: \'%s\'' % nfo.nfo_path)
+                        return None
+                    locked_nfo = nfo
+                nfo.make_xml()
+                self.on_nfo_loaded(nfo, result)
+                break
+            except NFOHandlerError as e:
+                default_nfo = False # we will not use the default anymore
+                self.log.warning(e)
+                # try to fall back to another nfo handler
                 try:
-                    if (default_nfo):
-                        nfo = None # needed in case nfo cannot be instantiated
-                        nfo = self.get_nfo_handler(video_id)
-                    nfo.make_xml()
-                    self.on_nfo_loaded(nfo, result)
-                    break
-                except NFOHandlerError as e:
-                    default_nfo = False # we will not use the default anymore
+                    nfo = self.on_nfo_load_failed(nfo, result)
+                except Exception as e:
+                    self.log.warning('error instantiating the fallback NFO handler')
                     self.log.warning(e)
-                    # try to fall back to another nfo handler
-                    try:
-                        nfo = self.on_nfo_load_failed(nfo, result)
-                    except Exception as e:
-                        self.log.warning('error instantiating the fallback NFO handler')
-                        self.log.warning(e)
-                        self.log.warning('  => will not try further more => skipping this video')
-                        nfo = None
-                        break
-                    if (not nfo):
-                        result.add_error(nfo, e) # a dummy error will be added, as nfo == None raises an exception
-                        break
-
-            if (not nfo):
-                # skip this video if there is no valid NFOHandler
-                continue
+                    self.log.warning('  => will not try further more => skipping this video')
+                    nfo = None
+                    break
+                if (not nfo):
+                    result.add_error(nfo, e) # a dummy error will be added, as nfo == None raises an exception
+                    break
 
-            # we need to track if the script was successful, in order to decide whether we can save or not
-            script_success = True
-
-            # apply script to nfo content
-            if (self.script and not self.ignore_script):
-                if (not self.apply_script(nfo)):
-                    result.script_errors = True # not tracked in result.errors
-                    script_success = False
-
-            # save nfo, and trigger event if content was actually modified
-            if (not script_success):
-                if (addon.getSettingBool('movies.general.script.ignore_script_errors')):
-                    self.log.warning('  => script error => ignoring and trying to save the NFO anyway [berserker mode]')
-                else:
-                    self.log.warning('  => script error => NOT saving the NFO')
-            try:
-                modified = nfo.save()
-                if (modified):
-                    self.log.info('saved nfo: \'%s\'' % nfo.nfo_path)
-                    if (self.on_nfo_saved(nfo, result) and self.refresh_nfo(nfo, result)):
-                        result.modified.append(nfo.nfo_path) # add to modified only if saved and refreshed
-                else:
-                    self.log.debug('not saving to \'%s\': contents are identical' % nfo.nfo_path)
-            except NFOHandlerError as e:
-                self.log.error(e)
-                result.add_error(nfo, e)
+        if (not nfo and locked_nfo):
+            self.release_item(locked_nfo)
+        return nfo
 
-        result.status = 'complete'
-        return result
+    # release everything held for the item: nfo lock, and XML tree (explicitly, to keep memory flat on large libraries)
+    def release_item(self, nfo):
+        self.unlock_nfo(nfo)
+        nfo.close()
 
     # to be overridden
     # populate the list of entries (video details) to be processed
     def populate_entries(self):
         pass
 
+    # can be overridden
+    # iterate over the items (video IDs) to process; may be a generator, and raise TaskError while iterating
+    def iter_items(self):
+        return iter(self.items)
+
+    # can be overridden
+    # whether the library entry of an item must be refreshed even though its nfo was not saved
+    def refresh_unmodified(self, job):
+        return False
+
     # load script content
     def load_script(self):
         script_path = xbmc.translatePath(addon.getSetting('movies.general.script.path'))
@@ -267,6 +613,29 @@ class BaseTask(object):
             self.log.debug('loading script: %s' % script_path)
             return FileScriptHandler(script_path, log_prefix = self.__class__.__name__)
 
+    # hash of the script that will be applied, or None; see memo.py
+    def get_script_hash(self):
+        if (self.ignore_script):
+            return None
+        try:
+            return hash_script(self.load_script())
+        except ScriptError:
+            return None
+
+    # load and compile tag rules
+    def load_rules(self):
+        rules_path = xbmc.translatePath(addon.getSetting('movies.general.rules.path'))
+        if (not addon.getSettingBool('movies.general.rules') or not rules_path):
+            return None
+        self.log.debug('loading tag rules: %s' % rules_path)
+        return load_rules(rules_path.decode('utf-8') if (isinstance(rules_path, bytes)) else rules_path)
+
+    # apply tag rules to the XML content
+    def apply_rules(self, nfo):
+        self.log.debug('applying tag rules against nfo: %s' % nfo.nfo_path)
+        if (self.rules.apply(nfo.soup, nfo.root, nfo.video_path)):
+            nfo.mark_dirty()
+
     # run external script to modify the XML content, if applicable
     def apply_script(self, nfo):
         if (not self.script):
@@ -274,15 +643,24 @@ class BaseTask(object):
         # apply script to XML content
         try:
             self.log.debug('executing script against nfo: %s' % nfo.nfo_path)
-            self.script.execute(locals_dict = {
-                'soup': nfo.soup,
-                'root': nfo.root,
+            nfo.mark_dirty() # the script may update any part of the tree
+            locals_dict = {
                 'video_type': self.video_type,
                 'video_path': nfo.video_path,
                 'nfo_path': nfo.nfo_path,
                 'video_title': nfo.video_title,
                 'task_family': self.task_family,
-            })
+            }
+            # run the script in a worker process if possible, on a copy of the tree
+            script_pool = get_script_pool()
+            if (script_pool and not self.script.in_process):
+                (soup, root) = script_pool.execute(self.script, self.video_type, nfo.root, locals_dict)
+                if (root is None):
+                    raise ScriptError('no root tag \'%s\' in the nfo returned by the script' % self.video_type)
+                nfo.replace_tree(soup, root)
+            else:
+                locals_dict.update({ 'soup': nfo.soup, 'root': nfo.root })
+                self.script.execute(locals_dict = locals_dict)
             return True
         except ScriptError as e:
             self.log.warning('error executing script against nfo: %s' % nfo.nfo_path)
@@ -296,6 +674,24 @@ class BaseTask(object):
         self.log.debug('instantiating NFOHandler')
         return NFOLoadHandler(self, self.video_type, video_id)
 
+    # get the exclusive lock on the nfo, if coordinating with other instances
+    # returns False if the nfo is still locked by another instance after LOCK_TIMEOUT
+    def lock_nfo(self, nfo):
+        coordinator = get_coordinator()
+        if (not coordinator):
+            return True
+        try:
+            return coordinator.acquire(nfo.nfo_path, timeout = self.LOCK_TIMEOUT)
+        except (IOError, OSError) as e:
+            # do not block the whole sync if the shared folder is unavailable
+            self.log.warning('cannot lock nfo \'%s\': %s => processing anyway' % (nfo.nfo_path, str(e)))
+            return True
+
+    def unlock_nfo(self, nfo):
+        coordinator = get_coordinator()
+        if (coordinator):
+            coordinator.release(nfo.nfo_path)
+
     # to be overridden
     # called when nfo content has been loaded
     def on_nfo_loaded(self, nfo, result):
@@ -328,15 +724,34 @@ class BaseTask(object):
         log_level = xbmc.LOGERROR if (result.nb_errors or result.status != 'complete') else xbmc.LOGINFO
         self.log.log(log_str, log_level)
 
-        # log errors and warnings
-        if (result.errors):
-            self.log.debug('Errors:')
-            for nfo_path, msg in result.errors:
-                self.log.debug('  >> %s: %s' % (nfo_path, msg))
-        if (result.warnings):
-            self.log.debug('Warnings:')
-            for msg in result.warnings:
+        if (result.nb_items):
+            self.log.debug('NFO changes: %s / %d NFOs unchanged' % (result.diff, result.nb_unchanged))
+        if (result.nb_script_skipped):
+            self.log.debug('script skipped for %d NFOs, as it would not change them' % result.nb_script_skipped)
+        if (result.nb_refresh_avoided):
+            self.log.info('library refreshes avoided: %d, as only fields settable directly had changed' % result.nb_refresh_avoided)
+        if (result.cache_hits + result.cache_misses):
+            self.log.debug('tree cache: %d hits / %d lookups (%d%%)' % (result.cache_hits, result.cache_hits + result.cache_misses, 100 * result.cache_hits // (result.cache_hits + result.cache_misses)))
+        script_pool = get_script_pool()
+        if (script_pool and self.script and script_pool.get_stats(self.script.label)):
+            self.log.debug('isolated script: %s' % script_pool.get_stats(self.script.label))
+        if (result.throttle):
+            self.log.debug('throttle: level %(level)s (max %(max_level)s), I/O latency %(io_latency_ms)dms, %(delay_time).1fs spent pacing' % result.throttle)
+
+        # log errors and warnings: only samples, everything else is in the journal
+        journal = get_result_journal()
+        for label, samples, count in [ ('Errors', [ '%s: %s' % (nfo_path, msg) for nfo_path, msg in result.error_samples ], result.nb_errors), ('Warnings', result.warning_samples, result.nb_warnings) ]:
+            if (not count):
+                continue
+            self.log.debug('%s:' % label)
+            for msg in samples:
                 self.log.debug('  >> %s' % msg)
+            if (count > len(samples)):
+                self.log.debug('  >> ... %d more%s' % (count - len(samples), ', see %s' % journal.path if (journal) else ''))
+        if (result.nb_errors):
+            self.log.debug('errors by kind: %s' % result.summarize_errors(nb_kinds = 10))
+        if (journal):
+            journal.flush()
 
         # optionally notify user
         if (notify_user and not self.silent):
@@ -362,16 +777,28 @@ class BaseTask(object):
     def refresh_nfo(self, nfo, result):
         # refresh entry as it was modified
         # note: Kodi will actually perform delete + add operations, which will result in a new entry id in the lib
+        # refreshes are spaced out while throttling, as each one makes Kodi read the video files again
+        throttle = get_throttle()
+        if (throttle):
+            throttle.pace_refresh()
+        metrics.counter('refreshes_total', 'Nb of library refreshes issued').inc()
         try:
             self.log.debug('refreshing %s: %s (%d)' % (nfo.video_type, nfo.video_title, nfo.video_id))
-            result = exec_jsonrpc('VideoLibrary.RefreshMovie', movieid=nfo.video_id, ignorenfo=False)
-            if (result != 'OK'):
+            start = time.time()
+            response = exec_jsonrpc('VideoLibrary.RefreshMovie', movieid=nfo.video_id, ignorenfo=False)
+            if (throttle):
+                throttle.record_io(time.time() - start)
+            if (response != 'OK'):
                 self.log.warning('%s refresh failed for \'%s\' (%d)' % (self.video_type, nfo.video_path, nfo.video_id))
+                metrics.counter('refresh_errors_total', 'Nb of failed library refreshes').inc()
                 result.add_error(nfo, 'refresh failed')
                 return False
+            if (self.followers):
+                self.refreshed[nfo.video_id] = nfo.video_path
             return True
         except JSONRPCError as e:
             self.log.warning('%s refresh failed for \'%s\' (%d)' % (self.video_type, nfo.video_path, nfo.video_id))
             self.log.warning(e)
+            metrics.counter('refresh_errors_total', 'Nb of failed library refreshes').inc()
             result.add_error(nfo, 'refresh failed: %s' % str(e))
             return False
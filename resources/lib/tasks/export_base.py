@@ -1,9 +1,15 @@
 from __future__ import unicode_literals
 import xbmc
 from resources.lib.helpers import addon
+import resources.lib.library as Library
+LibraryError = Library.LibraryError # just as a convenience
+from resources.lib.tasks import PRIORITY_LOW
 from resources.lib.tasks import BaseTask, TaskError, TaskJSONRPCError, TaskFileError, TaskScriptError
-from resources.lib.nfo import NFOHandlerError
+from resources.lib.nfo import NFOLoadHandler, NFOHandlerError
 from resources.lib.nfo.movie_build import MovieNFOBuildHandler
+from resources.lib.nfo.patch import NFOPatchHandler
+from resources.lib.nfo.template import element
+from resources.lib.reconcile import get_exported_state, get_exported_states
 
 class ExportTaskError(TaskError):
     pass
@@ -14,6 +20,11 @@ class ExportTaskFileError(ExportTaskError, TaskFileError):
 class ExportTaskScriptError(ExportTaskError, TaskScriptError):
     pass
 
+# children of the 'resume' element, from the library entry
+def get_resume_elements(entry):
+    resume = entry.get('resume') or {}
+    return tuple(element(prop, resume.get(prop, 0)) for prop in [ 'position', 'total' ])
+
 # base task for exporting a single video entry to nfo file
 class ExportTask(BaseTask):
     def __init__(self, video_type, ignore_script = False, silent = False):
@@ -27,9 +38,34 @@ class ExportTask(BaseTask):
         # optionally include 'userrating' tag to XML content
         if (addon.getSettingBool('movies.export.userrating')):
             nfo.add_tag('userrating', replace = True)
+        # optionally include 'resume' tag to XML content (see resume.py)
+        if (addon.getSettingBool('movies.export.resume')):
+            nfo.add_tag('resume', get_resume_elements(nfo.entry), replace = True)
+
+    # instantiate the NFOHandler
+    def get_nfo_handler(self, video_id):
+        # fast path: only watched / userrating may change, so they are patched into the file content, without parsing it
+        if (addon.getSettingBool('debug.export.patch') and (self.ignore_script or not (self.script or self.rules))):
+            return NFOPatchHandler(self, self.video_type, video_id)
+        return super(ExportTask, self).get_nfo_handler(video_id)
+
+    # remember what the nfo now holds, for the reconciliation at startup (see reconcile.py)
+    def stage_save(self, job):
+        super(ExportTask, self).stage_save(job)
+        states = get_exported_states()
+        if (states and job.nfo):
+            if (job.done):
+                states.forget(job.nfo.video_path)
+            else:
+                states.record(job.nfo.video_path, get_exported_state(job.nfo.entry))
 
     # called when an exception was caught while processing the nfo handler
     def on_nfo_load_failed(self, nfo, result):
+        # the file cannot be patched (e.g. malformed): fallback to the full parse
+        if (nfo and nfo.family == 'patch'):
+            self.log.debug('  => loading nfo file the regular way: \'%s\'' % nfo.nfo_path)
+            nfo.close() # the lock on the nfo is kept, see BaseTask.load_item()
+            return NFOLoadHandler(self, nfo.video_type, nfo.video_id)
         # fallback to MovieNFOBuildHandler, in order to regenerate the file completely
         # first check if correct setting is activated
         if (nfo and nfo.family == 'load' and addon.getSettingBool('movies.export.rebuild')):
@@ -50,3 +86,82 @@ class ExportSingleTask(ExportTask):
         self.log.debug('exporting entry: %d' % self.video_id)
         # we just have one item here
         self.items = [ self.video_id ]
+
+# task class for exporting several video entries to nfo files at once (e.g. playcount updates buffered during a library scan)
+class ExportBatchTask(ExportTask):
+    PIPELINE = True
+
+    def __init__(self, video_type, video_ids, ignore_script = False, silent = False):
+        super(ExportBatchTask, self).__init__(video_type, ignore_script, silent)
+        self.video_ids = sorted(set(video_ids))
+
+    # populate the list of items (video IDs) to be processed
+    def populate_entries(self):
+        if (self.after and self.after.refreshed):
+            self.follow_refreshed(self.after.refreshed)
+        self.after = None # no need to keep the previous task around
+        self.log.debug('exporting %d entries' % len(self.video_ids))
+        self.items = self.video_ids
+
+    # the task we were chained to refreshed some of our entries: look up their new IDs
+    def follow_refreshed(self, refreshed):
+        video_ids = []
+        for video_id in self.video_ids:
+            if (video_id not in refreshed):
+                video_ids.append(video_id)
+                continue
+            try:
+                new_id = Library.find_id(self.video_type, refreshed[video_id])
+            except LibraryError as e:
+                self.log.warning('cannot find refreshed %s \'%s\': %s' % (self.video_type, refreshed[video_id], str(e)))
+                continue
+            if (new_id is None):
+                self.log.warning('refreshed %s \'%s\' not found in the library anymore => skipping it' % (self.video_type, refreshed[video_id]))
+                continue
+            self.log.debug('%s \'%s\' refreshed: #%d => #%d' % (self.video_type, refreshed[video_id], video_id, new_id))
+            video_ids.append(new_id)
+        self.video_ids = sorted(set(video_ids))
+
+# task class for exporting the entries whose watched state / user rating changed while the service was not running
+# the whole library is fetched page by page, and compared against the values of the last export of each nfo; nfo files
+# already in sync are not loaded at all
+class ExportReconcileTask(ExportBatchTask):
+    PRIORITY = PRIORITY_LOW
+
+    def __init__(self, video_type):
+        super(ExportReconcileTask, self).__init__(video_type, [], silent = True)
+
+    # populate the list of items (video IDs) to be processed
+    def populate_entries(self):
+        states = get_exported_states()
+        if (not states):
+            self.items = []
+            return
+        video_paths = set()
+        mismatches = []
+        # first run: record the current states instead of exporting everything (see reconcile.py)
+        seeding = states.new
+        try:
+            for entry in Library.iter_list(self.video_type, addon.getSettingInt('debug.import.page_size'), properties = ['file', 'playcount', 'userrating', 'resume']):
+                state = get_exported_state(entry)
+                if (not state):
+                    # export does not write anything: nothing to reconcile, and the paths seen so far are not the whole library
+                    self.log.debug('nothing exported => no reconciliation')
+                    self.video_ids = self.items = []
+                    return
+                video_paths.add(entry['file'])
+                if (seeding):
+                    states.record(entry['file'], state)
+                elif (not states.matches(entry['file'], state)):
+                    mismatches.append(entry[self.video_type + 'id'])
+        except LibraryError as e:
+            raise ExportTaskJSONRPCError('cannot retrieve the list of %ss' % self.video_type, e)
+        if (video_paths):
+            states.retain(video_paths)
+        if (seeding):
+            self.log.info('first reconciliation: current states of %d %ss recorded as exported' % (len(video_paths), self.video_type))
+            states.new = False
+        else:
+            self.log.info('%d of %d nfo files out of sync with the library' % (len(mismatches), len(video_paths)))
+        self.video_ids = mismatches
+        self.items = mismatches
@@ -1,17 +1,36 @@
 from __future__ import unicode_literals
+import gc
+import os.path
+import time
+from array import array
 import xbmcvfs
 from resources.lib.tasks import TaskJSONRPCError
 from resources.lib.tasks.import_base import ImportTask, ImportTaskError
-from resources.lib.helpers import timestamp_to_str, str_to_timestamp, get_nfo_path
+from resources.lib.helpers import addon, addon_profile, timestamp_to_str, str_to_timestamp, get_nfo_path, get_memory_usage
+from resources.lib.helpers.resolver import get_nfo_resolver
+from resources.lib.nfo.written import get_written_nfos
 import resources.lib.library as Library
 LibraryError = Library.LibraryError # just as a convenience
+from resources.lib.coordination import get_coordinator
+from resources.lib.snapshot import SnapshotBuilder, load_snapshot, diff_snapshots
+from resources.lib.memo import get_script_memo
+from resources.lib.helpers.io_executor import get_io_executor
 
 class ImportAllTaskError(ImportTaskError):
     pass
 
 class ImportAllTask(ImportTask):
-    def __init__(self, video_type, ignore_script = False, silent = False, last_import = None):
+    LOCK_TIMEOUT = 0 # a nfo locked by another instance is already being processed, no need to wait
+    PIPELINE = True
+    MIN_PAGE_SIZE = 10 # minimum nb of library entries fetched per JSON-RPC call
+    NOT_OWNED = -1 # see inspect_entry()
+    DRAIN_POLL = 0.05 # seconds between two checks of the jobs in flight, see drain()
+
+    def __init__(self, video_type, ignore_script = False, silent = False, last_import = None, extra_ids = None):
         super(ImportAllTask, self).__init__(video_type, ignore_script, silent, last_import)
+        self.extra_ids = set(extra_ids or []) # video IDs to be processed whatever the timestamp of their nfo (e.g. added during a scan)
+        self.outdated_ids = set() # video IDs whose nfo was modified outside of Kodi and this service: the library must reflect them
+        self.nb_finished = 0 # nb of items through all stages, see drain()
 
     # populate the list of entries (video details) to be processed
     def populate_entries(self):
@@ -19,27 +38,147 @@ class ImportAllTask(ImportTask):
         # this is acceptable, because this task will be triggered AFTER library scans, which means that new nfo files are already integrated in the library
         # following this approach, all nfo that are not associated with an entry in the library can be gracefully ignored (they are probably falsy)
         self.log.info('scanning library for nfo files newer than %s' % timestamp_to_str(self.last_import))
-        # retrieve all video entries in the library
-        self.items = []
+        if (self.extra_ids):
+            self.log.info('  + %d entries added during the last scan' % len(self.extra_ids))
+
+    # iterate over the items (video IDs) to be processed
+    # library entries are fetched page by page, and each one is inspected as it comes, so that memory does not grow with
+    # the size of the library; the IDs of the selected entries are only yielded once paging is over: processing an item
+    # refreshes its library entry, which Kodi does by removing it and adding it again under a new ID, so refreshing while
+    # paging by offset would shift the next pages, skipping entries or returning refreshed ones again
+    # selected IDs are kept in a compact array (4 bytes each) until then; while they are processed, the memory ceiling is
+    # enforced by letting the items in flight finish before yielding more (see drain())
+    # a compact snapshot of the library (see snapshot.py) is built along the way, and compared with the one of the
+    # previous import: a nfo whose mtime differs from the recorded one is imported even if it is older than last_import
+    # (e.g. a nfo restored from a backup, or copied with its original timestamp)
+    # nfo files are stat'ed concurrently through the I/O executor (see helpers/io_executor.py), results coming back in order
+    def iter_items(self):
+        page_size = max(addon.getSettingInt('debug.import.page_size'), self.MIN_PAGE_SIZE)
+        memory_ceiling = addon.getSettingInt('debug.import.memory_ceiling') * 1024 * 1024 # setting in MB
+        # in multi-room configurations, only process the partition this instance is in charge of
+        coordinator = get_coordinator()
+        snapshot_path = os.path.join(addon_profile, 'library_%s.snapshot' % self.video_type)
+        old_snapshot = load_snapshot(snapshot_path)
+        new_snapshot = SnapshotBuilder()
+        # nfo files processed by a previous version of the script must be processed again
+        memo = get_script_memo()
+        script_hash = self.get_script_hash() if (memo) else None
+        nb_stale = 0
+        nb_skipped = 0
+        nb_entries = 0
+        selected = array(str('I')) # IDs of the entries to process
+        written = get_written_nfos()
+        executor = get_io_executor()
         try:
-            entries = Library.get_list(self.video_type, properties = ['file']) # may raise TaskJSONRPCError
+            entries = Library.iter_list(self.video_type, page_size, properties = ['file', 'playcount', 'userrating'])
+            if (executor):
+                window = 4 * executor.threads_per_host
+                inspected = ((entry, future.result()) for entry, future in executor.imap(entries, lambda entry: entry['file'], self.inspect_entry, window))
+            else:
+                inspected = ((entry, self.inspect_entry(entry)) for entry in entries)
+            for entry, nfo_mtime in inspected:
+                nb_entries += 1
+                video_id = entry[self.video_type + 'id']
+                previous = old_snapshot.find(entry['file']) if (old_snapshot) else None
+                if (nfo_mtime == self.NOT_OWNED):
+                    nb_skipped += 1
+                    # keep what we knew about this nfo, another instance is in charge of it
+                    new_snapshot.add(video_id, entry['file'], entry.get('playcount'), entry.get('userrating'), previous.nfo_mtime if (previous) else 0)
+                    continue
+                new_snapshot.add(video_id, entry['file'], entry.get('playcount'), entry.get('userrating'), nfo_mtime)
+                if (nfo_mtime is None):
+                    pass
+                elif (video_id in self.extra_ids):
+                    selected.append(video_id) # its nfo was just read by Kodi, during the scan
+                elif (nfo_mtime > self.last_import or (previous and previous.nfo_mtime and nfo_mtime != previous.nfo_mtime)):
+                    selected.append(video_id)
+                    if (not written.is_own(get_nfo_path(entry['file']), nfo_mtime)):
+                        self.outdated_ids.add(video_id)
+                elif (script_hash and memo.is_stale(get_nfo_path(entry['file']), self.task_family, script_hash)):
+                    nb_stale += 1
+                    selected.append(video_id)
+                if (memory_ceiling and nb_entries % page_size == 0):
+                    self.check_memory(memory_ceiling)
         except LibraryError as e:
             raise TaskJSONRPCError('error retrieving the list of %ss' % self.video_type, e.ex)
+        finally:
+            if (old_snapshot is not None):
+                old_snapshot.close()
+        if (nb_stale):
+            self.log.info('%d nfo files processed again, as the script changed' % nb_stale)
+        if (len(selected) > len(self.outdated_ids)):
+            self.log.debug('%d entries will only be refreshed if their nfo is saved' % (len(selected) - len(self.outdated_ids)))
+        if (nb_skipped):
+            self.log.info('%d entries left to other instances (%d live instances)' % (nb_skipped, len(coordinator.live_instances())))
+        if (executor):
+            for host, stats in executor.get_stats().items():
+                self.log.debug('I/O on %s: %s' % (host, stats))
+        self.save_snapshot(snapshot_path, new_snapshot)
+        del new_snapshot
+        for n, video_id in enumerate(selected):
+            if (memory_ceiling and n and n % page_size == 0 and not self.check_memory(memory_ceiling)):
+                self.drain(n)
+            yield video_id
+
+    def finish_job(self, job):
+        super(ImportAllTask, self).finish_job(job)
+        self.nb_finished += 1
+
+    # wait for the items yielded so far to be processed, so that their nfo trees are released before loading more
+    def drain(self, nb_yielded):
+        start = time.time()
+        in_flight = nb_yielded - self.nb_finished
+        while (self.nb_finished < nb_yielded):
+            time.sleep(self.DRAIN_POLL)
+        gc.collect()
+        self.log.debug('memory ceiling exceeded => waited %dms for %d items in flight' % (1000 * (time.time() - start), in_flight))
+
+    # only entries whose nfo was modified outside of Kodi are refreshed even when not saved: entries added during a scan,
+    # nfo files written by this service (exports), or selected for a new version of the script, are already reflected by
+    # the library
+    def refresh_unmodified(self, job):
+        return (job.video_id in self.outdated_ids)
+
+    # log the library changes since the previous import, and persist the new snapshot
+    def save_snapshot(self, snapshot_path, new_snapshot):
+        old_snapshot = load_snapshot(snapshot_path)
+        if (old_snapshot is not None):
+            try:
+                self.log.debug('library changes since previous import: %s' % diff_snapshots(old_snapshot, new_snapshot))
+            finally:
+                old_snapshot.close()
+        try:
+            new_snapshot.save(snapshot_path)
+        except EnvironmentError as e:
+            self.log.warning('unable to save library snapshot: %s' % str(e))
 
-        for entry in entries:
-            # check the modification timestamp of each nfo file
-            if (self.inspect_nfo(entry['file'])):
-                self.items.append(entry[self.video_type + 'id'])
+    # make sure we stay under the configured memory ceiling: force a garbage collection if we are above it
+    # returns False if memory usage is still above the ceiling
+    def check_memory(self, memory_ceiling):
+        usage = get_memory_usage()
+        if (usage is None or usage <= memory_ceiling):
+            return True
+        gc.collect()
+        usage_after = get_memory_usage()
+        self.log.debug('memory ceiling exceeded (%d MB) => garbage collected, now %d MB' % (usage // (1024 * 1024), usage_after // (1024 * 1024)))
+        if (usage_after > memory_ceiling):
+            self.log.warning('memory usage (%d MB) still above the configured ceiling (%d MB)' % (usage_after // (1024 * 1024), memory_ceiling // (1024 * 1024)))
+            return False
+        return True
 
-    # inspect a nfo file to check if the corresponding video library entry should be refreshed
-    def inspect_nfo(self, video_file):
-        # build .nfo file name from the video one
-        nfo_path = get_nfo_path(video_file)
+    # check the modification timestamp of the nfo file of a library entry
+    # returns the timestamp, None if there is no nfo, or NOT_OWNED if the entry is left to another instance (multi-room)
+    def inspect_entry(self, entry):
+        coordinator = get_coordinator()
+        if (coordinator and not coordinator.owns(get_nfo_path(entry['file']))):
+            return self.NOT_OWNED
+        return self.get_nfo_mtime(entry['file'])
 
-        if (not xbmcvfs.exists(nfo_path)):
-            return
-        # get the last modified timestamp
+    # get the last modified timestamp of the nfo file of a video, or None if there is none
+    def get_nfo_mtime(self, video_file):
+        # look for the nfo file in the (cached) listing of its folder
+        nfo_path = get_nfo_resolver().find(video_file)
+        if (not nfo_path):
+            return None
         stat = xbmcvfs.Stat(nfo_path)
-        last_modified = stat.st_mtime()
-        # check if the nfo file was modified after last_import
-        return (last_modified > self.last_import)
+        return stat.st_mtime()
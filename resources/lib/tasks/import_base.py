@@ -7,6 +7,10 @@ import xbmcvfs
 from resources.lib.helpers import addon, timestamp_to_str, str_to_timestamp, load_data, save_data, FileError
 from resources.lib.tasks import BaseTask, TaskError, TaskJSONRPCError, TaskFileError, TaskScriptError
 from resources.lib.helpers.jsonrpc import exec_jsonrpc, JSONRPCError
+from resources.lib.nfo import NFOHandlerError
+from resources.lib.nfo.fields import get_field_digests, get_field_properties, split_fields, diff_fields
+import resources.lib.library as Library
+LibraryError = Library.LibraryError # just as a convenience
 
 class ImportTaskError(TaskError):
     pass
@@ -31,6 +35,49 @@ class ImportTask(BaseTask):
         self.this_run = time.time() # save run date of the current task, to override last_import on success
         self.save_resume_point = True # save run timestamp if task is successful
 
+    # update the library entry from the nfo: only set the fields that changed if possible, refresh otherwise
+    def refresh_nfo(self, nfo, result):
+        digests = get_field_digests()
+        if (not digests):
+            return super(ImportTask, self).refresh_nfo(nfo, result)
+        try:
+            (values, digest) = split_fields(nfo.current_state(), self.video_type)
+        except NFOHandlerError as e:
+            self.log.warning(e)
+            (values, digest) = (None, None)
+        # nothing but settable fields changed since Kodi last read the nfo
+        if (digest and digests.get(nfo.nfo_path) == digest):
+            try:
+                entry = Library.get_details(self.video_type, nfo.video_id, properties = get_field_properties(self.video_type))
+                changes = diff_fields(values, entry, self.video_type)
+                if (changes):
+                    self.log.debug('updating %s: %s (%d): %s' % (nfo.video_type, nfo.video_title, nfo.video_id, ', '.join(sorted(changes))))
+                    Library.set_details(self.video_type, nfo.video_id, **changes)
+                else:
+                    self.log.debug('%s already up to date: %s (%d)' % (nfo.video_type, nfo.video_title, nfo.video_id))
+                result.nb_refresh_avoided += 1
+                return True
+            except LibraryError as e:
+                self.log.warning('cannot update %s \'%s\' (%d) in place: %s => refreshing it' % (self.video_type, nfo.video_path, nfo.video_id, str(e)))
+        if (not super(ImportTask, self).refresh_nfo(nfo, result)):
+            digests.forget(nfo.nfo_path)
+            return False
+        if (digest):
+            digests.record(nfo.nfo_path, digest)
+        return True
+
+    # an entry neither saved nor refreshed is in sync with its nfo (e.g. just read by Kodi, during a scan): record the
+    # digest of the nfo, so that the next change of its settable fields only needs a targeted update
+    def stage_refresh(self, job):
+        super(ImportTask, self).stage_refresh(job)
+        digests = get_field_digests()
+        if (not digests or job.modified or self.refresh_unmodified(job) or digests.get(job.nfo.nfo_path)):
+            return
+        try:
+            digests.record(job.nfo.nfo_path, split_fields(job.nfo.current_state(), self.video_type)[1])
+        except NFOHandlerError as e:
+            self.log.warning(e)
+
     # called when process completed; typically used for setting the result
     # returns: TaskResult object
     def on_process_finished(self, result):
@@ -48,7 +95,7 @@ class ImportTask(BaseTask):
             return
 
         # if everything is fine, save the run datetime as the new import resume point
-        if (not result.script_errors and not result.errors):
+        if (not result.script_errors and not result.nb_errors):
             try:
                 self.log.debug('saving last_import to data file \'%s\'' % self.LAST_IMPORT_FILE)
                 # save this_run datetime to last_import.tmp
@@ -56,6 +103,6 @@ class ImportTask(BaseTask):
             except FileError as e:
                 self.log.warning('error saving last_import datetime to data file \'%s\': %s' % (e.path, e))
                 self.log.warning('  => next import will probably process the same videos again!')
-                result.warnings.append('cannot save import resume point')
+                result.add_warning('cannot save import resume point')
         else:
                 self.log.debug('NOT saving last_import to data file \'%s\', as there were some errors' % self.LAST_IMPORT_FILE)
@@ -0,0 +1,103 @@
+from threading import Thread, Lock
+from Queue import Queue
+
+# staged processing pipeline
+# jobs go through a sequence of stages, each one served by its own pool of threads, and connected to the next one by a
+# bounded queue: a slow stage (e.g. network I/O) makes upstream stages wait (back-pressure) instead of piling up jobs in memory
+# finished jobs are handed back to the caller thread in their original order, so that results can be accounted for exactly
+
+_STOP = object() # end-of-stream marker
+
+class PipelineJob(object):
+    def __init__(self, index, item):
+        self.index = index # position in the input stream
+        self.item = item
+        self.done = False # if set by a stage, the job skips the remaining stages
+        self.exception = None # unexpected exception raised by a stage
+
+class PipelineStage(object):
+    def __init__(self, name, func, nb_workers = 1):
+        self.name = name
+        self.func = func # called with the job as single argument
+        self.nb_workers = max(nb_workers, 1)
+
+class Pipeline(object):
+    def __init__(self, stages, queue_size = 2, log = None):
+        self.stages = stages
+        self.queue_size = queue_size # per worker
+        self.log = log
+
+    # feed the pipeline with items (any iterable, consumed from a dedicated thread)
+    # on_job_finished(job) is called from the caller thread, in the order of items
+    # exceptions raised while iterating over items are re-raised once in-flight jobs are finished
+    def run(self, items, on_job_finished):
+        queues = [ Queue(maxsize = self.queue_size * stage.nb_workers) for stage in self.stages ]
+        output = Queue(maxsize = self.queue_size)
+        threads = []
+        errors = []
+
+        # stage workers
+        for i, stage in enumerate(self.stages):
+            next_queue = queues[i + 1] if (i + 1 < len(self.stages)) else output
+            next_nb_stops = self.stages[i + 1].nb_workers if (i + 1 < len(self.stages)) else 1
+            remaining = [ stage.nb_workers ] # nb of workers still running, shared by the workers of this stage
+            lock = Lock()
+            for n in range(stage.nb_workers):
+                t = Thread(target = self._work, name = 'pipeline-%s-%d' % (stage.name, n), args = (stage, queues[i], next_queue, next_nb_stops, remaining, lock))
+                t.daemon = True
+                threads.append(t)
+                t.start()
+
+        # feeder
+        def feed():
+            try:
+                for index, item in enumerate(items):
+                    queues[0].put(PipelineJob(index, item))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                for n in range(self.stages[0].nb_workers):
+                    queues[0].put(_STOP)
+        feeder = Thread(target = feed, name = 'pipeline-feeder')
+        feeder.daemon = True
+        feeder.start()
+
+        # collect jobs, and hand them back in order
+        pending = {}
+        next_index = 0
+        while (True):
+            job = output.get()
+            if (job is _STOP):
+                break
+            pending[job.index] = job
+            while (next_index in pending):
+                on_job_finished(pending.pop(next_index))
+                next_index += 1
+
+        feeder.join()
+        for t in threads:
+            t.join()
+        if (errors):
+            raise errors[0]
+
+    def _work(self, stage, in_queue, out_queue, nb_stops, remaining, lock):
+        while (True):
+            job = in_queue.get()
+            if (job is _STOP):
+                break
+            if (not job.done):
+                try:
+                    stage.func(job)
+                except Exception as e:
+                    if (self.log):
+                        self.log.error('unexpected error in pipeline stage \'%s\': %s: %s' % (stage.name, e.__class__.__name__, str(e)))
+                    job.exception = e
+                    job.done = True
+            out_queue.put(job)
+        # the last worker of the stage to exit propagates the end of stream downstream
+        with lock:
+            remaining[0] -= 1
+            last = (remaining[0] == 0)
+        if (last):
+            for n in range(nb_stops):
+                out_queue.put(_STOP)
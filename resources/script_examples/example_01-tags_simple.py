@@ -32,7 +32,7 @@ for elt in root.find_all('actor'):
 for elt in root.find_all('video'): # we probably have only one 'video' node, but just in case we loop through all of them
     try:
         if (elt.height and int(elt.height.string) == 2160):
-            tag_labels.add('video: UltraHD / 4k')
+            tags.add('video: UltraHD / 4k')
     except ValueError: # conversion to int failed
         continue
 
@@ -40,7 +40,7 @@ for elt in root.find_all('video'): # we probably have only one 'video' node, but
 for elt in root.find_all('top250'): # we probably have only one 'top250' node, but just in case we loop through all of them
     try:
         if (int(elt.string) > 0):
-            tag_labels.add('top 250')
+            tags.add('top 250')
     except ValueError: # conversion to int failed
         continue
 
@@ -53,4 +53,4 @@ for tag_name in tags:
     elt = soup.new_tag('tag') # create a new node element
     elt.string = tag_name # set its string content
     root.append(elt) # add the node to root children
-log.debug('added tags to nfo: %s' % str(list(tag_labels)))
+log.debug('added tags to nfo: %s' % str(list(tags)))
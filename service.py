@@ -2,7 +2,13 @@ from __future__ import unicode_literals
 import xbmc
 from resources.lib.helpers import addon
 from resources.lib.helpers.log import log
+from resources.lib.helpers.transport import set_transport, TCPTransport
 from resources.lib.monitor import NFOMonitor
+from resources.lib.tasks import save_stores
+from resources.lib.script_pool import stop_script_pool
+from resources.lib.helpers.io_executor import stop_io_executor
+from resources.lib.metrics import start_metrics_exporter, stop_metrics_exporter
+from resources.lib.resume import start_resume_exporter, stop_resume_exporter
 
 if __name__ == '__main__':
 
@@ -10,7 +16,17 @@ if __name__ == '__main__':
         log.fatal('no thread at all??? Are you serious??? I cannot work this way, I quit')
         exit()
 
+    # optionally talk to Kodi over TCP instead of in-process (e.g. to sync the library of another Kodi instance)
+    if (addon.getSetting('debug.jsonrpc.host')):
+        log.notice('using JSON-RPC over TCP: %s:%d' % (addon.getSetting('debug.jsonrpc.host'), addon.getSettingInt('debug.jsonrpc.port')))
+        set_transport(TCPTransport(addon.getSetting('debug.jsonrpc.host'), addon.getSettingInt('debug.jsonrpc.port')))
+
     monitor = NFOMonitor(nb_threads = addon.getSettingInt('debug.nb_threads'))
+    start_metrics_exporter()
+    start_resume_exporter(monitor.add_task)
+    # catch up with the changes made while we were not running
+    if (addon.getSettingBool('movies.export.reconcile') and (addon.getSettingBool('movies.export.watched') or addon.getSettingBool('movies.export.userrating') or addon.getSettingBool('movies.export.resume'))):
+        monitor.reconcile()
 
     log.notice('service started')
 
@@ -21,5 +37,12 @@ if __name__ == '__main__':
             break
 
     log.notice('stopping service')
+    stop_resume_exporter() # queues the last resume points, before the worker threads are stopped
     monitor.stop_all_threads()
+    save_stores(force = True)
+    stop_metrics_exporter()
+    monitor.stop_coordination()
+    stop_script_pool()
+    stop_io_executor()
+    set_transport(None)
     log.notice('service stopped')
@@ -0,0 +1,138 @@
+from __future__ import unicode_literals
+import errno
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from resources.lib.coordination import Coordinator
+
+# several Kodi instances (processes) sharing a coordination folder
+# mutual exclusion is checked with a marker file per NFO, created exclusively while its lock is held: if two holders
+# ever overlap, the second one cannot create the marker
+
+NB_PATHS = 20
+
+def enter(marker_path):
+    try:
+        os.close(os.open(marker_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError as e:
+        if (e.errno != errno.EEXIST):
+            raise
+        return False
+
+# lock each NFO in turn, hold it for a while, and count the overlaps
+def lock_all(shared_dir, instance_id, markers_dir, nb_threads, results):
+    coordinator = Coordinator(shared_dir, instance_id)
+    coordinator.heartbeat()
+    overlaps = []
+    def work():
+        for n in range(NB_PATHS):
+            path = '/movies/movie_%d.nfo' % n
+            if (not coordinator.acquire(path, timeout = 30)):
+                overlaps.append('timeout on %s' % path)
+                continue
+            marker_path = os.path.join(markers_dir, '%d' % n)
+            if (not enter(marker_path)):
+                overlaps.append(path)
+                coordinator.release(path)
+                continue
+            time.sleep(0.005)
+            os.remove(marker_path)
+            coordinator.release(path)
+    threads = [ threading.Thread(target = work) for i in range(nb_threads) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    coordinator.stop()
+    results.put((instance_id, overlaps))
+
+class CoordinatorTest(unittest.TestCase):
+    def setUp(self):
+        self.shared_dir = tempfile.mkdtemp()
+        self.markers_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.shared_dir)
+        shutil.rmtree(self.markers_dir)
+
+    def run_instances(self, nb_instances, nb_threads):
+        results = multiprocessing.Queue()
+        processes = [ multiprocessing.Process(target = lock_all, args = (self.shared_dir, 'instance-%d' % i, self.markers_dir, nb_threads, results)) for i in range(nb_instances) ]
+        for p in processes:
+            p.start()
+        outcome = dict(results.get(timeout = 120) for p in processes)
+        for p in processes:
+            p.join()
+        return outcome
+
+    def test_processes_exclude_each_other(self):
+        outcome = self.run_instances(3, 1)
+        self.assertEqual(outcome, dict(('instance-%d' % i, []) for i in range(3)))
+        self.assertEqual(os.listdir(os.path.join(self.shared_dir, 'locks')), [])
+
+    # threads of an instance share its ID: a lock being created by one of them must not look like a leftover to the others
+    def test_threads_of_an_instance_exclude_each_other(self):
+        outcome = self.run_instances(2, 4)
+        self.assertEqual(outcome, dict(('instance-%d' % i, []) for i in range(2)))
+
+    # same, with a lock file left half-created for a while: it must not be taken over by another thread
+    def test_lock_being_created_is_not_stolen(self):
+        coordinator = Coordinator(self.shared_dir, 'instance-0')
+        coordinator.heartbeat()
+        acquired = {}
+        def acquire(name, timeout):
+            acquired[name] = coordinator.acquire('/movies/movie_0.nfo', timeout = timeout)
+        real_close = os.close
+        def slow_close(fd):
+            time.sleep(0.3)
+            real_close(fd)
+        os.close = slow_close
+        try:
+            first = threading.Thread(target = acquire, args = ('first', 0))
+            first.start()
+            time.sleep(0.1)
+            acquire('second', 0)
+            first.join()
+        finally:
+            os.close = real_close
+        self.assertEqual(acquired, { 'first': True, 'second': False })
+
+    def test_partition(self):
+        coordinators = [ Coordinator(self.shared_dir, 'instance-%d' % i) for i in range(3) ]
+        for coordinator in coordinators:
+            coordinator.heartbeat()
+        for n in range(NB_PATHS):
+            path = '/movies/movie_%d.nfo' % n
+            self.assertEqual([ coordinator.owns(path) for coordinator in coordinators ].count(True), 1)
+
+    def test_takeover_of_leftover_lock(self):
+        previous_run = Coordinator(self.shared_dir, 'instance-0')
+        self.assertTrue(previous_run.acquire('/movies/movie_0.nfo'))
+        # same instance ID, after a restart
+        coordinator = Coordinator(self.shared_dir, 'instance-0')
+        self.assertTrue(coordinator.acquire('/movies/movie_0.nfo'))
+
+    def test_takeover_of_dead_instance_lock(self):
+        dead = Coordinator(self.shared_dir, 'instance-0')
+        dead.heartbeat()
+        self.assertTrue(dead.acquire('/movies/movie_0.nfo'))
+        coordinator = Coordinator(self.shared_dir, 'instance-1')
+        coordinator.heartbeat()
+        self.assertFalse(coordinator.acquire('/movies/movie_0.nfo', timeout = 0))
+        # lease expired
+        lease_path = os.path.join(self.shared_dir, 'instances', 'instance-0.lease')
+        with open(lease_path, 'rb') as fp:
+            lease = json.loads(fp.read().decode('utf-8'))
+        lease['time'] -= 2 * Coordinator.LEASE_TTL
+        with open(lease_path, 'wb') as fp:
+            fp.write(json.dumps(lease).encode('utf-8'))
+        self.assertTrue(coordinator.acquire('/movies/movie_0.nfo', timeout = 0))
+
+if __name__ == '__main__':
+    unittest.main()
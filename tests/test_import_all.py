@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+import weakref
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib.helpers import addon, get_memory_usage
+from resources.lib.helpers.transport import set_transport
+from resources.lib.loadtest import FakeLibrary
+from resources.lib.nfo import NFOHandler
+from resources.lib.tasks.import_all import ImportAllTask
+
+# memory of ImportAllTask over libraries of growing sizes
+# the library is paged, and only the IDs of the selected entries are kept: neither the nb of nfo trees alive at once
+# nor the resident memory may grow with the size of the library
+
+NB_NFOS = 200
+
+# library of nb_entries entries, generated page by page; only NB_NFOS of them, spread over the library, have a nfo
+class SparseLibrary(FakeLibrary):
+    def __init__(self, library_dir, nb_entries):
+        super(SparseLibrary, self).__init__(library_dir, 0)
+        self.library_dir = library_dir
+        self.nb_entries = nb_entries
+        step = nb_entries // NB_NFOS
+        for movie_id in range(step, nb_entries + 1, step):
+            self.add_movie(library_dir, movie_id)
+
+    def call(self, command, timeout = None):
+        if (command['method'] != 'VideoLibrary.GetMovies'):
+            return super(SparseLibrary, self).call(command, timeout)
+        limits = command['params']['limits']
+        page = [ { 'movieid': movie_id, 'label': 'Movie %d' % movie_id, 'playcount': 0, 'userrating': 0,
+            'file': os.path.join(self.library_dir, 'movie_%05d' % movie_id, 'movie_%05d.mkv' % movie_id) }
+            for movie_id in range(limits['start'] + 1, min(limits['end'], self.nb_entries) + 1) ]
+        return { 'jsonrpc': '2.0', 'id': command.get('id'), 'result': { 'movies': page,
+            'limits': { 'start': limits['start'], 'end': limits['start'] + len(page), 'total': self.nb_entries } } }
+
+# keeps track of the nfo handlers alive, and of the resident memory, each time an item is finished
+class SampledImportAllTask(ImportAllTask):
+    def __init__(self, *args, **kwargs):
+        super(SampledImportAllTask, self).__init__(*args, **kwargs)
+        self.max_handlers = 0
+        self.max_memory = 0
+
+    def finish_job(self, job):
+        super(SampledImportAllTask, self).finish_job(job)
+        self.max_handlers = max(self.max_handlers, len(handlers))
+        self.max_memory = max(self.max_memory, get_memory_usage() or 0)
+
+handlers = weakref.WeakSet()
+
+class ImportAllMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.settings = dict(addon.settings)
+        addon.setSetting('movies.auto.notify', 'false')
+        self.real_init = NFOHandler.__init__
+        real_init = self.real_init
+        def init(handler, *args, **kwargs):
+            handlers.add(handler)
+            real_init(handler, *args, **kwargs)
+        NFOHandler.__init__ = init
+
+    def tearDown(self):
+        NFOHandler.__init__ = self.real_init
+        set_transport(None)
+        addon.settings = self.settings
+        shutil.rmtree(self.work_dir)
+
+    def run_import(self, nb_entries):
+        set_transport(SparseLibrary(os.path.join(self.work_dir, 'library_%d' % nb_entries), nb_entries))
+        task = SampledImportAllTask('movie', last_import = 1)
+        memory_before = get_memory_usage() or 0
+        task.run()
+        set_transport(None)
+        self.assertEqual(task.nb_processed, NB_NFOS)
+        self.assertEqual(len(handlers), 0) # all released
+        return (task.max_handlers, task.max_memory - memory_before)
+
+    def test_memory_is_flat(self):
+        (small_handlers, small_memory) = self.run_import(1000)
+        (large_handlers, large_memory) = self.run_import(100000)
+        # bounded by the pipeline, whatever the size of the library
+        self.assertTrue(large_handlers <= max(small_handlers, 1) * 2, '%d nfo handlers alive at once for 100k entries, %d for 1k' % (large_handlers, small_handlers))
+        # what remains is the snapshot of the library, a few dozen bytes per entry
+        if (get_memory_usage() is not None):
+            self.assertTrue(large_memory - small_memory < 32 * 1024 * 1024, 'memory grew by %d MB from 1k to 100k entries' % ((large_memory - small_memory) // (1024 * 1024)))
+
+    # above the memory ceiling, the items in flight are processed before yielding more
+    def test_memory_ceiling(self):
+        addon.setSetting('debug.import.memory_ceiling', '1')
+        addon.setSetting('debug.import.page_size', '10')
+        set_transport(SparseLibrary(os.path.join(self.work_dir, 'library'), 1000))
+        task = SampledImportAllTask('movie', last_import = 1)
+        log_level = headless.log_level
+        headless.log_level = headless.LOGERROR # the ceiling cannot be met: a warning on each page
+        try:
+            task.run()
+        finally:
+            headless.log_level = log_level
+        self.assertEqual(task.nb_processed, NB_NFOS)
+        self.assertTrue(task.max_handlers <= 10, '%d nfo handlers alive at once' % task.max_handlers)
+
+if __name__ == '__main__':
+    unittest.main()
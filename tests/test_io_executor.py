@@ -0,0 +1,24 @@
+from __future__ import unicode_literals
+import tempfile
+import threading
+import time
+import unittest
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib.helpers.io_executor import IOExecutor
+
+class IOExecutorTest(unittest.TestCase):
+    def test_shutdown(self):
+        executor = IOExecutor(threads_per_host = 2)
+        futures = [ executor.submit(path, time.sleep, 0.05) for path in [ '/local/a', 'smb://nas/b', 'smb://nas/c' ] ]
+        threads = [ t for lane in executor.lanes.values() for t in lane.threads ]
+        self.assertEqual(len(threads), 4)
+        executor.shutdown(timeout = 5)
+        # the operations queued before the shutdown are done, then the threads exit
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertFalse(any(t.is_alive() for t in threads))
+        self.assertFalse(any(t in threading.enumerate() for t in threads))
+        self.assertEqual(executor.lanes, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from bs4 import BeautifulSoup
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib import memo
+from resources.lib.helpers import addon, get_nfo_path
+from resources.lib.helpers.transport import set_transport
+from resources.lib.loadtest import FakeLibrary
+from resources.lib.memo import ScriptMemo, hash_input, hash_text
+from resources.lib.nfo.diff import freeze
+from resources.lib.tasks.export_base import ExportBatchTask
+from resources.lib.tasks.import_all import ImportAllTask
+
+SCRIPT = '''existing = [ elt.get_text() for elt in root.find_all('tag', recursive = False) ]
+if ('memo' not in existing):
+    elt = soup.new_tag('tag')
+    elt.string = 'memo'
+    root.append(elt)
+'''
+
+def frozen(xml):
+    return freeze(BeautifulSoup(xml, 'html.parser').find('movie'))
+
+class ScriptMemoTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.memo = ScriptMemo(os.path.join(self.dir, 'script_memo.json'))
+        self.input_hash = hash_input(frozen('<movie><title>Heat</title></movie>'), '/movies/heat.mkv')
+        self.memo.record('/movies/heat.nfo', 'import', 'script-1', self.input_hash, self.input_hash)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_same_script_and_input(self):
+        self.assertEqual(self.memo.lookup('/movies/heat.nfo', 'import', 'script-1', self.input_hash), self.input_hash)
+
+    def test_other_task_family(self):
+        self.assertEqual(self.memo.lookup('/movies/heat.nfo', 'export', 'script-1', self.input_hash), None)
+
+    def test_changed_script(self):
+        self.assertEqual(self.memo.lookup('/movies/heat.nfo', 'import', 'script-2', self.input_hash), None)
+        self.assertTrue(self.memo.is_stale('/movies/heat.nfo', 'import', 'script-2'))
+        self.assertFalse(self.memo.is_stale('/movies/heat.nfo', 'import', 'script-1'))
+        # never processed: not stale, it is selected (or not) on its own merits
+        self.assertFalse(self.memo.is_stale('/movies/other.nfo', 'import', 'script-2'))
+
+    def test_changed_input(self):
+        input_hash = hash_input(frozen('<movie><title>Heat (1995)</title></movie>'), '/movies/heat.mkv')
+        self.assertNotEqual(input_hash, self.input_hash)
+        self.assertEqual(self.memo.lookup('/movies/heat.nfo', 'import', 'script-1', input_hash), None)
+
+    # scripts may depend on the path of the video
+    def test_changed_video_path(self):
+        input_hash = hash_input(frozen('<movie><title>Heat</title></movie>'), '/movies/kids/heat.mkv')
+        self.assertNotEqual(input_hash, self.input_hash)
+        self.assertEqual(self.memo.lookup('/movies/heat.nfo', 'import', 'script-1', input_hash), None)
+
+    def test_forget(self):
+        self.memo.forget('/movies/heat.nfo', 'import')
+        self.assertEqual(self.memo.lookup('/movies/heat.nfo', 'import', 'script-1', self.input_hash), None)
+
+    def test_save_and_load(self):
+        self.memo.save()
+        loaded = ScriptMemo(self.memo.path)
+        self.assertEqual(loaded.lookup('/movies/heat.nfo', 'import', 'script-1', self.input_hash), self.input_hash)
+
+class ScriptMemoTaskTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.library = FakeLibrary(os.path.join(self.dir, 'library'), 5)
+        set_transport(self.library)
+        self.settings = dict(addon.settings)
+        self.script_path = os.path.join(self.dir, 'script.py')
+        self.set_script(SCRIPT)
+        for key, value in [ ('movies.general.script', 'true'), ('movies.general.script.path', self.script_path),
+                ('movies.auto.notify', 'false'), ('movies.export.reconcile', 'false'), ('debug.import.set_details', 'false') ]:
+            addon.setSetting(key, value)
+        memo._memo = ScriptMemo(os.path.join(self.dir, 'script_memo.json'))
+
+    def tearDown(self):
+        memo._memo = None
+        addon.settings = self.settings
+        set_transport(None)
+        shutil.rmtree(self.dir)
+
+    def set_script(self, content):
+        with open(self.script_path, 'wb') as fp:
+            fp.write(content.encode('utf-8'))
+
+    def nfo_path(self, movie_id):
+        return get_nfo_path(self.library.movies[movie_id]['file'])
+
+    def export(self):
+        return ExportBatchTask('movie', sorted(self.library.movies)).process().nb_script_skipped
+
+    # the script is skipped once it is known to leave the nfo unchanged, until the script changes
+    def test_skip(self):
+        self.assertEqual(self.export(), 0) # tags added
+        self.assertEqual(self.export(), 0) # no change, recorded
+        self.assertEqual(self.export(), 5)
+        self.set_script(SCRIPT + '\n# new version\n')
+        self.assertEqual(self.export(), 0)
+
+    # nfo files processed by another version of the script are selected again, and only them
+    def test_stale_entries_selected(self):
+        script_hash = hash_text(SCRIPT)
+        memo._memo.record(self.nfo_path(1), 'import', 'old version', 'input', 'output')
+        memo._memo.record(self.nfo_path(2), 'import', 'old version', 'input', 'output')
+        memo._memo.record(self.nfo_path(3), 'import', script_hash, 'input', 'output')
+        memo._memo.record(self.nfo_path(4), 'export', 'old version', 'input', 'output') # another task family
+        task = ImportAllTask('movie', last_import = time.time() + 3600) # no nfo is newer
+        self.assertEqual(list(task.iter_items()), [ 1, 2 ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+import shutil
+import tempfile
+import unittest
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib.helpers.transport import set_transport
+from resources.lib.loadtest import FakeLibrary
+from resources.lib.nfo import NFOHandlerError
+from resources.lib.nfo.patch import scan, patch, PatchError, NFOPatchHandler
+from resources.lib.nfo.template import element
+from resources.lib.tasks.export_base import ExportSingleTask
+
+NFO = '''<?xml version="1.0" encoding="UTF-8"?>
+<!-- hand-written, keep as is -->
+<movie>
+\t<title>Am\xe9lie &amp; co</title>
+\t<watched>false</watched>
+\t<actor>
+\t\t<name>Audrey Tautou</name>
+\t\t<watched>true</watched>
+\t</actor>
+\t<plot><![CDATA[<b>bold</b> plot]]></plot>
+</movie>
+'''
+
+def apply(content, patches):
+    return patch(content, scan(content, 'movie'), patches)
+
+class PatchTest(unittest.TestCase):
+    def test_replace_in_place(self):
+        (content, stats) = apply(NFO, [ ('watched', 'true') ])
+        self.assertEqual(content, NFO.replace('<watched>false</watched>', '<watched>true</watched>'))
+        self.assertEqual((stats.changed, stats.added), (1, 0))
+
+    def test_append_with_sibling_indentation(self):
+        (content, stats) = apply(NFO, [ ('userrating', 8) ])
+        self.assertEqual(content, NFO.replace('</movie>', '\t<userrating>8</userrating>\n</movie>'))
+        self.assertEqual((stats.changed, stats.added), (0, 1))
+
+    def test_append_compound(self):
+        (content, stats) = apply(NFO, [ ('resume', (element('position', 60), element('total', 6000))) ])
+        self.assertEqual(content, NFO.replace('</movie>', '\t<resume>\n\t\t<position>60</position>\n\t\t<total>6000</total>\n\t</resume>\n</movie>'))
+        # same values: nothing to do
+        self.assertFalse(apply(content, [ ('resume', (element('position', 60), element('total', 6000))) ])[1])
+
+    def test_unchanged(self):
+        (content, stats) = apply(NFO, [ ('watched', 'false'), ('title', 'Am\xe9lie & co') ])
+        self.assertEqual(content, NFO)
+        self.assertFalse(stats)
+
+    def test_escaping(self):
+        (content, stats) = apply(NFO, [ ('title', 'Fish & <Chips>') ])
+        self.assertTrue('<title>Fish &amp; &lt;Chips&gt;</title>' in content)
+
+    # the existing line endings are kept, including on inserted lines
+    def test_crlf(self):
+        crlf = NFO.replace('\n', '\r\n')
+        (content, stats) = apply(crlf, [ ('watched', 'true'), ('userrating', 8), ('resume', (element('position', 60), element('total', 6000))) ])
+        self.assertEqual(content.count('\r\n'), content.count('\n'))
+        self.assertTrue(content.endswith('\t<userrating>8</userrating>\r\n\t<resume>\r\n\t\t<position>60</position>\r\n\t\t<total>6000</total>\r\n\t</resume>\r\n</movie>\r\n'))
+
+    # only direct children of the root are patched
+    def test_nested_element_ignored(self):
+        content = '<movie>\n    <actor>\n        <watched>true</watched>\n    </actor>\n</movie>\n'
+        (patched, stats) = apply(content, [ ('watched', 'false') ])
+        self.assertEqual(patched, content.replace('</movie>', '    <watched>false</watched>\n</movie>'))
+
+    def test_duplicate_element(self):
+        content = '<movie><watched>true</watched><watched>false</watched></movie>'
+        self.assertRaises(PatchError, apply, content, [ ('watched', 'true') ])
+
+    def test_non_leaf_element(self):
+        content = '<movie><watched><value>true</value></watched></movie>'
+        self.assertRaises(PatchError, apply, content, [ ('watched', 'true') ])
+
+    def test_unbalanced_tags(self):
+        self.assertRaises(PatchError, scan, '<movie><title>Heat</plot></movie>', 'movie')
+        self.assertRaises(PatchError, scan, '<movie><title>Heat</title>', 'movie')
+
+    def test_stray_lower_than(self):
+        self.assertRaises(PatchError, scan, '<movie><plot>a < b</plot></movie>', 'movie')
+
+    def test_trailing_root(self):
+        self.assertRaises(PatchError, scan, '<movie></movie><movie></movie>', 'movie')
+
+    def test_wrong_root(self):
+        self.assertRaises(PatchError, scan, '<tvshow></tvshow>', 'movie')
+
+class PatchFallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.library_dir = tempfile.mkdtemp()
+        self.library = FakeLibrary(self.library_dir, 1)
+        set_transport(self.library)
+
+    def tearDown(self):
+        set_transport(None)
+        shutil.rmtree(self.library_dir)
+
+    # a file that cannot be patched is loaded the regular way, and the patch handler is released
+    def test_fallback_closes_patch_handler(self):
+        task = ExportSingleTask('movie', 1)
+        nfo = NFOPatchHandler(task, 'movie', 1)
+        with open(nfo.nfo_path, 'wb') as fp:
+            fp.write(b'<movie><plot>a < b</plot></movie>')
+        self.assertRaises(NFOHandlerError, nfo.make_xml)
+        fallback = task.on_nfo_load_failed(nfo, None)
+        self.assertEqual(fallback.family, 'load')
+        self.assertEqual((nfo.raw, nfo.scanned), (None, None))
+        fallback.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib import reconcile
+from resources.lib.helpers import addon
+from resources.lib.helpers.transport import set_transport
+from resources.lib.loadtest import FakeLibrary
+from resources.lib.reconcile import ExportedStates
+from resources.lib.tasks.export_base import ExportReconcileTask
+
+class ExportReconcileTest(unittest.TestCase):
+    def setUp(self):
+        self.library_dir = tempfile.mkdtemp()
+        self.library = FakeLibrary(self.library_dir, 5)
+        set_transport(self.library)
+        self.settings = dict(addon.settings)
+        for key, value in [ ('movies.export.watched', 'true'), ('movies.export.userrating', 'true'), ('movies.export.resume', 'false') ]:
+            addon.setSetting(key, value)
+        self.states = ExportedStates(os.path.join(self.library_dir, 'exported_states.json'))
+        reconcile._states = self.states
+
+    def tearDown(self):
+        reconcile._states = None
+        addon.settings = self.settings
+        set_transport(None)
+        shutil.rmtree(self.library_dir)
+
+    def reconcile(self):
+        task = ExportReconcileTask('movie')
+        task.populate_entries()
+        return task.items
+
+    def path(self, movie_id):
+        return self.library.movies[movie_id]['file']
+
+    # nothing to compare against: the current states are recorded, nothing is exported
+    def test_first_run(self):
+        self.assertTrue(self.states.new)
+        self.assertEqual(self.reconcile(), [])
+        self.assertFalse(self.states.new)
+        self.assertEqual(self.states.entries, dict((self.path(movie_id), { 'watched': False, 'userrating': 0 }) for movie_id in range(1, 6)))
+
+    # only the entries changed since the last export are exported
+    def test_mismatches(self):
+        self.reconcile()
+        self.library.set_playcount(2, 1)
+        self.library.movies[4]['userrating'] = 7
+        self.assertEqual(self.reconcile(), [ 2, 4 ])
+        # until exported
+        self.states.record(self.path(2), { 'watched': True, 'userrating': 0 })
+        self.assertEqual(self.reconcile(), [ 4 ])
+
+    def test_removed_entries_are_pruned(self):
+        self.reconcile()
+        removed = self.path(3)
+        del self.library.movies[3]
+        self.assertEqual(self.reconcile(), [])
+        self.assertFalse(removed in self.states.entries)
+        self.assertEqual(len(self.states.entries), 4)
+
+    # export does not write anything: the pass stops, and the recorded states are kept as is
+    def test_nothing_exported(self):
+        self.reconcile()
+        entries = dict(self.states.entries)
+        addon.setSetting('movies.export.watched', 'false')
+        addon.setSetting('movies.export.userrating', 'false')
+        def retain(video_paths):
+            self.fail('retain() called on %d paths' % len(video_paths))
+        self.states.retain = retain
+        self.assertEqual(self.reconcile(), [])
+        self.assertEqual(self.states.entries, entries)
+
+if __name__ == '__main__':
+    unittest.main()
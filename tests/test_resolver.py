@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib.helpers.resolver import NFOResolver, UncachedNFOResolver, get_nfo_candidates
+
+class NFOResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    # create files (and their folders) under the temp dir; returns the path of the first one
+    def touch(self, *names):
+        for name in names:
+            path = os.path.join(self.dir, name)
+            if (not os.path.isdir(os.path.dirname(path))):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'wb').close()
+        return os.path.join(self.dir, names[0])
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    # folders changed a while ago, so that their listings can be cached
+    def age(self, *names):
+        t = time.time() - 60
+        for name in names:
+            os.utime(self.path(name), (t, t))
+
+    def test_plain_file(self):
+        video = self.touch('Heat/Heat.mkv')
+        for resolver in [ NFOResolver(), NFOResolver(movie_nfo = True), UncachedNFOResolver() ]:
+            self.assertEqual(resolver.find(video), None)
+            self.assertEqual(resolver.resolve(video), self.path('Heat/Heat.nfo')) # where a new nfo goes
+        self.touch('Heat/movie.nfo')
+        # movie.nfo only if each movie has its own folder
+        self.assertEqual(NFOResolver().find(video), None)
+        self.assertEqual(NFOResolver(movie_nfo = True).find(video), self.path('Heat/movie.nfo'))
+        # the nfo named after the video comes first
+        self.touch('Heat/Heat.nfo')
+        self.assertEqual(NFOResolver(movie_nfo = True).find(video), self.path('Heat/Heat.nfo'))
+
+    def test_dvd_folder(self):
+        video = self.touch('Heat/VIDEO_TS/VIDEO_TS.IFO')
+        self.assertEqual(NFOResolver().resolve(video), self.path('Heat/movie.nfo'))
+        self.touch('Heat/VIDEO_TS/VIDEO_TS.nfo')
+        self.assertEqual(NFOResolver().find(video), self.path('Heat/VIDEO_TS/VIDEO_TS.nfo'))
+        self.touch('Heat/movie.nfo')
+        self.assertEqual(NFOResolver().find(video), self.path('Heat/movie.nfo'))
+
+    def test_bluray_folder(self):
+        video = self.touch('Heat/BDMV/index.bdmv')
+        self.assertEqual(NFOResolver().resolve(video), self.path('Heat/movie.nfo'))
+        self.touch('Heat/BDMV/index.nfo')
+        self.assertEqual(NFOResolver().find(video), self.path('Heat/BDMV/index.nfo'))
+
+    def test_stack(self):
+        self.touch('Heat/Heat-cd1.avi', 'Heat/Heat-cd2.avi')
+        video = 'stack://%s , %s' % (self.path('Heat/Heat-cd1.avi'), self.path('Heat/Heat-cd2.avi'))
+        self.assertEqual(NFOResolver().resolve(video), self.path('Heat/Heat.nfo')) # the stack title
+        self.touch('Heat/Heat-cd1.nfo')
+        self.assertEqual(NFOResolver().find(video), self.path('Heat/Heat-cd1.nfo'))
+        self.touch('Heat/movie.nfo')
+        self.assertEqual(NFOResolver().find(video), self.path('Heat/Heat-cd1.nfo'))
+        self.touch('Heat/Heat.nfo')
+        self.assertEqual(NFOResolver().find(video), self.path('Heat/Heat.nfo'))
+
+    def test_stack_movie_nfo(self):
+        self.touch('Heat/Heat-cd1.avi', 'Heat/Heat-cd2.avi', 'Heat/movie.nfo')
+        video = 'stack://%s , %s' % (self.path('Heat/Heat-cd1.avi'), self.path('Heat/Heat-cd2.avi'))
+        self.assertEqual(NFOResolver(movie_nfo = True).find(video), self.path('Heat/movie.nfo'))
+        # never where a new nfo goes
+        self.assertEqual(get_nfo_candidates(video, movie_nfo = True)[0], (self.path('Heat') + os.sep, 'Heat.nfo'))
+
+    # a listing is reused as long as the folder does not change
+    def test_cache_invalidated_on_change(self):
+        video = self.touch('Heat/Heat.mkv')
+        self.age('Heat')
+        resolver = NFOResolver()
+        self.assertEqual(resolver.find(video), None)
+        self.assertEqual(resolver.find(video), None)
+        self.assertEqual(resolver.get_stats(), { 'folders': 1, 'hits': 1, 'misses': 1 })
+        self.touch('Heat/Heat.nfo') # the folder mtime changes
+        self.assertEqual(resolver.find(video), self.path('Heat/Heat.nfo'))
+        self.assertEqual(resolver.get_stats()['misses'], 2)
+
+    # the listing is proven stale by the folder mtime only: an unchanged mtime means the cached listing is used
+    def test_cache_used(self):
+        video = self.touch('Heat/Heat.mkv')
+        self.age('Heat')
+        resolver = NFOResolver()
+        self.assertEqual(resolver.find(video), None)
+        self.touch('Heat/Heat.nfo')
+        self.age('Heat')
+        self.assertEqual(resolver.find(video), None)
+
+    # a listing made within the same second as the last change of the folder may miss a file created right after
+    def test_same_second(self):
+        video = self.touch('Heat/Heat.mkv')
+        t = int(time.time()) + 1 # whatever the time it takes to run the test
+        os.utime(self.path('Heat'), (t, t))
+        resolver = NFOResolver()
+        self.assertEqual(resolver.find(video), None)
+        self.assertEqual(resolver.find(video), None)
+        self.assertEqual(resolver.get_stats()['hits'], 0)
+
+    def test_max_folders(self):
+        videos = [ self.touch('Movie%d/Movie%d.mkv' % (n, n)) for n in range(3) ]
+        self.age(*[ 'Movie%d' % n for n in range(3) ])
+        resolver = NFOResolver(max_folders = 2)
+        for video in videos:
+            resolver.find(video)
+        self.assertEqual(resolver.get_stats()['folders'], 2)
+        resolver.find(videos[0]) # evicted
+        self.assertEqual(resolver.get_stats()['misses'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
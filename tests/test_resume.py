@@ -0,0 +1,96 @@
+from __future__ import unicode_literals
+import tempfile
+import unittest
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib import resume
+from resources.lib.resume import ResumeExporter
+
+INTERVAL = 60
+
+# stands for the time module in resume.py
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000000.0
+    def time(self):
+        return self.now
+    def advance(self, seconds):
+        self.now += seconds
+
+class ResumeExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.real_time = resume.time
+        resume.time = self.clock
+        self.tasks = [] # queued tasks
+        self.exporter = ResumeExporter(self.tasks.append, INTERVAL) # not started: ticks are driven by the test
+
+    def tearDown(self):
+        resume.time = self.real_time
+
+    # IDs exported by each task queued since the last call
+    def exported(self):
+        exported = [ task.video_ids for task in self.tasks ]
+        del self.tasks[:]
+        return exported
+
+    def test_flush_on_interval(self):
+        self.exporter.mark(1)
+        self.exporter.mark(2)
+        self.exporter.mark(1)
+        self.clock.advance(INTERVAL - 1)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [])
+        self.clock.advance(1)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [ [ 1, 2 ] ])
+        # nothing left
+        self.clock.advance(INTERVAL)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [])
+
+    # shortly after the end of a playback, without waiting for the interval
+    def test_flush_after_playback(self):
+        self.exporter.mark(1)
+        self.exporter.request_flush()
+        self.clock.advance(ResumeExporter.END_DELAY - 1)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [])
+        self.clock.advance(1)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [ [ 1 ] ])
+
+    # a movie is written at most once per interval, whatever the nb of playbacks
+    def test_once_per_interval(self):
+        self.exporter.mark(1)
+        self.exporter.request_flush()
+        self.clock.advance(ResumeExporter.END_DELAY)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [ [ 1 ] ])
+        # played again
+        self.exporter.mark(1)
+        self.exporter.mark(2)
+        self.exporter.request_flush()
+        self.clock.advance(ResumeExporter.END_DELAY)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [ [ 2 ] ]) # 1 is held back
+        self.clock.advance(INTERVAL - 2 * ResumeExporter.END_DELAY - 1)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [])
+        self.clock.advance(INTERVAL)
+        self.exporter.tick()
+        self.assertEqual(self.exported(), [ [ 1 ] ])
+
+    # on shutdown, everything is written, held back or not
+    def test_flush_on_stop(self):
+        self.exporter.mark(1)
+        self.exporter.flush()
+        self.assertEqual(self.exported(), [ [ 1 ] ])
+        self.exporter.mark(1)
+        self.exporter.mark(2)
+        self.exporter.stop()
+        self.assertEqual(self.exported(), [ [ 1, 2 ] ])
+        self.assertTrue(self.exporter.stopped.is_set())
+
+if __name__ == '__main__':
+    unittest.main()
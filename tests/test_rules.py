@@ -0,0 +1,120 @@
+from __future__ import unicode_literals
+import json
+import os
+import tempfile
+import unittest
+from bs4 import BeautifulSoup
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib.headless import ADDON_DIR
+from resources.lib.rules import RuleSet, RulesError
+from resources.lib.script import FileScriptHandler
+
+EXAMPLES_DIR = os.path.join(ADDON_DIR, 'resources', 'script_examples')
+
+# same tags as example_01-tags_simple.py, which replaces all the tags of the nfo
+EXAMPLE_01_RULES = {
+    'replace_tags': True,
+    'rules': [
+        { 'tag': 'audio: fr', 'audio_language': 'fre' },
+        { 'tag': 'subs: fr', 'subtitle_language': 'fre' },
+        { 'tag': 'favorite actors: Jean-Claude Van Damme', 'actor': 'Jean-Claude Van Damme' },
+        { 'tag': 'video: UltraHD / 4k', 'video_height': 2160 },
+        { 'tag': 'top 250', 'top250': True },
+    ]
+}
+
+# same tags as example_02-tags_advanced.py, based on the location of the file
+EXAMPLE_02_RULES = {
+    'replace_tags': True,
+    'rules': [
+        { 'tag': 'cartoons', 'path': '/My cartoons/' },
+        { 'tag': 'comics', 'path': '/My comics movies/' },
+        { 'tag': 'favorites', 'path': '/Favorites/' },
+        { 'tag': 'audio: fr', 'path': r'/[^/]*\.FRENCH\.[^/]*$' },
+    ]
+}
+
+STREAMS = '<fileinfo><streamdetails><video><height>%d</height></video><audio><language>%s</language></audio>%s</streamdetails></fileinfo>'
+SUBTITLE = '<subtitle><language>%s</language></subtitle>'
+ACTOR = '<actor><name>%s</name><role>Himself</role></actor>'
+
+NFOS = [
+    '<movie><title>Bloodsport</title>' + ACTOR % 'Jean-Claude Van Damme' + STREAMS % (1080, 'eng', SUBTITLE % 'fre') + '<tag>old</tag></movie>',
+    '<movie><title>Am\xe9lie</title><top250>55</top250>' + ACTOR % 'Audrey Tautou' + STREAMS % (2160, 'fre', SUBTITLE % 'eng') + '</movie>',
+    '<movie><title>Heat</title><top250>0</top250>' + STREAMS % (720, 'eng', '') + '<tag>audio: fr</tag><tag>kept?</tag></movie>',
+    '<movie><title>Timecop</title>' + ACTOR % 'Jean-Claude Van Damme' + ACTOR % 'Mia Sara' + STREAMS % (2160, 'fre', SUBTITLE % 'fre') + '<top250>12</top250></movie>',
+    '<movie><title>Empty</title></movie>',
+]
+
+VIDEO_PATHS = [
+    '/movies/My cartoons/Cars (2006)/Cars.mkv',
+    '/movies/Favorites/My comics movies/Superman.mkv',
+    '/movies/Heat.FRENCH.1080p.mkv',
+    '/movies/Favorites/Heat (1995)/Heat.mkv',
+    '/movies/Other/Other.mkv',
+]
+
+def parse(xml):
+    soup = BeautifulSoup(xml, 'html.parser')
+    return (soup, soup.find('movie'))
+
+def get_tags(root):
+    return [ elt.get_text() for elt in root.find_all('tag', recursive = False) ]
+
+class RuleSetTest(unittest.TestCase):
+    def run_script(self, name, xml, video_path):
+        (soup, root) = parse(xml)
+        script = FileScriptHandler(os.path.join(EXAMPLES_DIR, name))
+        script.execute({ 'soup': soup, 'root': root, 'video_path': video_path, 'nfo_path': video_path.rsplit('.', 1)[0] + '.nfo',
+            'video_type': 'movie', 'video_title': '', 'task_family': 'import' })
+        return sorted(get_tags(root))
+
+    def run_rules(self, rules, xml, video_path):
+        (soup, root) = parse(xml)
+        RuleSet(json.dumps(rules)).apply(soup, root, video_path)
+        return sorted(get_tags(root))
+
+    # language, actor, video height and top250 conditions
+    def test_same_tags_as_example_01(self):
+        for xml in NFOS:
+            self.assertEqual(self.run_rules(EXAMPLE_01_RULES, xml, VIDEO_PATHS[0]), self.run_script('example_01-tags_simple.py', xml, VIDEO_PATHS[0]), xml)
+
+    # path conditions
+    def test_same_tags_as_example_02(self):
+        for video_path in VIDEO_PATHS:
+            for xml in NFOS[:3]:
+                self.assertEqual(self.run_rules(EXAMPLE_02_RULES, xml, video_path), self.run_script('example_02-tags_advanced.py', xml, video_path), video_path)
+
+    def test_example_03(self):
+        with open(os.path.join(EXAMPLES_DIR, 'example_03-tag_rules.json'), 'rb') as fp:
+            rule_set = RuleSet(fp.read().decode('utf-8'))
+        (soup, root) = parse(NFOS[3])
+        self.assertTrue(rule_set.apply(soup, root, '/movies/kids/Timecop.mkv'))
+        self.assertEqual(sorted(get_tags(root)), [ 'audio: fr', 'favorite actors: Jean-Claude Van Damme', 'kids', 'subs: fr', 'top 250', 'video: UltraHD / 4k' ])
+
+    # without replace_tags, the missing tags are added, and the other ones kept
+    def test_merge(self):
+        rules = { 'rules': [ { 'tag': 'audio: fr', 'audio_language': 'fre' }, { 'tag': 'HD', 'min_video_height': 720 } ] }
+        (soup, root) = parse(NFOS[2])
+        self.assertTrue(RuleSet(json.dumps(rules)).apply(soup, root))
+        self.assertEqual(get_tags(root), [ 'audio: fr', 'kept?', 'HD' ])
+        # nothing left to do
+        self.assertFalse(RuleSet(json.dumps(rules)).apply(soup, root))
+        self.assertEqual(get_tags(root), [ 'audio: fr', 'kept?', 'HD' ])
+
+    # with replace_tags, tags not given by the rules are removed, the ones given by the rules are kept in place
+    def test_replace_tags(self):
+        rules = { 'replace_tags': True, 'rules': [ { 'tag': 'kept?', 'top250': False }, { 'tag': 'HD', 'min_video_height': 720 } ] }
+        (soup, root) = parse(NFOS[2])
+        self.assertTrue(RuleSet(json.dumps(rules)).apply(soup, root))
+        self.assertEqual(get_tags(root), [ 'kept?', 'HD' ])
+        self.assertFalse(RuleSet(json.dumps(rules)).apply(soup, root))
+
+    def test_invalid_rules(self):
+        for content in [ 'not json', '{}', '{"rules": [{"tag": "x"}]}', '{"rules": [{"tag": "x", "unknown": 1}]}',
+                '{"rules": [{"tag": "x", "path": "("}]}', '{"rules": [{"tag": "x", "min_video_height": "high"}]}' ]:
+            self.assertRaises(RulesError, RuleSet, content)
+
+if __name__ == '__main__':
+    unittest.main()
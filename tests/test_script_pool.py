@@ -0,0 +1,106 @@
+from __future__ import unicode_literals
+import sys
+import tempfile
+import time
+import unittest
+try:
+    import resource
+except ImportError: # Windows: no CPU limit
+    resource = None
+from bs4 import BeautifulSoup
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib.script import ScriptHandler, ScriptExecError
+from resources.lib.script_pool import ScriptPool, ScriptTimeoutError, ScriptWorkerError
+
+ADD_TAG = '''elt = soup.new_tag('tag')
+elt.string = 'from %s' % video_path
+root.append(elt)
+log.info('tag added')
+print('printed output does not break the protocol')
+'''
+INFINITE_LOOP = 'while True:\n    pass\n'
+CPU_BURNER = 'n = 0\nwhile True:\n    n += 1\n'
+
+def parse(xml):
+    return BeautifulSoup(xml, 'html.parser').find('movie')
+
+# scripts run by worker processes started with the interpreter running the tests
+class ScriptPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = None
+
+    def tearDown(self):
+        if (self.pool):
+            self.pool.close()
+
+    def execute(self, content, xml = '<movie><title>Heat</title></movie>'):
+        return self.pool.execute(ScriptHandler(content), 'movie', parse(xml), { 'video_path': '/movies/Heat.mkv' })
+
+    # the pid of the idle worker
+    def worker_pid(self):
+        self.assertEqual(self.pool.idle.qsize(), 1)
+        return self.pool.idle.queue[0].process.pid
+
+    def test_script(self):
+        self.pool = ScriptPool(sys.executable, 1, timeout = 10, cpu_limit = 10)
+        (soup, root) = self.execute(ADD_TAG)
+        self.assertEqual([ elt.get_text() for elt in root.find_all('tag') ], [ 'from /movies/Heat.mkv' ])
+        self.assertEqual(root.find('title').get_text(), 'Heat')
+        # the worker is reused, and the script is only sent once
+        pid = self.worker_pid()
+        self.execute(ADD_TAG)
+        self.assertEqual(self.worker_pid(), pid)
+        self.assertEqual(len(self.pool.idle.queue[0].scripts), 1)
+        self.assertTrue(self.pool.get_stats('raw').startswith('2 calls'))
+
+    def test_script_error(self):
+        self.pool = ScriptPool(sys.executable, 1, timeout = 10, cpu_limit = 10)
+        try:
+            self.execute('undefined_name')
+            self.fail('no error')
+        except ScriptExecError as e:
+            self.assertTrue('NameError' in str(e.ex))
+        self.assertTrue(self.pool.get_stats('raw').endswith('1 errors, 0 timeouts'))
+        # the worker is still usable
+        self.execute(ADD_TAG)
+
+    # beyond the wall time limit, the worker is killed, and a new one is started for the next script
+    def test_timeout(self):
+        self.pool = ScriptPool(sys.executable, 1, timeout = 1, cpu_limit = 0)
+        self.execute(ADD_TAG)
+        pid = self.worker_pid()
+        start = time.time()
+        self.assertRaises(ScriptTimeoutError, self.execute, INFINITE_LOOP)
+        self.assertTrue(time.time() - start < 5)
+        self.assertEqual(self.pool.nb_workers, 0)
+        self.execute(ADD_TAG)
+        self.assertNotEqual(self.worker_pid(), pid)
+        self.assertTrue(self.pool.get_stats('raw').endswith('0 errors, 1 timeouts'))
+
+    # beyond the CPU time limit, the script gets an exception; the worker survives, and keeps working afterwards
+    @unittest.skipIf(resource is None, 'no CPU time limit on this platform')
+    def test_cpu_limit(self):
+        self.pool = ScriptPool(sys.executable, 1, timeout = 30, cpu_limit = 1)
+        self.execute(ADD_TAG)
+        pid = self.worker_pid()
+        for n in range(2):
+            try:
+                self.execute(CPU_BURNER)
+                self.fail('no error')
+            except ScriptExecError as e:
+                self.assertTrue('CPULimitExceeded' in str(e.ex))
+            self.assertEqual(self.worker_pid(), pid)
+        # the limit is lifted between scripts: the worker does not get killed by SIGXCPU later on
+        time.sleep(0.5)
+        self.execute(ADD_TAG)
+        self.assertEqual(self.worker_pid(), pid)
+
+    def test_worker_died(self):
+        self.pool = ScriptPool(sys.executable, 1, timeout = 10, cpu_limit = 10)
+        self.assertRaises(ScriptWorkerError, self.execute, 'import os\nos._exit(1)\n')
+        self.assertEqual(self.pool.nb_workers, 0)
+        self.execute(ADD_TAG)
+
+if __name__ == '__main__':
+    unittest.main()
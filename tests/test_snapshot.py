@@ -0,0 +1,94 @@
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import unittest
+from resources.lib.snapshot import SnapshotBuilder, load_snapshot, diff_snapshots, HEADER, MAGIC
+
+PATHS = [
+    '/movies/Heat (1995)/Heat.mkv',
+    '/movies/Am\xe9lie (2001)/Am\xe9lie.mkv',
+    '/movies/\u96fb\u5f71/\u96fb\u5f71.mkv',
+    '/movies/Zorro/Zorro.avi',
+    '/movies/Alien/Alien.mkv',
+]
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.snapshots = []
+
+    def tearDown(self):
+        for snapshot in self.snapshots:
+            snapshot.close()
+        shutil.rmtree(self.dir)
+
+    def save(self, entries, name = 'library.snapshot'):
+        builder = SnapshotBuilder()
+        for entry in entries:
+            builder.add(*entry)
+        path = os.path.join(self.dir, name)
+        builder.save(path)
+        snapshot = load_snapshot(path)
+        self.assertTrue(snapshot is not None)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def test_round_trip(self):
+        entries = [ (n + 1, path, n, n - 1, 1500000000.5 + n) for n, path in enumerate(PATHS) ]
+        snapshot = self.save(entries)
+        self.assertEqual(len(snapshot), len(entries))
+        # sorted by utf-8 encoded path
+        paths = [ entry.path for entry in snapshot ]
+        self.assertEqual(paths, sorted(PATHS, key = lambda path: path.encode('utf-8')))
+        for (video_id, path, playcount, userrating, nfo_mtime) in entries:
+            entry = snapshot.find(path)
+            self.assertEqual((entry.video_id, entry.path, entry.playcount, entry.userrating, entry.nfo_mtime), (video_id, path, playcount, userrating, nfo_mtime))
+        self.assertEqual(snapshot.find('/movies/Missing/Missing.mkv'), None)
+        self.assertEqual(snapshot.find('/movies/Am\xe9lie (2001)/Amelie.mkv'), None)
+
+    def test_empty_library(self):
+        snapshot = self.save([])
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(list(snapshot), [])
+        self.assertEqual(snapshot.find(PATHS[0]), None)
+        diff = diff_snapshots(snapshot, self.save([ (1, PATHS[0], 0, 0, 0) ], 'new.snapshot'))
+        self.assertEqual((diff.added, diff.removed, diff.changed), ([ PATHS[0] ], [], []))
+
+    def test_diff(self):
+        old = self.save([ (n + 1, path, 0, 0, 1000) for n, path in enumerate(PATHS[:4]) ], 'old.snapshot')
+        new = self.save([
+            (11, PATHS[0], 0, 0, 1000), # refreshed: new ID, nothing else changed
+            (2, PATHS[1], 1, 0, 1000), # watched
+            (3, PATHS[2], 0, 0, 2000), # nfo modified
+            (5, PATHS[4], 0, 0, 1000), # added
+        ], 'new.snapshot')
+        diff = diff_snapshots(old, new)
+        self.assertEqual(diff.added, [ PATHS[4] ])
+        self.assertEqual(diff.removed, [ PATHS[3] ])
+        self.assertEqual(sorted(diff.changed), sorted([ PATHS[1], PATHS[2] ]))
+        # a builder can be compared as well, before being saved
+        builder = SnapshotBuilder()
+        builder.add(1, PATHS[0], 0, 0, 1000)
+        self.assertEqual(diff_snapshots(old, builder).removed, sorted(PATHS[1:4], key = lambda path: path.encode('utf-8')))
+
+    def test_old_version_rejected(self):
+        path = os.path.join(self.dir, 'old.snapshot')
+        with open(path, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, 1, 0, 0))
+        self.assertEqual(load_snapshot(path), None)
+
+    def test_truncated_rejected(self):
+        self.save([ (1, PATHS[0], 0, 0, 0) ])
+        path = os.path.join(self.dir, 'library.snapshot')
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        with open(path, 'wb') as fp:
+            fp.write(content[:-1])
+        self.assertEqual(load_snapshot(path), None)
+
+    def test_missing(self):
+        self.assertEqual(load_snapshot(os.path.join(self.dir, 'missing.snapshot')), None)
+
+if __name__ == '__main__':
+    unittest.main()
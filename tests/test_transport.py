@@ -0,0 +1,202 @@
+from __future__ import unicode_literals
+import json
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from resources.lib import headless
+headless.install(profile = tempfile.mkdtemp())
+from resources.lib.helpers.transport import TCPTransport, TransportError, TransportTimeoutError
+
+# local stand-in for Kodi's JSON-RPC TCP server
+# like Kodi, it sends JSON objects back to back, without delimiter, and handles requests concurrently, so that responses
+# may come back in any order; the method of a request tells how to answer it:
+#   echo: respond with the params
+#   sleep: respond with the params after params['delay'] seconds
+#   ignore: never respond
+#   drop: close the connection without responding
+class StandInServer(object):
+    def __init__(self, chunk_size = None, notify = False):
+        self.chunk_size = chunk_size # send responses in chunks of that many bytes, to split messages
+        self.notify = notify # send a notification before each response
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.lock = threading.Lock()
+        self.connections = []
+        self.request_ids = []
+        self.nb_accepted = 0
+        thread = threading.Thread(target = self._accept_loop)
+        thread.daemon = True
+        thread.start()
+
+    def _accept_loop(self):
+        while (True):
+            try:
+                (conn, address) = self.sock.accept()
+            except (socket.error, IOError):
+                return
+            with self.lock:
+                self.connections.append(conn)
+                self.nb_accepted += 1
+            thread = threading.Thread(target = self._serve, args = (conn, threading.Lock()))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn, write_lock):
+        decoder = json.JSONDecoder()
+        buf = b''
+        while (True):
+            try:
+                chunk = conn.recv(4096)
+            except (socket.error, IOError):
+                return
+            if (not chunk):
+                return
+            buf += chunk
+            while (buf.strip()):
+                try:
+                    (request, end) = decoder.raw_decode(buf.decode('utf-8').lstrip())
+                except ValueError:
+                    break
+                buf = buf.decode('utf-8').lstrip()[end:].encode('utf-8')
+                with self.lock:
+                    self.request_ids.append(request['id'])
+                if (request['method'] == 'drop'):
+                    self.drop(conn)
+                    return
+                if (request['method'] != 'ignore'):
+                    thread = threading.Thread(target = self._respond, args = (conn, write_lock, request))
+                    thread.daemon = True
+                    thread.start()
+
+    def _respond(self, conn, write_lock, request):
+        if (request['method'] == 'sleep'):
+            time.sleep(request['params']['delay'])
+        data = json.dumps({ 'jsonrpc': '2.0', 'id': request['id'], 'result': request.get('params') }, ensure_ascii = False)
+        if (self.notify):
+            data = json.dumps({ 'jsonrpc': '2.0', 'method': 'VideoLibrary.OnUpdate', 'params': { 'data': request['id'] } }) + data
+        data = data.encode('utf-8')
+        size = self.chunk_size or len(data)
+        try:
+            with write_lock:
+                for start in range(0, len(data), size):
+                    conn.sendall(data[start:start + size])
+        except (socket.error, IOError):
+            pass
+
+    def drop(self, conn):
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except (socket.error, IOError):
+            pass
+        conn.close()
+
+    # close all the client connections, as Kodi does when it restarts its server
+    def drop_all(self):
+        with self.lock:
+            connections = self.connections
+            self.connections = []
+        for conn in connections:
+            self.drop(conn)
+
+    def close(self):
+        self.drop_all()
+        # the socket stays open as long as the accept loop is blocked on it: shut it down first to wake it up
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, IOError):
+            pass
+        self.sock.close()
+
+def request(method, **params):
+    return { 'jsonrpc': '2.0', 'id': 'caller', 'method': method, 'params': params }
+
+class TCPTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = None
+        self.transport = None
+
+    def tearDown(self):
+        if (self.transport):
+            self.transport.close()
+        if (self.server):
+            self.server.close()
+
+    def connect(self, server, **kwargs):
+        self.server = server
+        self.transport = TCPTransport('127.0.0.1', server.port, **kwargs)
+        return self.transport
+
+    def test_call(self):
+        transport = self.connect(StandInServer(), timeout = 5)
+        response = transport.call({ 'jsonrpc': '2.0', 'id': 'abc', 'method': 'echo', 'params': { 'title': 'Am\xe9lie' } })
+        self.assertEqual(response['id'], 'abc') # the id of the caller, not the one used on the wire
+        self.assertEqual(response['result'], { 'title': 'Am\xe9lie' })
+
+    # messages split anywhere, even within a multi-byte character, with notifications in between
+    def test_split_messages_and_notifications(self):
+        notifications = []
+        transport = self.connect(StandInServer(chunk_size = 1, notify = True), timeout = 5, on_notification = notifications.append)
+        response = transport.call(request('echo', title = '\u96fb\u5f71'))
+        self.assertEqual(response['result'], { 'title': '\u96fb\u5f71' })
+        self.assertEqual(len(notifications), 1)
+        self.assertEqual(notifications[0]['method'], 'VideoLibrary.OnUpdate')
+
+    # all requests are sent before the first response is read: responses come back in any order, matched by id
+    def test_pipelined_calls(self):
+        transport = self.connect(StandInServer(), pool_size = 1, timeout = 5)
+        delays = [ 0.4, 0.3, 0.2, 0.1, 0 ]
+        start = time.time()
+        responses = transport.call_many([ request('sleep', delay = delay, n = n) for n, delay in enumerate(delays) ])
+        elapsed = time.time() - start
+        self.assertEqual([ response['result']['n'] for response in responses ], list(range(len(delays))))
+        self.assertTrue(elapsed < sum(delays), 'calls were not pipelined (%.2fs)' % elapsed)
+        # one connection, with distinct ids on the wire
+        self.assertEqual(self.server.nb_accepted, 1)
+        self.assertEqual(len(set(self.server.request_ids)), len(delays))
+
+    def test_timeout(self):
+        transport = self.connect(StandInServer(), timeout = 0.3)
+        start = time.time()
+        self.assertRaises(TransportTimeoutError, transport.call, request('ignore'))
+        self.assertTrue(time.time() - start < 2)
+        # the connection is still usable
+        self.assertEqual(transport.call(request('echo', n = 1))['result'], { 'n': 1 })
+        # a late response is ignored
+        self.assertRaises(TransportTimeoutError, transport.call, request('sleep', delay = 0.6, n = 2))
+        time.sleep(0.5)
+        self.assertEqual(transport.call(request('echo', n = 3))['result'], { 'n': 3 })
+
+    # calls in flight fail when the connection is dropped
+    def test_drop_fails_pending_calls(self):
+        transport = self.connect(StandInServer(), pool_size = 1, timeout = 5)
+        handle = transport.send(request('sleep', delay = 1))
+        transport.send(request('drop'))
+        self.assertRaises(TransportError, transport.wait, handle)
+
+    def test_reconnect_after_drop(self):
+        transport = self.connect(StandInServer(), pool_size = 2, timeout = 5)
+        self.assertEqual(transport.call_many([ request('echo', n = n) for n in range(2) ])[1]['result'], { 'n': 1 })
+        self.assertEqual(self.server.nb_accepted, 2)
+        self.server.drop_all()
+        # wait for the transport to notice
+        deadline = time.time() + 2
+        while (any(conn.alive for conn in transport.connections) and time.time() < deadline):
+            time.sleep(0.01)
+        self.assertEqual([ response['result']['n'] for response in transport.call_many([ request('echo', n = n) for n in range(4) ]) ], list(range(4)))
+        self.assertEqual(self.server.nb_accepted, 4)
+
+    def test_connection_refused(self):
+        server = StandInServer()
+        port = server.port
+        server.close()
+        transport = TCPTransport('127.0.0.1', port, connect_timeout = 1)
+        self.assertRaises(TransportError, transport.call, request('echo'))
+        transport.close()
+
+if __name__ == '__main__':
+    unittest.main()